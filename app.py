@@ -4,7 +4,7 @@
 ╚══════════════════════════════════════════════════════════════════════════════╝
 """
 
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session, send_file
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session, send_file, Response, stream_with_context
 import sqlite3
 from datetime import datetime, timedelta
 import random
@@ -15,6 +15,9 @@ import os
 import json
 import threading
 import requests
+import uuid
+import secrets
+from collections import OrderedDict, defaultdict
 
 app = Flask(__name__)
 app.secret_key = 'smart_retail_secret_key_2024'
@@ -162,7 +165,9 @@ check_gpu_for_yolo()
 # ═══════════════════════════════════════════════════════════════════════════════
 MODEL_FOLDER = 'models'
 os.makedirs(MODEL_FOLDER, exist_ok=True)
-KIOSK_CART = []
+SCAN_RESULTS = OrderedDict()  # idempotency key → (body, status) scan terakhir - replay spool scanner tidak dobel
+SCAN_RESULTS_MAX = 10000
+SCAN_LOCK = threading.Lock()
 STORE_CONFIG = {'name': 'SMART KIOSK', 'address': 'Jl. Teknik Informatika No. 1', 'phone': '021-1234567'}
 
 def get_db_connection():
@@ -184,13 +189,184 @@ def init_db():
 
 init_db()
 
+# ═══════════════════════════════════════════════════════════════════════════════
+#                           📦 KATALOG PRODUK (CACHE)
+# ═══════════════════════════════════════════════════════════════════════════════
+class ProductCatalog:
+    """Salinan tabel produk di memori: index barcode → produk dan id → produk.
+
+    Dimuat sekali saat start, lalu di-patch oleh setiap jalur tulis (tambah/hapus
+    barang, upload Excel, checkout). Setiap perubahan menaikkan `version`.
+    Kalau toko.db diubah dari luar app.py, panggil load() lagi.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.by_id = {}
+        self.by_barcode = {}
+        self.version = 0
+        self._mapping = (-1, {})  # (version, barcode → nama) untuk /api/product_mapping
+
+    def load(self):
+        conn = get_db_connection()
+        rows = conn.execute('SELECT * FROM produk').fetchall()
+        conn.close()
+        by_id = {row['id']: dict(row) for row in rows}
+        with self.lock:
+            self.by_id = by_id
+            self.by_barcode = {str(p['barcode']).strip(): p for p in by_id.values() if p['barcode']}
+            self.version += 1
+
+    def refresh(self, produk_id):
+        """Baca ulang satu produk dari DB (setelah INSERT)"""
+        conn = get_db_connection()
+        row = conn.execute('SELECT * FROM produk WHERE id = ?', (produk_id,)).fetchone()
+        conn.close()
+        with self.lock:
+            self._drop(produk_id)
+            if row:
+                produk = dict(row)
+                self.by_id[produk['id']] = produk
+                if produk['barcode']: self.by_barcode[str(produk['barcode']).strip()] = produk
+            self.version += 1
+
+    def remove(self, produk_id):
+        with self.lock:
+            self._drop(produk_id)
+            self.version += 1
+
+    def adjust_stock(self, changes):
+        """{id: selisih stok} - dipanggil setelah UPDATE stok di DB sudah commit"""
+        with self.lock:
+            for produk_id, delta in changes.items():
+                produk = self.by_id.get(produk_id)
+                if produk: produk['stok'] += delta
+            self.version += 1
+
+    def _drop(self, produk_id):
+        produk = self.by_id.pop(produk_id, None)
+        if produk and produk['barcode']: self.by_barcode.pop(str(produk['barcode']).strip(), None)
+
+    def get(self, produk_id):
+        try:
+            return self.by_id.get(int(produk_id))
+        except (TypeError, ValueError):
+            return None
+
+    def find(self, barcode):
+        return self.by_barcode.get(barcode)
+
+    def mapping(self):
+        """barcode → nama produk, dibangun ulang hanya kalau versi katalog berubah"""
+        version, mapping = self._mapping
+        if version != self.version:
+            with self.lock:
+                version = self.version
+                mapping = {code: p['nama_barang'] for code, p in self.by_barcode.items()}
+            self._mapping = (version, mapping)
+        return version, mapping
+
+CATALOG = ProductCatalog()
+CATALOG.load()
+
+# ═══════════════════════════════════════════════════════════════════════════════
+#                           🛒 KERANJANG PER LANE
+# ═══════════════════════════════════════════════════════════════════════════════
+DEFAULT_LANE = 'default'
+
+class Cart:
+    """Keranjang satu lane/kiosk: item per id produk, total & versi diupdate tiap perubahan"""
+
+    def __init__(self, store, lane):
+        self.store = store
+        self.lane = lane
+        self.items = {}  # id produk → {'id', 'nama', 'harga', 'jumlah', 'subtotal', 'barcode'}
+        self.total_bayar = 0
+        self.total_items = 0
+        self.version = 0
+
+    def qty(self, produk_id):
+        item = self.items.get(produk_id)
+        return item['jumlah'] if item else 0
+
+    def add(self, produk, jumlah=1):
+        with self.store.lock:
+            return self.set(produk, self.qty(produk['id']) + jumlah)
+
+    def set(self, produk, jumlah):
+        """Ubah jumlah produk → None, atau sisa stok kalau tidak cukup"""
+        jumlah = max(jumlah, 0)
+        with self.store.lock:
+            sisa = self.store.available(produk, self)
+            if jumlah > sisa:
+                return sisa
+            self._put(produk['id'], jumlah, produk)
+
+    def remove(self, produk_id):
+        with self.store.lock:
+            if produk_id in self.items: self._put(produk_id, 0)
+
+    def clear(self):
+        with self.store.lock:
+            for produk_id in list(self.items):
+                self._put(produk_id, 0)
+
+    def _put(self, produk_id, jumlah, produk=None):
+        item = self.items.get(produk_id)
+        if item is None:
+            item = self.items[produk_id] = {'id': produk['id'], 'nama': produk['nama_barang'], 'harga': produk['harga'], 'jumlah': 0, 'subtotal': 0, 'barcode': produk['barcode']}
+        delta = jumlah - item['jumlah']
+        self.total_items += delta
+        self.total_bayar += delta * item['harga']
+        self.store.reserved[produk_id] += delta
+        item['jumlah'], item['subtotal'] = jumlah, jumlah * item['harga']
+        if jumlah <= 0: del self.items[produk_id]
+        self.version += 1
+
+    def snapshot(self):
+        with self.store.lock:
+            return {'keranjang': [dict(item) for item in self.items.values()], 'total_bayar': self.total_bayar,
+                    'jumlah_item': len(self.items), 'total_items': self.total_items,
+                    'lane': self.lane, 'version': self.store.token(self)}
+
+class CartStore:
+    """Semua keranjang aktif (per lane scanner / per sesi browser) + stok yang sedang dipesan"""
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.carts = {}
+        self.reserved = defaultdict(int)  # id produk → jumlah di semua keranjang
+        self.epoch = uuid.uuid4().hex[:8]  # Token versi tidak bentrok setelah app restart
+
+    def get(self, lane=None):
+        lane = str(lane) if lane not in (None, '') else DEFAULT_LANE
+        with self.lock:
+            cart = self.carts.get(lane)
+            if cart is None: cart = self.carts[lane] = Cart(self, lane)
+            return cart
+
+    def available(self, produk, cart):
+        """Stok yang masih bisa masuk `cart` (stok dikurangi isi keranjang lane lain)"""
+        return produk['stok'] - (self.reserved[produk['id']] - cart.qty(produk['id']))
+
+    def token(self, cart):
+        return f"{self.epoch}-{cart.lane}-{cart.version}"
+
+CARTS = CartStore()
+
+def current_cart(data=None):
+    """Keranjang untuk request ini: field 'lane' (JSON/form/query) → lane di session → default"""
+    lane = (data or {}).get('lane') or request.values.get('lane') or session.get('lane')
+    return CARTS.get(lane)
+
 @app.route('/')
 def index():
+    if request.args.get('lane'): session['lane'] = request.args['lane']  # /?lane=2 → browser ini kiosk lane 2
     conn = get_db_connection()
     produk = conn.execute('SELECT * FROM produk ORDER BY nama_barang').fetchall()
     conn.close()
-    total_bayar = sum(item['subtotal'] for item in KIOSK_CART)
-    return render_template('index.html', produk=produk, keranjang=KIOSK_CART, total_bayar=total_bayar, store=STORE_CONFIG)
+    cart = current_cart()
+    return render_template('index.html', produk=produk, keranjang=list(cart.items.values()), total_bayar=cart.total_bayar, store=STORE_CONFIG)
 
 @app.route('/dashboard')
 def dashboard():
@@ -235,45 +411,68 @@ def riwayat():
 
 @app.route('/api/get_keranjang')
 def get_keranjang():
-    total_bayar = sum(item['subtotal'] for item in KIOSK_CART)
-    total_items = sum(item['jumlah'] for item in KIOSK_CART)
-    return jsonify({'keranjang': KIOSK_CART, 'total_bayar': total_bayar, 'jumlah_item': len(KIOSK_CART), 'total_items': total_items})
+    cart = current_cart()
+    if request.args.get('since') == CARTS.token(cart):
+        return jsonify({'unchanged': True, 'version': request.args['since']})
+    return jsonify(cart.snapshot())
 
 @app.route('/api/product_mapping')
 def product_mapping():
-    conn = get_db_connection()
-    products = conn.execute('SELECT barcode, nama_barang FROM produk').fetchall()
-    conn.close()
-    mapping = {str(p['barcode']).strip(): p['nama_barang'] for p in products if p['barcode']}
-    return jsonify(mapping)
+    version, mapping = CATALOG.mapping()
+    response = jsonify(mapping)
+    response.set_etag(f'catalog-{version}')
+    return response.make_conditional(request)
 
 @app.route('/api/scan', methods=['POST'])
 def api_scan():
-    data = request.json
-    kode_barcode = str(data.get('code', '')).strip()
+    data = request.json or {}
+    key = data.get('key')
+    code = str(data.get('code', '')).strip()
+    with SCAN_LOCK:
+        if key and key in SCAN_RESULTS:
+            body, status = SCAN_RESULTS[key]
+            return jsonify(dict(body, duplicate=True)), status
+        body, status = scan_barcode(code, CATALOG.find(code), CARTS.get(data.get('lane')))
+        remember_scan(key, body, status)
+    return jsonify(body), status
+
+@app.route('/api/scan/batch', methods=['POST'])
+def api_scan_batch():
+    """Banyak scan sekaligus (frame multi-barcode, replay spool) → hasil per event, urutan sama"""
+    events = (request.json or {}).get('events')
+    if not isinstance(events, list) or not all(isinstance(event, dict) for event in events):
+        return jsonify({'status': 'error', 'message': 'events harus berupa list objek'}), 400
+    codes = [str(event.get('code', '')).strip() for event in events]
+    # Satu lock untuk seluruh batch: cek stok + update keranjang tidak diselingi request lain
+    with SCAN_LOCK:
+        results = []
+        for event, code in zip(events, codes):
+            key = event.get('key')
+            if key and key in SCAN_RESULTS:
+                body, status = SCAN_RESULTS[key]
+                body = dict(body, duplicate=True)
+            else:
+                body, status = scan_barcode(code, CATALOG.find(code), CARTS.get(event.get('lane')))
+                remember_scan(key, body, status)
+            results.append(dict(body, code=code, key=key, lane=event.get('lane'), http_status=status))
+    return jsonify({'status': 'success', 'results': results})
+
+def remember_scan(key, body, status):
+    if key:
+        SCAN_RESULTS[key] = (body, status)
+        if len(SCAN_RESULTS) > SCAN_RESULTS_MAX: SCAN_RESULTS.popitem(last=False)
+
+def scan_barcode(kode_barcode, produk, cart):
+    """Satu scan ke keranjang lane (produk sudah dicari) → (body JSON, status HTTP)"""
     if not kode_barcode:
-        return jsonify({'status': 'error', 'message': 'Kode kosong'}), 400
-    conn = get_db_connection()
-    produk = conn.execute('SELECT * FROM produk WHERE barcode = ?', (kode_barcode,)).fetchone()
-    conn.close()
+        return {'status': 'error', 'message': 'Kode kosong'}, 400
     if produk:
-        qty_in_cart = 0
-        target_item = None
-        for item in KIOSK_CART:
-            if item['id'] == produk['id']:
-                qty_in_cart = item['jumlah']
-                target_item = item
-                break
-        if (qty_in_cart + 1) > produk['stok']:
-            return jsonify({'status': 'error', 'message': f'Stok tidak cukup! Sisa: {produk["stok"]}'}), 400
-        if target_item:
-            target_item['jumlah'] += 1
-            target_item['subtotal'] = target_item['jumlah'] * target_item['harga']
-        else:
-            KIOSK_CART.append({'id': produk['id'], 'nama': produk['nama_barang'], 'harga': produk['harga'], 'jumlah': 1, 'subtotal': produk['harga'], 'barcode': produk['barcode']})
-        return jsonify({'status': 'success', 'nama': produk['nama_barang'], 'harga': produk['harga']})
+        sisa = cart.add(produk)
+        if sisa is not None:
+            return {'status': 'error', 'message': f'Stok tidak cukup! Sisa: {sisa}'}, 400
+        return {'status': 'success', 'nama': produk['nama_barang'], 'harga': produk['harga']}, 200
     else:
-        return jsonify({'status': 'error', 'message': f'Barang tidak terdaftar ({kode_barcode})'}), 404
+        return {'status': 'error', 'message': f'Barang tidak terdaftar ({kode_barcode})'}, 404
 
 @app.route('/api/cart/add', methods=['POST'])
 def cart_add():
@@ -284,51 +483,20 @@ def cart_add():
     if not produk_id:
         return jsonify({'status': 'error', 'message': 'ID produk tidak valid'}), 400
     
-    conn = get_db_connection()
-    produk = conn.execute('SELECT * FROM produk WHERE id = ?', (produk_id,)).fetchone()
-    conn.close()
-    
-    if not produk:
+    produk_dict = CATALOG.get(produk_id)
+    if not produk_dict:
         return jsonify({'status': 'error', 'message': 'Produk tidak ditemukan'}), 404
     
-    produk_dict = dict(produk)
-    produk_id_val = produk_dict.get('id', 0)
-    produk_nama = produk_dict.get('nama_barang', 'Unknown')
-    produk_harga = produk_dict.get('harga', 0)
-    produk_stok = produk_dict.get('stok', 0)
-    produk_barcode = produk_dict.get('barcode', '')
-    
-    target_item = None
-    current_qty = 0
-    for item in KIOSK_CART:
-        if item.get('id') == produk_id_val:
-            target_item = item
-            current_qty = item.get('jumlah', 0)
-            break
-    
-    if (current_qty + jumlah) > produk_stok:
-        return jsonify({'status': 'error', 'message': f'Stok tidak cukup! Sisa: {produk_stok}'}), 400
-    
-    if target_item:
-        target_item['jumlah'] += jumlah
-        target_item['subtotal'] = target_item.get('jumlah', 1) * target_item.get('harga', 0)
-    else:
-        KIOSK_CART.append({
-            'id': produk_id_val, 
-            'nama': produk_nama, 
-            'harga': produk_harga, 
-            'jumlah': jumlah, 
-            'subtotal': produk_harga * jumlah, 
-            'barcode': produk_barcode
-        })
+    sisa = current_cart(data).add(produk_dict, jumlah)
+    if sisa is not None:
+        return jsonify({'status': 'error', 'message': f'Stok tidak cukup! Sisa: {sisa}'}), 400
     return jsonify({'status': 'success'})
 
 @app.route('/api/cart/remove', methods=['POST'])
 def cart_remove():
     data = request.json or {}
     produk_id = data.get('produk_id')
-    global KIOSK_CART
-    KIOSK_CART = [item for item in KIOSK_CART if item.get('id') != produk_id]
+    current_cart(data).remove(produk_id)
     return jsonify({'status': 'success'})
 
 @app.route('/api/cart/update', methods=['POST'])
@@ -338,18 +506,11 @@ def cart_update():
     jumlah = data.get('jumlah', 1)
     if jumlah < 1:
         return cart_remove()
-    conn = get_db_connection()
-    produk = conn.execute('SELECT stok FROM produk WHERE id = ?', (produk_id,)).fetchone()
-    conn.close()
-    if produk:
-        produk_stok = dict(produk).get('stok', 0)
-        if jumlah > produk_stok:
+    produk = CATALOG.get(produk_id)
+    cart = current_cart(data)
+    if produk and produk['id'] in cart.items:
+        if cart.set(produk, jumlah) is not None:
             return jsonify({'status': 'error', 'message': f'Stok tidak cukup!'}), 400
-    for item in KIOSK_CART:
-        if item.get('id') == produk_id:
-            item['jumlah'] = jumlah
-            item['subtotal'] = item.get('harga', 0) * jumlah
-            break
     return jsonify({'status': 'success'})
 
 @app.route('/api/telegram/test', methods=['POST'])
@@ -381,35 +542,84 @@ def open_scanner():
     data = request.json
     mode = data.get('mode', 'webcam')
     custom_url = data.get('url', '')
+    headless = data.get('headless', False)
     
     # Build command arguments
     cmd = [sys.executable, 'scanner.py', '--mode', mode]
     if mode == 'custom' and custom_url:
         cmd.extend(['--url', custom_url])
+    if headless:
+        # Tanpa jendela OpenCV - preview lewat MJPEG (port 9108) di modal browser
+        cmd.append('--headless')
+    env = dict(os.environ, SCANNER_CONTROL_TOKEN=SCANNER_CONTROL['token'])
     
     try:
         # Run scanner in background (non-blocking)
         if os.name == 'nt':  # Windows
-            subprocess.Popen(cmd, creationflags=subprocess.CREATE_NEW_CONSOLE)
+            subprocess.Popen(cmd, env=env, creationflags=subprocess.CREATE_NEW_CONSOLE)
         else:  # Linux/Mac
-            subprocess.Popen(cmd)
+            subprocess.Popen(cmd, env=env)
         return jsonify({'status': 'success', 'message': 'Scanner dibuka!'})
     except Exception as e:
         return jsonify({'status': 'error', 'message': str(e)})
 
 
 
+# Kontrol scanner (127.0.0.1:9108) tidak dibuka ke browser langsung: halaman kasir lewat proxy
+# di bawah (origin sama), token perintah hanya diketahui Flask dan proses scanner yang ia jalankan
+SCANNER_CONTROL = {
+    'url': os.environ.get('SCANNER_CONTROL_URL', 'http://127.0.0.1:9108'),
+    'token': os.environ.get('SCANNER_CONTROL_TOKEN') or secrets.token_urlsafe(16),
+}
+SCANNER_COMMANDS = ('reload', 'sync', 'detect', 'metrics', 'quit')
+
+@app.route('/scanner/command/<name>', methods=['POST'])
+def scanner_command(name):
+    if name not in SCANNER_COMMANDS:
+        return jsonify({'status': 'error', 'message': 'Perintah tidak dikenal'}), 404
+    try:
+        r = requests.post(f"{SCANNER_CONTROL['url']}/command/{name}",
+                          headers={'X-Scanner-Token': SCANNER_CONTROL['token']}, timeout=3)
+    except requests.RequestException:
+        return jsonify({'status': 'error', 'message': 'Scanner tidak berjalan'}), 502
+    if r.status_code != 200:
+        return jsonify({'status': 'error', 'message': f'Scanner menolak perintah ({r.status_code})'}), 502
+    return jsonify(r.json())
+
+@app.route('/scanner/stream.mjpg')
+def scanner_stream():
+    try:
+        r = requests.get(f"{SCANNER_CONTROL['url']}/stream.mjpg", stream=True, timeout=(3, 30))
+    except requests.RequestException:
+        return 'Scanner tidak berjalan', 502
+
+    def relay():
+        # Viewer menutup modal → generator ditutup → koneksi ke scanner ikut ditutup
+        try:
+            for chunk in r.iter_content(chunk_size=16384):
+                yield chunk
+        finally:
+            r.close()
+    return Response(stream_with_context(relay()), content_type=r.headers.get('Content-Type'),
+                    headers={'Cache-Control': 'no-cache'})
+
 @app.route('/reset_keranjang')
 def reset_keranjang():
-    KIOSK_CART.clear()
+    current_cart().clear()
     flash('Keranjang dikosongkan', 'info')
     return redirect(url_for('index'))
 
 @app.route('/checkout', methods=['POST'])
 def checkout():
     uang_bayar = int(request.form.get('uang_bayar', 0))
-    total_tagihan = sum(item['subtotal'] for item in KIOSK_CART)
-    if not KIOSK_CART:
+    cart = current_cart()
+    with CARTS.lock:  # Scan yang masuk selama checkout menunggu, tidak ikut terhapus
+        return checkout_cart(cart, uang_bayar)
+
+def checkout_cart(cart, uang_bayar):
+    items = [dict(item) for item in cart.items.values()]
+    total_tagihan = cart.total_bayar
+    if not items:
         flash('Keranjang kosong!', 'warning')
         return redirect(url_for('index'))
     if uang_bayar < total_tagihan:
@@ -423,7 +633,7 @@ def checkout():
     conn = get_db_connection()
     try:
         detail_list = []
-        for item in KIOSK_CART:
+        for item in items:
             item_id = item.get('id', 0)
             item_jumlah = item.get('jumlah', 1)
             item_nama = item.get('nama', 'Unknown')
@@ -436,13 +646,14 @@ def checkout():
         detail_str = ", ".join(detail_list)
         conn.execute('INSERT INTO riwayat (trx_id, waktu, detail, total_belanja, uang_bayar, kembalian) VALUES (?, ?, ?, ?, ?, ?)', (trx_id, waktu_str, detail_str, total_tagihan, uang_bayar, kembalian))
         conn.commit()
-        notify_transaction(trx_id, KIOSK_CART.copy(), total_tagihan, uang_bayar, kembalian)
+        CATALOG.adjust_stock({item.get('id', 0): -item.get('jumlah', 1) for item in items})
+        notify_transaction(trx_id, items, total_tagihan, uang_bayar, kembalian)
         low_stock_threshold = TELEGRAM_CONFIG.get('low_stock_threshold', 5)
         low_stock = conn.execute('SELECT nama_barang, stok FROM produk WHERE stok < ?', (low_stock_threshold,)).fetchall()
         if low_stock:
             notify_low_stock([dict(p) for p in low_stock])
-        session['last_trx'] = {'id': trx_id, 'waktu': waktu_str, 'items': KIOSK_CART.copy(), 'total': total_tagihan, 'bayar': uang_bayar, 'kembalian': kembalian}
-        KIOSK_CART.clear()
+        session['last_trx'] = {'id': trx_id, 'waktu': waktu_str, 'items': items, 'total': total_tagihan, 'bayar': uang_bayar, 'kembalian': kembalian}
+        cart.clear()
         flash('Transaksi berhasil!', 'success')
     except Exception as e:
         conn.rollback()
@@ -455,9 +666,10 @@ def checkout():
 def tambah_barang():
     try:
         conn = get_db_connection()
-        conn.execute('INSERT INTO produk (nama_barang, harga, stok, barcode) VALUES (?, ?, ?, ?)', (request.form['nama'], request.form['harga'], request.form['stok'], request.form['barcode']))
+        cursor = conn.execute('INSERT INTO produk (nama_barang, harga, stok, barcode) VALUES (?, ?, ?, ?)', (request.form['nama'], request.form['harga'], request.form['stok'], request.form['barcode']))
         conn.commit()
         conn.close()
+        CATALOG.refresh(cursor.lastrowid)
         flash('Barang berhasil ditambahkan!', 'success')
     except sqlite3.IntegrityError:
         flash('Error: Barcode sudah digunakan!', 'danger')
@@ -469,6 +681,7 @@ def hapus_barang(id):
     conn.execute('DELETE FROM produk WHERE id = ?', (id,))
     conn.commit()
     conn.close()
+    CATALOG.remove(id)
     flash('Barang dihapus', 'info')
     return redirect(request.referrer or url_for('index'))
 
@@ -499,6 +712,7 @@ def upload_excel():
                     count_sukses += 1
             conn.commit()
             conn.close()
+            CATALOG.load()  # Banyak baris sekaligus → muat ulang seluruh katalog
             flash(f'Berhasil memproses {count_sukses} data!', 'success')
         except Exception as e:
             flash(f'Gagal: {str(e)}', 'danger')
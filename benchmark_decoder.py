@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+"""
+╔══════════════════════════════════════════════════════════════════════════════╗
+║     🧩 SMART RETAIL - BARCODE DECODER BENCHMARK                              ║
+║══════════════════════════════════════════════════════════════════════════════║
+║  Membandingkan decode barcode pada frame yang sudah direkam:                 ║
+║  1. backend - pyzbar / opencv (cv2.barcode) / zxing-cpp, satu panggilan      ║
+║  2. tiled   - frame dipecah jadi tile overlap, didecode paralel              ║
+╚══════════════════════════════════════════════════════════════════════════════╝
+
+CARA PAKAI:
+-----------
+1. Simpan beberapa frame kamera (.jpg/.png) ke satu folder, misal 'bench_frames'
+2. Jalankan: python benchmark_decoder.py --frames bench_frames
+3. Simulasi kamera IP 1080p: python benchmark_decoder.py --frames bench_frames --resize 1920x1080
+4. Pilih backend tercepat per lane, lalu set BARCODE_BACKEND di ScannerConfig
+
+Opsi --workers, --tile dan --overlap menimpa nilai BARCODE_* di ScannerConfig.
+Secara default hanya simbologi BARCODE_SYMBOLOGIES yang didecode; pakai
+--all-symbologies untuk melihat selisih waktu tanpa filter.
+
+CORPUS SINTETIS (regression gate):
+----------------------------------
+1. python generate_barcodes.py --out synth_barcodes
+2. python benchmark_decoder.py --corpus synth_barcodes --save-baseline baseline.json
+3. Setelah mengubah decoder: python benchmark_decoder.py --corpus synth_barcodes --baseline baseline.json
+   → exit code 1 kalau decode rate suatu bucket turun > --tolerance atau ms/frame
+     naik lebih dari --max-slowdown kali
+"""
+
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+
+import cv2
+
+from scanner import CONFIG, BARCODE_BACKENDS, TiledBarcodeDecoder, make_barcode_engine
+
+
+def load_frames(folder, resize=None):
+    """Baca semua gambar di folder sebagai grayscale (opsional di-resize)"""
+    paths = sorted(p for ext in ('*.jpg', '*.jpeg', '*.png') for p in glob.glob(os.path.join(folder, ext)))
+    frames = []
+    for path in paths:
+        img = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+        if img is None:
+            continue
+        if resize:
+            img = cv2.resize(img, resize, interpolation=cv2.INTER_LINEAR)
+        frames.append(img)
+    return frames
+
+
+def run_engine(name, decode, frames, repeat):
+    """Decode semua frame `repeat` kali → ms/frame, decodes/detik, hit rate"""
+    decode(frames[0])  # warm-up (pool start, cache)
+    hits = 0
+    codes = 0
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for frame in frames:
+            results = decode(frame)
+            hits += bool(results)
+            codes += len(results)
+    elapsed = time.perf_counter() - start
+    total = repeat * len(frames)
+    return {
+        'name': name,
+        'ms': elapsed * 1000 / total,
+        'fps': total / elapsed if elapsed > 0 else 0,
+        'hit_rate': hits / total,
+        'codes': codes / total,
+    }
+
+
+def load_corpus(folder):
+    """Frame grayscale + entry ground_truth.json dari generate_barcodes.py"""
+    with open(os.path.join(folder, "ground_truth.json")) as f:
+        truth = json.load(f)
+    corpus = []
+    for entry in truth["frames"]:
+        img = cv2.imread(os.path.join(folder, entry["file"]), cv2.IMREAD_GRAYSCALE)
+        if img is not None:
+            corpus.append((entry, img))
+    return corpus
+
+
+def run_corpus(decode, corpus):
+    """Per bucket distorsi: decode rate, false positive, ms/frame (+ baris 'all')"""
+    decode(corpus[0][1])  # warm-up
+    buckets = {}
+    for entry, gray in corpus:
+        start = time.perf_counter()
+        found = {r.code for r in decode(gray)}
+        ms = (time.perf_counter() - start) * 1000
+        expected = {bc["code"] for bc in entry["barcodes"]}
+        for name in (entry["bucket"], "all"):
+            b = buckets.setdefault(name, {"frames": 0, "expected": 0, "decoded": 0, "false": 0, "ms": 0.0})
+            b["frames"] += 1
+            b["expected"] += len(expected)
+            b["decoded"] += len(expected & found)
+            b["false"] += len(found - expected)
+            b["ms"] += ms
+    for b in buckets.values():
+        b["rate"] = b["decoded"] / b["expected"] if b["expected"] else 0.0
+        b["ms"] /= b["frames"]
+    return buckets
+
+
+def print_corpus_report(name, buckets):
+    print(f"\n📊 {name}")
+    print(f"{'Bucket':<14}{'frames':>8}{'decode':>9}{'false':>7}{'ms/frame':>10}")
+    print("─" * 48)
+    for bucket, b in sorted(buckets.items(), key=lambda kv: kv[0] == "all"):
+        print(f"{bucket:<14}{b['frames']:>8}{b['rate']*100:>8.1f}%{b['false']:>7}{b['ms']:>10.2f}")
+
+
+def check_baseline(results, baseline, tolerance, max_slowdown):
+    """→ daftar regresi (backend, bucket, alasan) dibanding baseline"""
+    regressions = []
+    for backend, buckets in baseline.items():
+        if backend not in results:
+            regressions.append((backend, "-", "backend tidak ada di run ini (tidak terinstall / dilewati)"))
+            continue
+        for bucket, base in buckets.items():
+            current = results[backend].get(bucket)
+            if current is None:
+                regressions.append((backend, bucket, "bucket tidak ada di corpus ini"))
+                continue
+            if current["rate"] < base["rate"] - tolerance:
+                regressions.append((backend, bucket, f"decode {base['rate']*100:.1f}% → {current['rate']*100:.1f}%"))
+            if base["ms"] > 0 and current["ms"] > base["ms"] * max_slowdown:
+                regressions.append((backend, bucket, f"{base['ms']:.2f} → {current['ms']:.2f} ms/frame"))
+    return regressions
+
+
+def corpus_main(args, backend_names):
+    corpus = load_corpus(args.corpus)
+    if not corpus:
+        print(f"❌ Corpus kosong: '{args.corpus}'")
+        return 1
+    print(f"\n🏷️ Corpus {args.corpus}: {len(corpus)} frame | engine {CONFIG.BARCODE_ENGINE}")
+
+    results = {}
+    for name in backend_names:
+        # Stage barcode scanner.py apa adanya (engine single/tiled, simbologi dari CONFIG)
+        CONFIG.BARCODE_BACKEND = name
+        engine = make_barcode_engine()
+        try:
+            results[name] = run_corpus(engine, corpus)
+        finally:
+            if hasattr(engine, "close"): engine.close()
+        print_corpus_report(f"{name} ({CONFIG.BARCODE_ENGINE})", results[name])
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\n💾 Baseline tersimpan: {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = check_baseline(results, baseline, args.tolerance, args.max_slowdown)
+        if regressions:
+            print(f"\n❌ {len(regressions)} regresi vs {args.baseline}:")
+            for backend, bucket, reason in regressions:
+                print(f"   {backend}/{bucket}: {reason}")
+            return 1
+        print(f"\n✅ Tidak ada regresi vs {args.baseline}")
+    return 0
+
+
+def print_report(title, results):
+    baseline = results[0]['ms']
+    print(f"\n{title}")
+    print(f"{'Engine':<28}{'ms/frame':>10}{'frames/s':>10}{'hit rate':>10}{'codes/f':>9}{'speedup':>9}")
+    print("─" * 76)
+    for r in results:
+        speedup = baseline / r['ms'] if r['ms'] > 0 else 0
+        print(f"{r['name']:<28}{r['ms']:>10.2f}{r['fps']:>10.1f}{r['hit_rate']*100:>9.1f}%{r['codes']:>9.2f}{speedup:>8.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Barcode decoder benchmark')
+    parser.add_argument('--frames', default='bench_frames', help='Folder berisi frame .jpg/.png')
+    parser.add_argument('--resize', help='Resize frame, misal 1920x1080')
+    parser.add_argument('--repeat', type=int, default=3, help='Berapa kali semua frame didecode')
+    parser.add_argument('--workers', type=int, default=CONFIG.BARCODE_WORKERS)
+    parser.add_argument('--tile', type=int, default=CONFIG.BARCODE_TILE)
+    parser.add_argument('--overlap', type=int, default=CONFIG.BARCODE_TILE_OVERLAP, help='Default: BARCODE_MAX_WIDTH + 10%%')
+    parser.add_argument('--backends', default=','.join(BARCODE_BACKENDS), help='Daftar backend, pisah koma')
+    parser.add_argument('--all-symbologies', action='store_true', help='Tanpa filter simbologi')
+    parser.add_argument('--skip-tiled', action='store_true', help='Hanya bandingkan backend')
+    parser.add_argument('--corpus', help='Folder dari generate_barcodes.py (decode rate per bucket distorsi)')
+    parser.add_argument('--engine', choices=['single', 'tiled'], default=CONFIG.BARCODE_ENGINE, help='Engine untuk --corpus')
+    parser.add_argument('--baseline', help='JSON baseline → exit 1 kalau ada regresi')
+    parser.add_argument('--save-baseline', help='Simpan hasil --corpus sebagai baseline')
+    parser.add_argument('--tolerance', type=float, default=0.02, help='Batas turun decode rate (absolut)')
+    parser.add_argument('--max-slowdown', type=float, default=1.5, help='Batas naik ms/frame (kali lipat)')
+    args = parser.parse_args()
+
+    symbologies = () if args.all_symbologies else CONFIG.BARCODE_SYMBOLOGIES
+    CONFIG.BARCODE_SYMBOLOGIES = symbologies
+    CONFIG.BARCODE_WORKERS, CONFIG.BARCODE_TILE, CONFIG.BARCODE_TILE_OVERLAP = args.workers, args.tile, args.overlap
+    CONFIG.BARCODE_ENGINE = args.engine
+    backends = []
+    for name in args.backends.split(','):
+        cls = BARCODE_BACKENDS.get(name.strip())
+        if cls is None or not cls.available:
+            print(f"⏭️ Backend '{name.strip()}' tidak tersedia - dilewati")
+            continue
+        backends.append(cls(symbologies))
+    if not backends:
+        print("❌ Tidak ada backend barcode yang terinstall")
+        return
+
+    if args.corpus:
+        sys.exit(corpus_main(args, [b.name for b in backends]))
+
+    resize = tuple(int(v) for v in args.resize.lower().split('x')) if args.resize else None
+    frames = load_frames(args.frames, resize)
+    if not frames:
+        print(f"❌ Tidak ada frame di '{args.frames}'")
+        return
+
+    h, w = frames[0].shape[:2]
+    print(f"\n📷 {len(frames)} frame ({w}x{h}) x {args.repeat} repeat")
+    print(f"🏷️ Simbologi: {', '.join(symbologies) if symbologies else 'semua'}")
+
+    results = [run_engine(f"{b.name} (1x full frame)", b.decode, frames, args.repeat) for b in backends]
+    print_report("📊 BACKEND", results)
+
+    if args.skip_tiled:
+        return
+
+    # Tiled engine memakai backend tercepat, dibanding single call backend yang sama
+    fastest = min(results, key=lambda r: r['ms'])
+    backend = backends[results.index(fastest)]
+    CONFIG.BARCODE_BACKEND = backend.name
+    tiled = [fastest]
+    for pool in ("thread", "process"):
+        engine = TiledBarcodeDecoder(workers=args.workers, tile=args.tile, overlap=args.overlap, pool=pool)
+        if pool == "thread":
+            print(f"\n🧩 Tile {engine.tile}px, overlap {engine.overlap}px, {args.workers} worker, backend {backend.name}")
+        try:
+            tiled.append(run_engine(f"tiled ({pool} x{args.workers})", engine, frames, args.repeat))
+        finally:
+            engine.close()
+
+    print_report("📊 SINGLE vs TILED", tiled)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+"""
+╔══════════════════════════════════════════════════════════════════════════════╗
+║     🏷️ SMART RETAIL - GENERATOR FRAME BARCODE SINTETIS                       ║
+║══════════════════════════════════════════════════════════════════════════════║
+║  Script ini akan:                                                            ║
+║  1. Ambil barcode produk dari toko.db (EAN-13 / EAN-8 / Code128)             ║
+║  2. Render barcode ke gambar background (folder atau background acak)       ║
+║  3. Beri distorsi: blur, perspective, glare, rotation, scale                 ║
+║  4. Simpan frame + ground_truth.json (kode, simbologi, distorsi, posisi)     ║
+╚══════════════════════════════════════════════════════════════════════════════╝
+
+CARA PAKAI:
+-----------
+1. Generate corpus:  python generate_barcodes.py --out synth_barcodes --frames 600
+2. Ukur decoder:     python benchmark_decoder.py --corpus synth_barcodes
+3. Simpan baseline:  python benchmark_decoder.py --corpus synth_barcodes --save-baseline baseline.json
+4. Regression gate:  python benchmark_decoder.py --corpus synth_barcodes --baseline baseline.json
+
+Simbologi dipilih dari isi barcode: 13 digit dengan checksum valid → EAN-13,
+8 digit valid → EAN-8, selain itu → Code128. Seed tetap (--seed) supaya corpus
+yang sama bisa dibuat ulang di mesin lain.
+"""
+
+import argparse
+import glob
+import json
+import os
+import random
+import sqlite3
+
+import cv2
+import numpy as np
+
+from scanner import AI_TO_BARCODE_MAP
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+#                              ⚙️ KONFIGURASI
+# ═══════════════════════════════════════════════════════════════════════════════
+
+GEN_CONFIG = {
+    "db": "toko.db",
+    "frame_size": (640, 480),
+    "module_px": (2, 4),              # Lebar 1 modul barcode (px) sebelum distorsi
+    "jpeg_quality": 90,
+}
+
+# Bucket distorsi → setiap frame hanya mendapat satu jenis distorsi
+BUCKETS = ("clean", "blur", "perspective", "glare", "rotation", "scale")
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+#                         📦 ENCODER EAN-13 / EAN-8 / CODE128
+# ═══════════════════════════════════════════════════════════════════════════════
+
+EAN_L = ["0001101", "0011001", "0010011", "0111101", "0100011",
+         "0110001", "0101111", "0111011", "0110111", "0001011"]
+EAN_R = ["".join("1" if b == "0" else "0" for b in code) for code in EAN_L]
+EAN_G = [code[::-1] for code in EAN_R]
+EAN13_PARITY = ["LLLLLL", "LLGLGG", "LLGGLG", "LLGGGL", "LGLLGG",
+                "LGGLLG", "LGGGLL", "LGLGLG", "LGLGGL", "LGGLGL"]
+
+# Lebar bar/space Code128 untuk nilai 0..106 (106 = stop)
+CODE128 = """212222 222122 222221 121223 121322 131222 122213 122312 132212 221213
+221312 231212 112232 122132 122231 113222 123122 123221 223211 221132
+221231 213212 223112 312131 311222 321122 321221 312212 322112 322211
+212123 212321 232121 111323 131123 131321 112313 132113 132311 211313
+231113 231311 112133 112331 132131 113123 113321 133121 313121 211331
+231131 213113 213311 213131 311123 311321 331121 312113 312311 332111
+314111 221411 431111 111224 111422 121124 121421 141122 141221 112214
+112412 122114 122411 142112 142211 241211 221114 413111 241112 134111
+111242 121142 121241 114212 124112 124211 411212 421112 421211 212141
+214121 412121 111143 111341 131141 114113 114311 411113 411311 113141
+114131 311141 411131 211412 211214 211232 2331112""".split()
+CODE128_START_B = 104
+
+
+def ean_checksum(digits):
+    """Check digit untuk data EAN (tanpa check digit)"""
+    total = sum(int(d) * (3 if (len(digits) - i) % 2 == 1 else 1) for i, d in enumerate(digits))
+    return str((10 - total % 10) % 10)
+
+
+def symbology_of(code):
+    if code.isdigit() and len(code) in (8, 13) and ean_checksum(code[:-1]) == code[-1]:
+        return "EAN13" if len(code) == 13 else "EAN8"
+    return "CODE128"
+
+
+def encode_ean13(code):
+    parity = EAN13_PARITY[int(code[0])]
+    left = "".join((EAN_L if p == "L" else EAN_G)[int(d)] for p, d in zip(parity, code[1:7]))
+    right = "".join(EAN_R[int(d)] for d in code[7:])
+    return "101" + left + "01010" + right + "101"
+
+
+def encode_ean8(code):
+    return "101" + "".join(EAN_L[int(d)] for d in code[:4]) + "01010" + "".join(EAN_R[int(d)] for d in code[4:]) + "101"
+
+
+def encode_code128(code):
+    values = [CODE128_START_B] + [ord(c) - 32 for c in code]
+    checksum = (values[0] + sum(i * v for i, v in enumerate(values[1:], 1))) % 103
+    modules = ""
+    for value in values + [checksum, 106]:
+        for i, width in enumerate(CODE128[value]):
+            modules += ("1" if i % 2 == 0 else "0") * int(width)
+    return modules
+
+
+def encode(code, symbology):
+    return {"EAN13": encode_ean13, "EAN8": encode_ean8, "CODE128": encode_code128}[symbology](code)
+
+
+def render_label(code, symbology, module_px):
+    """Label putih dengan barcode + teks (quiet zone 10 modul) → BGR uint8"""
+    modules = np.array([c == "1" for c in encode(code, symbology)], dtype=bool)
+    quiet = 10
+    bar_h = max(40, int(len(modules) * module_px * 0.35))
+    width = (len(modules) + 2 * quiet) * module_px
+    label = np.full((bar_h + 2 * quiet * module_px // 2 + 22, width, 3), 255, dtype=np.uint8)
+    bars = np.repeat(modules, module_px)
+    top = quiet * module_px // 2
+    label[top:top + bar_h, quiet * module_px:quiet * module_px + len(bars)][:, bars] = 0
+    cv2.putText(label, code, (quiet * module_px, top + bar_h + 17), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 0), 1)
+    return label
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+#                         🎨 BACKGROUND + DISTORSI
+# ═══════════════════════════════════════════════════════════════════════════════
+
+def load_codes(db_path):
+    """Barcode produk dari toko.db, fallback ke AI_TO_BARCODE_MAP + EAN contoh"""
+    codes = []
+    if os.path.exists(db_path):
+        conn = sqlite3.connect(db_path)
+        codes = [r[0] for r in conn.execute("SELECT barcode FROM produk WHERE barcode IS NOT NULL AND barcode != ''")]
+        conn.close()
+    if not codes:
+        print(f"⚠️ Tidak ada barcode di '{db_path}' - pakai AI_TO_BARCODE_MAP + EAN contoh")
+        codes = list(AI_TO_BARCODE_MAP.values()) + ["8992761111113", "4006381333931", "96385074"]
+    # Code128 set B hanya ASCII 32..126
+    return [c for c in dict.fromkeys(codes) if all(32 <= ord(ch) < 127 for ch in c)]
+
+
+def random_background(size, rng, backgrounds):
+    w, h = size
+    if backgrounds:
+        img = cv2.imread(rng.choice(backgrounds))
+        if img is not None:
+            return cv2.resize(img, (w, h), interpolation=cv2.INTER_AREA)
+    # Gradient + noise seperti meja kasir
+    base = rng.randint(60, 200)
+    gradient = np.linspace(0, rng.randint(20, 60), w, dtype=np.float32)[None, :, None]
+    noise = np.random.default_rng(rng.randint(0, 2**31)).normal(0, 8, (h, w, 3)).astype(np.float32)
+    tint = np.array([rng.uniform(0.8, 1.2) for _ in range(3)], dtype=np.float32)
+    return np.clip((base + gradient + noise) * tint, 0, 255).astype(np.uint8)
+
+
+def place_label(frame, label, bucket, rng):
+    """Tempel label dengan homography → (frame, quad 4 titik, params distorsi)"""
+    fh, fw = frame.shape[:2]
+    lh, lw = label.shape[:2]
+    params = {}
+    scale = 1.0
+    if bucket == "scale":
+        scale = rng.choice([rng.uniform(0.35, 0.6), rng.uniform(1.3, 1.8)])
+        params["scale"] = round(scale, 2)
+    scale = min(scale, 0.9 * fw / lw, 0.9 * fh / lh)
+    src = np.float32([[0, 0], [lw, 0], [lw, lh], [0, lh]])
+    dst = src * scale
+
+    if bucket == "rotation":
+        angle = rng.uniform(-60, 60)
+        params["angle"] = round(angle, 1)
+        center = dst.mean(axis=0)
+        rot = cv2.getRotationMatrix2D(tuple(map(float, center)), angle, 1.0)
+        dst = (np.hstack([dst, np.ones((4, 1), np.float32)]) @ rot.T).astype(np.float32)
+    elif bucket == "perspective":
+        strength = rng.uniform(0.1, 0.3)
+        params["perspective"] = round(strength, 2)
+        jitter = np.float32([[rng.uniform(-1, 1), rng.uniform(-1, 1)] for _ in range(4)])
+        dst = dst + jitter * strength * np.float32([lw * scale, lh * scale])
+
+    # Geser ke posisi acak yang masih di dalam frame
+    dst -= dst.min(axis=0)
+    span = dst.max(axis=0)
+    if span[0] >= fw or span[1] >= fh:
+        dst *= 0.9 * min(fw / span[0], fh / span[1])
+        span = dst.max(axis=0)
+    dst += np.float32([rng.uniform(0, fw - span[0]), rng.uniform(0, fh - span[1])])
+
+    matrix = cv2.getPerspectiveTransform(src, dst)
+    warped = cv2.warpPerspective(label, matrix, (fw, fh), flags=cv2.INTER_LINEAR)
+    mask = cv2.warpPerspective(np.full((lh, lw), 255, np.uint8), matrix, (fw, fh), flags=cv2.INTER_LINEAR)
+    alpha = (mask.astype(np.float32) / 255)[..., None]
+    frame = (warped * alpha + frame * (1 - alpha)).astype(np.uint8)
+    return frame, dst, params
+
+
+def add_glare(frame, quad, rng):
+    """Pantulan lampu: blob putih elips di atas label"""
+    h, w = frame.shape[:2]
+    cx, cy = quad.mean(axis=0) + np.float32([rng.uniform(-0.3, 0.3), rng.uniform(-0.3, 0.3)]) * (quad.max(axis=0) - quad.min(axis=0))
+    radius = rng.uniform(0.15, 0.35) * float(np.ptp(quad[:, 0]))
+    strength = rng.uniform(0.5, 0.9)
+    yy, xx = np.mgrid[0:h, 0:w].astype(np.float32)
+    blob = np.exp(-(((xx - cx) / radius) ** 2 + ((yy - cy) / (radius * 0.6)) ** 2))[..., None] * strength
+    frame = (frame * (1 - blob) + 255 * blob).astype(np.uint8)
+    return frame, {"glare": round(strength, 2), "glare_radius": round(radius, 1)}
+
+
+def add_blur(frame, rng):
+    if rng.random() < 0.5:
+        sigma = rng.uniform(1.0, 2.5)
+        return cv2.GaussianBlur(frame, (0, 0), sigma), {"blur": "gaussian", "sigma": round(sigma, 2)}
+    length = rng.randint(5, 13)
+    kernel = np.zeros((length, length), np.float32)
+    kernel[length // 2, :] = 1.0 / length
+    angle = rng.uniform(0, 180)
+    kernel = cv2.warpAffine(kernel, cv2.getRotationMatrix2D((length / 2 - 0.5, length / 2 - 0.5), angle, 1.0), (length, length))
+    kernel /= kernel.sum()
+    return cv2.filter2D(frame, -1, kernel), {"blur": "motion", "length": length, "angle": round(angle, 1)}
+
+
+def generate_frame(codes, bucket, rng, backgrounds, size, per_frame):
+    frame = random_background(size, rng, backgrounds)
+    truth = []
+    params = {}
+    for code in rng.sample(codes, min(per_frame, len(codes))):
+        symbology = symbology_of(code)
+        label = render_label(code, symbology, rng.randint(*GEN_CONFIG["module_px"]))
+        frame, quad, p = place_label(frame, label, bucket, rng)
+        params.update(p)
+        if bucket == "glare":
+            frame, p = add_glare(frame, quad, rng)
+            params.update(p)
+        truth.append({"code": code, "symbology": symbology, "quad": np.round(quad, 1).tolist()})
+    if bucket == "blur":
+        frame, p = add_blur(frame, rng)
+        params.update(p)
+    return frame, truth, params
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generator frame barcode sintetis + ground truth')
+    parser.add_argument('--out', default='synth_barcodes', help='Folder output')
+    parser.add_argument('--frames', type=int, default=600, help='Jumlah frame (dibagi rata ke semua bucket)')
+    parser.add_argument('--db', default=GEN_CONFIG['db'])
+    parser.add_argument('--backgrounds', help='Folder gambar background (default: background acak)')
+    parser.add_argument('--per-frame', type=int, default=1, help='Barcode per frame')
+    parser.add_argument('--buckets', default=','.join(BUCKETS), help='Bucket distorsi, pisah koma')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    codes = load_codes(args.db)
+    buckets = [b.strip() for b in args.buckets.split(',') if b.strip() in BUCKETS]
+    backgrounds = sorted(p for ext in ('*.jpg', '*.jpeg', '*.png') for p in glob.glob(os.path.join(args.backgrounds, ext))) if args.backgrounds else []
+    rng = random.Random(args.seed)
+    os.makedirs(args.out, exist_ok=True)
+
+    print(f"🏷️ {len(codes)} barcode | {args.frames} frame | bucket: {', '.join(buckets)}")
+    truth = {"size": list(GEN_CONFIG["frame_size"]), "seed": args.seed, "frames": []}
+    for i in range(args.frames):
+        bucket = buckets[i % len(buckets)]
+        frame, barcodes, params = generate_frame(codes, bucket, rng, backgrounds, GEN_CONFIG["frame_size"], args.per_frame)
+        name = f"{i:05d}_{bucket}.jpg"
+        cv2.imwrite(os.path.join(args.out, name), frame, [cv2.IMWRITE_JPEG_QUALITY, GEN_CONFIG["jpeg_quality"]])
+        truth["frames"].append({"file": name, "bucket": bucket, "params": params, "barcodes": barcodes})
+
+    with open(os.path.join(args.out, "ground_truth.json"), 'w') as f:
+        json.dump(truth, f, indent=1)
+    print(f"✅ {args.frames} frame + ground_truth.json → {args.out}")
+
+
+if __name__ == "__main__":
+    main()
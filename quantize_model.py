@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+"""
+╔══════════════════════════════════════════════════════════════════════════════╗
+║     🗜️ SMART RETAIL - INT8 QUANTIZATION + LAPORAN AKURASI/LATENCY            ║
+║══════════════════════════════════════════════════════════════════════════════║
+║  Script ini akan:                                                            ║
+║  1. Export best.pt ke FP32 (ONNX / OpenVINO) - pakai cache scanner.py        ║
+║  2. Kalibrasi & quantize ke INT8 dengan gambar dari dataset_kasir            ║
+║  3. Bandingkan mAP per kelas (validation split) FP32 vs INT8                 ║
+║  4. Bandingkan latency per frame di CPU                                      ║
+║  5. Beri peringatan kalau akurasi kelas turun melewati batas                 ║
+╚══════════════════════════════════════════════════════════════════════════════╝
+
+CARA PAKAI:
+-----------
+1. Training dulu (python setup_and_train.py) sampai ada best.pt dan data.yaml
+2. Jalankan: python quantize_model.py
+3. Di scanner.py set:  INFERENCE_PRECISION: str = "int8"
+
+Model INT8 disimpan di EXPORT_CACHE_DIR dengan key hash bobot yang sama seperti
+export FP32, jadi scanner langsung memuatnya tanpa export ulang.
+"""
+
+import argparse
+import glob
+import json
+import os
+import random
+import shutil
+import time
+
+import cv2
+import numpy as np
+
+from scanner import (CONFIG, ONNXRUNTIME_AVAILABLE, OPENVINO_AVAILABLE, CPUDetector,
+                     export_cache_path, export_for_cpu, letterbox, replace_artifact)
+from setup_and_train import (INPUT_FOLDER, OUTPUT_BASE, print_error, print_header,
+                             print_info, print_step, print_success, print_warning)
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+#                              ⚙️ KONFIGURASI
+# ═══════════════════════════════════════════════════════════════════════════════
+
+QUANT_CONFIG = {
+    "weights": CONFIG.YOLO_MODEL,
+    "data_yaml": f"{OUTPUT_BASE}/data.yaml",
+    "calib_images": 100,              # Jumlah gambar kalibrasi dari dataset_kasir
+    "latency_images": 50,             # Jumlah gambar untuk ukur latency
+    "max_class_drop": 0.03,           # Batas turun mAP50-95 per kelas (absolut)
+    "report_dir": "runs/quantize",
+}
+
+
+def list_images(folder):
+    return sorted(p for ext in ('*.jpg', '*.jpeg', '*.png') for p in glob.glob(os.path.join(folder, ext)))
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+#                          STEP 2: QUANTIZE INT8
+# ═══════════════════════════════════════════════════════════════════════════════
+
+def quantize_onnx(fp32_path, int8_path, calib_images):
+    """Static QDQ quantization, kalibrasi dengan gambar dataset_kasir"""
+    from onnxruntime.quantization import CalibrationDataReader, QuantFormat, QuantType, quantize_static
+    import onnxruntime as ort
+
+    input_name = ort.InferenceSession(fp32_path, providers=["CPUExecutionProvider"]).get_inputs()[0].name
+
+    class KasirCalibrationReader(CalibrationDataReader):
+        def __init__(self, paths):
+            self.paths = iter(paths)
+
+        def get_next(self):
+            for path in self.paths:
+                img = cv2.imread(path)
+                if img is not None:
+                    blob, _, _ = letterbox(img, CONFIG.INFERENCE_IMGSZ)
+                    return {input_name: blob}
+            return None
+
+    # Hanya Conv yang di-quantize: head deteksi (concat/DFL) tetap FP32 supaya box tidak bergeser
+    quantize_static(fp32_path, int8_path, KasirCalibrationReader(calib_images),
+                    quant_format=QuantFormat.QDQ, per_channel=True,
+                    activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8,
+                    op_types_to_quantize=["Conv"])
+
+
+def calibration_yaml(model, calib_images, folder):
+    """data.yaml yang split train/val-nya persis gambar kalibrasi sampel (sama dengan jalur ONNX)"""
+    os.makedirs(folder, exist_ok=True)
+    with open(os.path.join(folder, "calib.txt"), 'w') as f:
+        f.write("\n".join(os.path.abspath(p) for p in calib_images) + "\n")
+    path = os.path.join(folder, "calib.yaml")
+    with open(path, 'w') as f:
+        # JSON juga YAML yang valid - tidak perlu pyyaml
+        json.dump({'path': os.path.abspath(folder), 'train': 'calib.txt', 'val': 'calib.txt',
+                   'names': [model.names[k] for k in sorted(model.names)]}, f, indent=2)
+    return path
+
+def quantize_openvino(weights, int8_path, calib_images):
+    """NNCF post-training quantization lewat export ultralytics, kalibrasi dengan gambar dataset_kasir"""
+    from ultralytics import YOLO
+    model = YOLO(weights)
+    data_yaml = calibration_yaml(model, calib_images, os.path.join(QUANT_CONFIG['report_dir'], "calib"))
+    exported = model.export(format="openvino", int8=True, data=data_yaml,
+                            imgsz=CONFIG.INFERENCE_IMGSZ, device="cpu")
+    replace_artifact(exported, int8_path)
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+#                          STEP 3 & 4: EVALUASI
+# ═══════════════════════════════════════════════════════════════════════════════
+
+def evaluate_map(artifact, data_yaml):
+    """mAP50 total + mAP50-95 per kelas pada validation split → dict atau None"""
+    if not os.path.exists(data_yaml):
+        return None
+    from ultralytics import YOLO
+    metrics = YOLO(artifact, task="detect").val(data=data_yaml, imgsz=CONFIG.INFERENCE_IMGSZ, batch=1,
+                                                 device="cpu", plots=False, verbose=False)
+    return {
+        'map50': float(metrics.box.map50),
+        'map': float(metrics.box.map),
+        'per_class': {metrics.names[i]: float(v) for i, v in enumerate(metrics.box.maps)},
+    }
+
+
+def measure_latency(artifact, runtime, images):
+    """ms per frame lewat CPUDetector (sama persis dengan jalur scanner)"""
+    detector = CPUDetector(artifact, runtime)
+    frames = [img for img in (cv2.imread(p) for p in images) if img is not None]
+    for frame in frames[:3]:
+        detector.detect(frame, CONFIG.CONFIDENCE_DISPLAY)  # warm-up
+    times = []
+    for frame in frames:
+        start = time.perf_counter()
+        detector.detect(frame, CONFIG.CONFIDENCE_DISPLAY)
+        times.append((time.perf_counter() - start) * 1000)
+    return {'mean_ms': float(np.mean(times)), 'p95_ms': float(np.percentile(times, 95))} if times else None
+
+
+def print_report(report, max_drop):
+    print_header("📊 LAPORAN FP32 vs INT8")
+    fp32, int8 = report['fp32'], report['int8']
+    if fp32['latency'] and int8['latency']:
+        speedup = fp32['latency']['mean_ms'] / int8['latency']['mean_ms']
+        print(f"  Latency  FP32 {fp32['latency']['mean_ms']:.1f} ms (p95 {fp32['latency']['p95_ms']:.1f})"
+              f" | INT8 {int8['latency']['mean_ms']:.1f} ms (p95 {int8['latency']['p95_ms']:.1f}) | {speedup:.2f}x")
+
+    if not (fp32['accuracy'] and int8['accuracy']):
+        print_warning("data.yaml tidak ditemukan - mAP tidak dihitung")
+        return
+
+    print(f"  mAP50    FP32 {fp32['accuracy']['map50']:.3f} | INT8 {int8['accuracy']['map50']:.3f}")
+    print(f"  mAP50-95 FP32 {fp32['accuracy']['map']:.3f} | INT8 {int8['accuracy']['map']:.3f}\n")
+    print(f"  {'Kelas':<24}{'FP32':>8}{'INT8':>8}{'Turun':>8}")
+    for name, drop in report['class_drop'].items():
+        flag = "  ⚠️" if drop > max_drop else ""
+        print(f"  {name:<24}{fp32['accuracy']['per_class'][name]:>8.3f}{int8['accuracy']['per_class'][name]:>8.3f}{drop:>8.3f}{flag}")
+
+    if report['warnings']:
+        print()
+        for name in report['warnings']:
+            print_warning(f"Kelas '{name}' turun {report['class_drop'][name]:.3f} (> {max_drop}) - pertimbangkan tetap FP32")
+    else:
+        print()
+        print_success(f"Semua kelas turun <= {max_drop} - aman pakai INT8")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='INT8 quantization YOLO untuk CPU')
+    parser.add_argument('--weights', default=QUANT_CONFIG['weights'])
+    parser.add_argument('--data', default=QUANT_CONFIG['data_yaml'], help='data.yaml (validation split)')
+    parser.add_argument('--runtime', choices=['onnx', 'openvino'], default='onnx' if ONNXRUNTIME_AVAILABLE else 'openvino')
+    parser.add_argument('--calib', type=int, default=QUANT_CONFIG['calib_images'])
+    parser.add_argument('--max-drop', type=float, default=QUANT_CONFIG['max_class_drop'])
+    args = parser.parse_args()
+
+    print_header("🗜️ INT8 QUANTIZATION")
+    if not os.path.exists(args.weights):
+        print_error(f"Bobot tidak ditemukan: {args.weights}")
+        return
+    if (args.runtime == 'onnx' and not ONNXRUNTIME_AVAILABLE) or (args.runtime == 'openvino' and not OPENVINO_AVAILABLE):
+        print_error(f"Runtime {args.runtime} tidak terinstall (pip install -r requirements-cpu.txt)")
+        return
+
+    images = list_images(INPUT_FOLDER)
+    if not images:
+        print_error(f"Tidak ada gambar di '{INPUT_FOLDER}' untuk kalibrasi")
+        return
+    random.seed(0)
+    calib_images = random.sample(images, min(args.calib, len(images)))
+    latency_images = random.sample(images, min(QUANT_CONFIG['latency_images'], len(images)))
+
+    print_step(1, "EXPORT FP32")
+    fp32_path = export_for_cpu(args.weights, args.runtime)
+    if fp32_path is None:
+        return
+    print_success(fp32_path)
+
+    print_step(2, f"QUANTIZE INT8 ({len(calib_images)} gambar kalibrasi)")
+    int8_path = export_cache_path(args.weights, args.runtime, "int8")
+    if args.runtime == 'onnx':
+        quantize_onnx(fp32_path, int8_path, calib_images)
+    else:
+        quantize_openvino(args.weights, int8_path, calib_images)
+    shutil.copy(fp32_path + ".names.json", int8_path + ".names.json")
+    print_success(int8_path)
+
+    print_step(3, "EVALUASI mAP (validation split)")
+    report = {'weights': args.weights, 'runtime': args.runtime, 'imgsz': CONFIG.INFERENCE_IMGSZ,
+              'fp32': {'artifact': fp32_path}, 'int8': {'artifact': int8_path}}
+    for key in ('fp32', 'int8'):
+        report[key]['accuracy'] = evaluate_map(report[key]['artifact'], args.data)
+
+    print_step(4, f"UKUR LATENCY ({len(latency_images)} frame, {CONFIG.INFERENCE_THREADS} thread)")
+    for key in ('fp32', 'int8'):
+        report[key]['latency'] = measure_latency(report[key]['artifact'], args.runtime, latency_images)
+
+    report['class_drop'] = {}
+    if report['fp32']['accuracy'] and report['int8']['accuracy']:
+        for name, value in report['fp32']['accuracy']['per_class'].items():
+            report['class_drop'][name] = value - report['int8']['accuracy']['per_class'].get(name, 0.0)
+    report['warnings'] = [name for name, drop in report['class_drop'].items() if drop > args.max_drop]
+
+    print_step(5, "LAPORAN")
+    print_report(report, args.max_drop)
+
+    os.makedirs(QUANT_CONFIG['report_dir'], exist_ok=True)
+    report_path = os.path.join(QUANT_CONFIG['report_dir'], os.path.basename(int8_path) + ".report.json")
+    with open(report_path, 'w') as f:
+        json.dump(report, f, indent=2)
+    print_info(f"Laporan tersimpan: {report_path}")
+    print_info('Aktifkan di scanner.py: INFERENCE_PRECISION: str = "int8"')
+
+
+if __name__ == "__main__":
+    main()
@@ -8,30 +8,69 @@ import os
 os.environ["KMP_DUPLICATE_LIB_OK"] = "TRUE"
 
 import sys
+import glob
+import json
+import re
+import shutil
+import hashlib
+import hmac
+import secrets
+import sqlite3
+import uuid
 import cv2
 import numpy as np
 import requests
 import time
 import threading
 import platform
+import signal
+import queue
+import multiprocessing as mp
+from multiprocessing import shared_memory
 from datetime import datetime
-from dataclasses import dataclass, field
-from typing import Optional, Tuple, Dict, List
-from collections import deque
+from dataclasses import dataclass, field, replace
+from typing import Optional, Tuple, Dict, List, Callable
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
 # ═══════════════════════════════════════════════════════════════════════════════
 #                         📦 DEPENDENCY CHECK
 # ═══════════════════════════════════════════════════════════════════════════════
 PYZBAR_AVAILABLE = False
+ZBarSymbol = None
 try:
-    from pyzbar.pyzbar import decode as pyzbar_decode
+    from pyzbar.pyzbar import decode as pyzbar_decode, ZBarSymbol
     PYZBAR_AVAILABLE = True
 except ImportError:
-    print("⚠️ pyzbar not installed - barcode scanning disabled")
+    print("⚠️ pyzbar not installed - falling back to zxing-cpp / cv2.barcode if available")
     print("   Install: pip install pyzbar")
-    def pyzbar_decode(image):
+    def pyzbar_decode(image, symbols=None):
         return []
 
+# Optional extra barcode backends (see BARCODE_BACKENDS)
+ZXING_AVAILABLE = False
+try:
+    import zxingcpp
+    ZXING_AVAILABLE = True
+except ImportError:
+    zxingcpp = None
+
+# CPU inference runtimes for YOLO (see INFERENCE_BACKEND)
+ONNXRUNTIME_AVAILABLE = False
+try:
+    import onnxruntime as ort
+    ONNXRUNTIME_AVAILABLE = True
+except ImportError:
+    ort = None
+
+OPENVINO_AVAILABLE = False
+try:
+    import openvino as ov
+    OPENVINO_AVAILABLE = True
+except ImportError:
+    ov = None
+
 # ═══════════════════════════════════════════════════════════════════════════════
 #                         🔥 GPU/AI CHECK - SEBELUM LOAD AI
 # ═══════════════════════════════════════════════════════════════════════════════
@@ -148,70 +187,498 @@ class ScannerConfig:
     FRAME_HEIGHT: int = 480
     YOLO_MODEL: str = "runs/train/retail_custom/weights/best.pt"
     YOLO_MODEL_DEFAULT: str = "yolo11l.pt"
+    INFERENCE_BACKEND: str = "auto"    # "torch" (CUDA/MPS), "onnx", "openvino", "auto" = torch on GPU else CPU runtime
+    INFERENCE_IMGSZ: int = 640         # Lower it (e.g. 416) when CHECKOUT_ZONE is much smaller than the frame
+    INFERENCE_THREADS: int = max(1, (os.cpu_count() or 2) // 2)  # Intra-op threads of the CPU runtime
+    INFERENCE_PRECISION: str = "fp32"  # "int8" = quantized artifact from quantize_model.py
+    INFERENCE_DYNAMIC_BATCH: bool = False  # Export with a dynamic batch axis so multi-lane batches run in one CPU call
+    EXPORT_CACHE_DIR: str = "models/export_cache"
+    CHECKOUT_ZONE: Tuple[Tuple[int, int], ...] = ()  # Polygon/rect corners in frame pixels, () = full frame
+    CHECKOUT_ZONE_FILE: str = "checkout_zone.json"   # Zone drawn on the scanner window is saved here
+    DETECT_MAPPED_ONLY: bool = True    # YOLO classes= limited to classes in AI_TO_BARCODE_MAP
+    MAX_DET: int = 20                  # Max boxes per frame after NMS
     CONFIDENCE_AUTO_INPUT: float = 0.80  # Lowered from 0.80 for easier detection
     CONFIDENCE_SUGGESTION: float = 0.45
     CONFIDENCE_DISPLAY: float = 0.35
     COOLDOWN_SAME_ITEM: float = 2.0
     COOLDOWN_DIFFERENT_ITEM: float = 0.3
     API_URL: str = "http://127.0.0.1:5000/api/scan"
+    API_BATCH_URL: str = "http://127.0.0.1:5000/api/scan/batch"  # One call per drain round (falls back to API_URL)
+    SUBMIT_COALESCE_MS: float = 30.0   # Scans this close together are posted as one round
+    SUBMIT_TIMEOUT: float = 2.0
+    SPOOL_FILE: str = "scan_spool.db"  # Scans wait here until /api/scan answers (survives restarts)
+    SPOOL_BATCH: int = 32              # Spool rows per drain round
+    SPOOL_MAX_ROWS: int = 10000        # Oldest rows dropped beyond this
+    SPOOL_RETRY_MAX: float = 10.0      # Offline retry delay doubles from 0.5s up to this
     SYNC_URL: str = "http://127.0.0.1:5000/api/product_mapping"
+    CAMERA_RING_SIZE: int = 8          # Preallocated frames in ThreadedCamera
+    MJPEG_READER: bool = True          # http(s) camera URLs via MJPEGCamera instead of cv2.VideoCapture
+    MJPEG_STALL_TIMEOUT: float = 2.0   # Seconds without a JPEG → stall, reconnect
+    MJPEG_BACKOFF_MAX: float = 8.0     # Reconnect delay doubles from 0.25s up to this
+    MJPEG_BARCODE_REDUCED: int = 0     # Barcode gray decoded straight from the JPEG at 1/N (1/2/4/8), 0 = cvtColor of the frame
+    PIPELINE_QUEUE_SIZE: int = 2       # Per-stage queue, oldest frame dropped when full
+    PIPELINE_MAX_RESULT_AGE: int = 1   # Frames between a result and the shown frame (0 = same frame only)
+    PIPELINE_LOCKSTEP: bool = False    # Every stage finishes a frame before the next is taken (set by --replay-fast)
+    LANES: Tuple[Tuple[str, str], ...] = ()  # Multi-lane: (lane id, camera source), e.g. (("1", "http://.../video"), ("2", "0"))
+    LANE_BATCH_MAX: int = 8            # Frames per shared YOLO call
+    LANE_BATCH_WAIT_MS: float = 5.0    # How long the first lane waits for others to join a batch
+    FRAME_BUS_SLOTS: int = 8           # --multiprocess: frames in the shared-memory ring
+    FRAME_BUS_POLL: float = 0.002      # Seconds between worker polls for a newer frame
+    RECORD_FPS: float = 30.0           # --record video rate
+    DETECT_MODE: str = "track"         # "track" = YOLO every N frames + optical flow, "every" = YOLO every frame
+    DETECT_STRIDE_MIN: int = 2
+    DETECT_STRIDE_MAX: int = 15
+    DETECT_BUDGET: float = 0.5         # Fraction of frame time the detector may use → stride N
+    TRACK_IOU_MATCH: float = 0.3
+    TRACK_MAX_MISSES: int = 1          # Detector runs a track may go unmatched before it is dropped
+    MOTION_GATE: bool = True           # Skip barcode + YOLO while the counter is static
+    MOTION_SIZE: Tuple[int, int] = (80, 60)
+    MOTION_PIXEL_DIFF: int = 20        # Gray levels vs background to count a pixel as moving
+    MOTION_MIN_AREA: float = 0.01      # Fraction of moving pixels that wakes the lane
+    MOTION_BG_ALPHA: float = 0.05      # Running background update rate
+    MOTION_HOLD: float = 1.5           # Seconds the lane stays active after the last motion
+    MOTION_IDLE_RENDER_EVERY: int = 5  # While idle only every Nth frame is drawn
+    BARCODE_ROI: bool = True           # Decode around the last hit instead of the full frame
+    BARCODE_ROI_MARGIN: float = 0.6    # ROI grows by this fraction of the last rect on each side
+    BARCODE_ROI_MIN_PAD: int = 40      # ...and by at least this many pixels
+    BARCODE_FULL_SWEEP_EVERY: int = 10 # Full-frame decode every N frames even while the ROI hits
+    BARCODE_UPSCALE_BELOW: int = 200   # ROI smaller than this (px, shorter side) is upscaled
+    BARCODE_UPSCALE: float = 2.0
+    BARCODE_BACKEND: str = "pyzbar"    # "pyzbar", "opencv" (cv2.barcode) or "zxing" (zxing-cpp)
+    BARCODE_SYMBOLOGIES: Tuple[str, ...] = ("EAN13", "EAN8", "CODE128")  # () = all symbologies
+    BARCODE_ENGINE: str = "single"     # "single" = one pyzbar call, "tiled" = overlapping tiles in a pool
+    BARCODE_POOL: str = "thread"       # "thread" (pyzbar releases the GIL) or "process"
+    BARCODE_WORKERS: int = max(1, (os.cpu_count() or 2) - 1)
+    BARCODE_TILE: int = 640            # Tile side in pixels (raised to 2x the overlap)
+    BARCODE_MAX_WIDTH: int = 320       # Widest expected barcode in frame pixels → tile overlap
+    BARCODE_TILE_OVERLAP: Optional[int] = None  # None = BARCODE_MAX_WIDTH + 10% quiet zone
+    BARCODE_FALLBACK_SIDE: int = 960   # Tiles found nothing → one pass on the frame downscaled to this
+    QUALITY_CONTROL: bool = True       # Trade detail for speed to hold TARGET_FPS / LATENCY_BUDGET_MS
+    TARGET_FPS: float = 20.0           # Capped at the camera rate (a 15 fps IP cam is not "too slow")
+    LATENCY_BUDGET_MS: float = 150.0   # decode + YOLO time per frame
+    QUALITY_INTERVAL: float = 1.0      # Seconds between controller decisions
+    QUALITY_RESTORE_AFTER: int = 5     # Calm intervals in a row before one level is restored
+    # Ladder, best first: (detect stride factor, YOLO imgsz, barcode decode scale, overlay detail 2/1/0)
+    QUALITY_LEVELS: Tuple[Tuple[int, int, float, int], ...] = (
+        (1, 640, 1.0, 2), (2, 640, 1.0, 2), (2, 512, 1.0, 1), (3, 416, 0.75, 1), (4, 320, 0.5, 0))
+    METRICS_WINDOW: int = 512          # Samples per stage for rolling p50/p95/p99
+    CONTROL_HOST: str = "127.0.0.1"    # "0.0.0.0" lets a fleet dashboard scrape this lane
+    CONTROL_PORT: int = 9108           # /metrics, /stream.mjpg, /command/<name>, 0 = off
+    CONTROL_TOKEN: str = os.environ.get("SCANNER_CONTROL_TOKEN", "")  # X-Scanner-Token for /command/*, "" = random per run
+    PREVIEW_FPS: float = 5.0           # MJPEG preview rate (only encoded while a viewer is connected)
+    PREVIEW_JPEG_QUALITY: int = 70
 
 CONFIG = ScannerConfig()
 
 class ThreadedCamera:
-    def __init__(self, src=0):
+    """
+    Capture thread writing into a preallocated ring of FRAME_WIDTH x FRAME_HEIGHT
+    frames. Frame `seq` lives in ring[seq % ring_size]; read_new() hands out a
+    read-only view of that slot, valid until ring_size - 1 newer frames arrive.
+    """
+    def __init__(self, src=0, ring_size=None):
         self.src = src
         self.stream = None
-        self.frame = None
+        self.ring_size = ring_size or CONFIG.CAMERA_RING_SIZE
+        self.ring = np.empty((self.ring_size, CONFIG.FRAME_HEIGHT, CONFIG.FRAME_WIDTH, 3), dtype=np.uint8)
+        self.seq = 0  # 0 = no frame yet
         self.stopped = False
-        self.lock = threading.Lock()
+        self.cond = threading.Condition()
+        self.grab_timer = LatencyHistogram()  # stream.read() incl. JPEG/H.264 decode
         
     def start(self):
         self.stream = cv2.VideoCapture(self.src)
         self.stream.set(cv2.CAP_PROP_FRAME_WIDTH, CONFIG.FRAME_WIDTH)
         self.stream.set(cv2.CAP_PROP_FRAME_HEIGHT, CONFIG.FRAME_HEIGHT)
         self.stream.set(cv2.CAP_PROP_BUFFERSIZE, 1)
-        _, self.frame = self.stream.read()
+        self._grab()
         threading.Thread(target=self.update, daemon=True).start()
         return self
 
+    def _grab(self):
+        slot = self.ring[(self.seq + 1) % self.ring_size]
+        t0 = time.perf_counter()
+        # Decodes straight into the slot when the camera already delivers the configured size
+        grabbed, frame = self.stream.read(slot)
+        if not grabbed or frame is None:
+            return False
+        self.grab_timer.time(t0)
+        if not np.shares_memory(frame, slot):
+            if frame.shape == slot.shape: np.copyto(slot, frame)
+            else: cv2.resize(frame, (CONFIG.FRAME_WIDTH, CONFIG.FRAME_HEIGHT), dst=slot)
+        with self.cond:
+            self.seq += 1
+            self.cond.notify_all()
+        return True
+
     def update(self):
         while not self.stopped:
-            if self.stream:
-                grabbed, frame = self.stream.read()
-                if grabbed:
-                    with self.lock:
-                        self.frame = frame
-            time.sleep(0.01)
+            if not self.stream or not self._grab():
+                time.sleep(0.01)
+
+    def _view(self, seq):
+        view = self.ring[seq % self.ring_size].view()
+        view.flags.writeable = False
+        return view
+
+    @property
+    def frame(self):
+        return self._view(self.seq) if self.seq else None
 
     def read(self):
-        with self.lock:
-            return self.frame.copy() if self.frame is not None else None
+        with self.cond:
+            return self.ring[self.seq % self.ring_size].copy() if self.seq else None
+
+    def read_new(self, after_seq=0, timeout=1.0):
+        """Block until a frame newer than after_seq exists → (seq, read-only view)"""
+        with self.cond:
+            self.cond.wait_for(lambda: self.seq > after_seq or self.stopped, timeout)
+            if self.seq <= after_seq:
+                return after_seq, None
+            seq = self.seq
+        return seq, self._view(seq)
+
+    def is_fresh(self, seq):
+        """False once the slot of `seq` may have been overwritten by newer frames"""
+        return self.seq - seq < self.ring_size - 1
+
+    def clock(self, seq):
+        """Capture time of frame `seq` - cooldowns and the motion gate run on this clock"""
+        return time.time()
+
+    def gray(self, seq):
+        """Grayscale of frame `seq` cheaper than cvtColor, None if the source has none"""
+        return None
+
+    def metrics(self) -> Dict[str, float]:
+        return {'frames': self.seq}
 
     def stop(self):
         self.stopped = True
+        with self.cond:
+            self.cond.notify_all()
         if self.stream: self.stream.release()
 
+# ═══════════════════════════════════════════════════════════════════════════════
+#                     📡 MJPEG CAMERA - NEWEST JPEG ONLY, LAZY DECODE
+# ═══════════════════════════════════════════════════════════════════════════════
+REDUCED_COLOR = {1: cv2.IMREAD_COLOR, 2: cv2.IMREAD_REDUCED_COLOR_2, 4: cv2.IMREAD_REDUCED_COLOR_4, 8: cv2.IMREAD_REDUCED_COLOR_8}
+REDUCED_GRAY = {1: cv2.IMREAD_GRAYSCALE, 2: cv2.IMREAD_REDUCED_GRAYSCALE_2, 4: cv2.IMREAD_REDUCED_GRAYSCALE_4, 8: cv2.IMREAD_REDUCED_GRAYSCALE_8}
+
+def iter_multipart(chunks, boundary):
+    """
+    multipart/x-mixed-replace body → part payloads. A part is read as exactly
+    Content-Length bytes after its headers; without the header it runs up to the
+    next boundary and the JPEG is SOI … last EOI (an EXIF thumbnail has its own EOI).
+    """
+    buf = bytearray()
+    chunks = iter(chunks)
+
+    def more():
+        chunk = next(chunks, None)
+        if chunk is None: return False
+        buf.extend(chunk)
+        return True
+
+    while True:
+        start = buf.find(boundary)
+        head_end = buf.find(b'\r\n\r\n', start) if start >= 0 else -1
+        if head_end < 0:
+            if start < 0: del buf[:max(0, len(buf) - len(boundary))]
+            if not more(): return
+            continue
+        body = head_end + 4
+        length = re.search(rb'content-length:\s*(\d+)', bytes(buf[start:head_end]), re.I)
+        if length:
+            end = body + int(length.group(1))
+            while len(buf) < end:
+                if not more(): return
+            yield bytes(buf[body:end])
+            del buf[:end]
+            continue
+        scan = body
+        while (end := buf.find(boundary, scan)) < 0:
+            scan = max(body, len(buf) - len(boundary))
+            if not more(): return
+        first, last = buf.find(b'\xff\xd8', body, end), buf.rfind(b'\xff\xd9', body, end)
+        if 0 <= first < last: yield bytes(buf[first:last + 2])
+        del buf[:end]
+
+def iter_jpeg_markers(chunks):
+    """Last resort without a multipart boundary: SOI … EOI pairs in the byte stream"""
+    buf = bytearray()
+    for chunk in chunks:
+        buf += chunk
+        while True:
+            # Entropy-coded data byte-stuffs 0xFF, so SOI/EOI only appear as markers
+            start = buf.find(b'\xff\xd8')
+            if start < 0:
+                del buf[:-1]
+                break
+            end = buf.find(b'\xff\xd9', start + 2)
+            if end < 0:
+                del buf[:start]
+                break
+            yield bytes(buf[start:end + 2])
+            del buf[:end + 2]
+
+class MJPEGCamera(ThreadedCamera):
+    """
+    IP Webcam /video (multipart MJPEG) read over one keep-alive requests.Session.
+    The reader thread only splits JPEGs off the stream and keeps the newest one;
+    JPEG decode happens in read_new() for the frame the pipeline actually takes
+    (IMREAD_REDUCED_* when the stream is larger than FRAME_WIDTH x FRAME_HEIGHT).
+    """
+    def __init__(self, src, ring_size=None):
+        super().__init__(src, ring_size)
+        self.session = requests.Session()
+        self.jpeg = None               # Newest JPEG bytes (seq = number received)
+        self.slot_seq = [0] * self.ring_size
+        self.slot_jpeg = [None] * self.ring_size
+        self.decoded = 0               # Newest decoded seq
+        self.reduce = None             # IMREAD_REDUCED factor, picked on the first JPEG
+        self.decode_lock = threading.Lock()
+        self.last_jpeg_time = 0.0
+        self.stats = {'received': 0, 'decoded': 0, 'stalls': 0, 'reconnects': 0}
+        self.failed = None             # Set when the URL is not an MJPEG stream
+
+    def start(self):
+        threading.Thread(target=self.update, daemon=True).start()
+        return self
+
+    def update(self):
+        backoff = 0.25
+        while not self.stopped:
+            received = self.stats['received']
+            try:
+                self._stream()
+            except ValueError as e:
+                self.failed = str(e)
+                print(f"⚠️ MJPEG: {e}")
+                with self.cond:
+                    self.cond.notify_all()
+                return
+            except (requests.RequestException, OSError) as e:
+                # Read timeouts surface as ConnectionError inside iter_content - judge by the gap instead
+                stalled = self.last_jpeg_time and time.time() - self.last_jpeg_time >= CONFIG.MJPEG_STALL_TIMEOUT
+                if stalled: self.stats['stalls'] += 1
+                print(f"⚠️ MJPEG stream {'stalled' if stalled else type(e).__name__} - reconnect in {backoff:.2f}s")
+            if self.stopped: break
+            if self.stats['received'] > received: backoff = 0.25  # Stream was healthy before dropping
+            time.sleep(backoff)
+            backoff = min(backoff * 2, CONFIG.MJPEG_BACKOFF_MAX)
+            self.stats['reconnects'] += 1
+
+    def _stream(self):
+        with self.session.get(self.src, stream=True, timeout=(3.0, CONFIG.MJPEG_STALL_TIMEOUT)) as r:
+            r.raise_for_status()
+            content_type = r.headers.get('Content-Type', '')
+            if 'multipart' not in content_type:
+                raise ValueError(f"not an MJPEG stream ({content_type or 'no Content-Type'})")
+            match = re.search(r'boundary="?([^";]+)"?', content_type, re.I)
+            chunks = r.iter_content(chunk_size=32768)
+            if match:
+                boundary = match.group(1).strip().encode('latin-1')
+                parts = iter_multipart(chunks, boundary if boundary.startswith(b'--') else b'--' + boundary)
+            else:
+                parts = iter_jpeg_markers(chunks)
+            for jpeg in parts:
+                if self.stopped: return
+                self._publish(jpeg)
+
+    def _publish(self, jpeg):
+        with self.cond:
+            self.jpeg = jpeg
+            self.seq += 1
+            self.stats['received'] += 1
+            self.last_jpeg_time = time.time()
+            self.cond.notify_all()
+
+    def _decode(self, seq, jpeg):
+        """JPEG → ring slot of seq (once per seq)"""
+        with self.decode_lock:
+            slot = seq % self.ring_size
+            if self.slot_seq[slot] == seq:
+                return True
+            t0 = time.perf_counter()
+            buf = np.frombuffer(jpeg, dtype=np.uint8)
+            if self.reduce is None:
+                frame = cv2.imdecode(buf, cv2.IMREAD_COLOR)
+                if frame is None: return False
+                h, w = frame.shape[:2]
+                self.reduce = max(n for n in REDUCED_COLOR if w // n >= CONFIG.FRAME_WIDTH and h // n >= CONFIG.FRAME_HEIGHT) \
+                    if w >= CONFIG.FRAME_WIDTH and h >= CONFIG.FRAME_HEIGHT else 1
+                print(f"📡 MJPEG {w}x{h} → decode 1/{self.reduce}")
+            else:
+                frame = cv2.imdecode(buf, REDUCED_COLOR[self.reduce])
+                if frame is None: return False
+            target = self.ring[slot]
+            self.slot_seq[slot] = -1  # is_fresh(old seq) turns False before the slot is rewritten
+            if frame.shape == target.shape: np.copyto(target, frame)
+            else: cv2.resize(frame, (CONFIG.FRAME_WIDTH, CONFIG.FRAME_HEIGHT), dst=target, interpolation=cv2.INTER_AREA)
+            self.slot_jpeg[slot] = jpeg
+            self.slot_seq[slot] = seq
+            self.decoded = max(self.decoded, seq)
+            self.stats['decoded'] += 1
+            self.grab_timer.time(t0)
+            return True
+
+    @property
+    def frame(self):
+        return self._view(self.decoded) if self.decoded else None
+
+    def read(self):
+        with self.cond:
+            self.cond.wait_for(lambda: self.seq or self.failed or self.stopped, 3.0)
+            seq, jpeg = self.seq, self.jpeg
+        if not seq or not self._decode(seq, jpeg):
+            return None
+        return self.ring[seq % self.ring_size].copy()
+
+    def read_new(self, after_seq=0, timeout=1.0):
+        """Newest JPEG after after_seq, decoded now → (seq, read-only view)"""
+        with self.cond:
+            self.cond.wait_for(lambda: self.seq > after_seq or self.stopped, timeout)
+            if self.seq <= after_seq:
+                return after_seq, None
+            seq, jpeg = self.seq, self.jpeg
+        if not self._decode(seq, jpeg):
+            return after_seq, None
+        return seq, self._view(seq)
+
+    def is_fresh(self, seq):
+        return self.slot_seq[seq % self.ring_size] == seq
+
+    def gray(self, seq):
+        """Barcode gray straight from the JPEG of seq at 1/MJPEG_BARCODE_REDUCED"""
+        factor = CONFIG.MJPEG_BARCODE_REDUCED
+        slot = seq % self.ring_size
+        jpeg = self.slot_jpeg[slot]
+        if factor not in REDUCED_GRAY or self.slot_seq[slot] != seq or jpeg is None:
+            return None
+        return cv2.imdecode(np.frombuffer(jpeg, dtype=np.uint8), REDUCED_GRAY[factor])
+
+    def metrics(self) -> Dict[str, float]:
+        out = dict(self.stats)
+        out['skipped'] = out['received'] - out['decoded']  # Never decoded: newer JPEG arrived first
+        out['frame_age_ms'] = (time.time() - self.last_jpeg_time) * 1000 if self.last_jpeg_time else 0.0
+        out['stalled'] = int(out['frame_age_ms'] > CONFIG.MJPEG_STALL_TIMEOUT * 1000)
+        return out
+
+    def stop(self):
+        self.stopped = True
+        with self.cond:
+            self.cond.notify_all()
+        self.session.close()
+
+class LatencyHistogram:
+    """Rolling window of stage timings (ms) + lifetime count/sum for Prometheus"""
+    def __init__(self, window=None):
+        self.samples = deque(maxlen=window or CONFIG.METRICS_WINDOW)
+        self.count = 0
+        self.total_ms = 0.0
+        self.lock = threading.Lock()
+
+    def add(self, ms):
+        with self.lock:
+            self.samples.append(ms)
+            self.count += 1
+            self.total_ms += ms
+
+    def percentiles(self, qs=(50, 95, 99)) -> Optional[List[float]]:
+        with self.lock:
+            samples = list(self.samples)
+        return np.percentile(samples, qs).tolist() if samples else None
+
+    def time(self, stage_start):
+        """add() the time since a perf_counter() reading"""
+        self.add((time.perf_counter() - stage_start) * 1000)
+
 @dataclass
 class Stats:
     fps_history: deque = field(default_factory=lambda: deque(maxlen=30))
     last_time: float = 0.0
+    ai_fps_history: deque = field(default_factory=lambda: deque(maxlen=30))
+    ai_last_time: float = 0.0
     barcode_count: int = 0
     ai_count: int = 0
     gpu_active: bool = False
     gpu_name: str = "N/A"
     model_name: str = "None"
+    engine: str = ""  # CPU runtime name when YOLO runs without GPU
+    detect_stride: int = 1
+    lane_active: bool = True
+    active_frames: int = 0
+    idle_frames: int = 0
+    wake_latency_ms: float = 0.0
+    stage_ms: Dict[str, float] = field(default_factory=dict)  # EMA per stage: decode / detect / draw
+    stages: Dict[str, LatencyHistogram] = field(default_factory=dict)  # Rolling percentiles per stage
+    dropped_frames: Dict[str, int] = field(default_factory=dict)  # Where frames were skipped
+    api_calls: int = 0
+    api_failures: int = 0
+    camera_metrics: Optional[Callable[[], Dict[str, float]]] = None  # camera.metrics, set by main()
+    spool_metrics: Optional[Callable[[], Dict[str, float]]] = None   # ScanSubmitter.metrics
+    quality_level: int = 0
+    quality_reason: str = ""
+    quality_knobs: Dict[str, float] = field(default_factory=dict)  # Current QualityLevel values
     
+    def time_stage(self, name, seconds):
+        ms = seconds * 1000
+        prev = self.stage_ms.get(name)
+        self.stage_ms[name] = ms if prev is None else 0.8 * prev + 0.2 * ms
+        self.histogram(name).add(ms)
+
+    def histogram(self, name) -> LatencyHistogram:
+        hist = self.stages.get(name)
+        if hist is None:
+            hist = self.stages.setdefault(name, LatencyHistogram())
+        return hist
+
+    def count_drop(self, stage, n=1):
+        self.dropped_frames[stage] = self.dropped_frames.get(stage, 0) + n
+
     def update_fps(self):
         now = time.time()
         if self.last_time > 0 and (now - self.last_time) > 0:
             self.fps_history.append(1.0 / (now - self.last_time))
         self.last_time = now
     
+    def update_ai_fps(self):
+        now = time.time()
+        if self.ai_last_time > 0 and (now - self.ai_last_time) > 0:
+            self.ai_fps_history.append(1.0 / (now - self.ai_last_time))
+        self.ai_last_time = now
+    
     @property
     def fps(self):
         return sum(self.fps_history) / len(self.fps_history) if self.fps_history else 0
 
+    @property
+    def ai_fps(self):
+        return sum(self.ai_fps_history) / len(self.ai_fps_history) if self.ai_fps_history else 0
+
+    @property
+    def idle_ratio(self):
+        total = self.active_frames + self.idle_frames
+        return self.idle_frames / total if total else 0
+
+    def metrics(self) -> Dict[str, float]:
+        """Flat snapshot for export (name → value)"""
+        out = {
+            'fps': self.fps, 'ai_fps': self.ai_fps, 'detect_stride': self.detect_stride,
+            'barcode_scans': self.barcode_count, 'ai_scans': self.ai_count,
+            'lane_active': int(self.lane_active), 'idle_ratio': self.idle_ratio,
+            'wake_latency_ms': self.wake_latency_ms, 'quality_level': self.quality_level,
+            'api_calls': self.api_calls, 'api_failures': self.api_failures,
+        }
+        out.update({f'stage_ms_{name}': ms for name, ms in self.stage_ms.items()})
+        out.update({f'quality_{name}': value for name, value in self.quality_knobs.items()})
+        if self.camera_metrics:
+            out.update({f'camera_{name}': value for name, value in self.camera_metrics().items()})
+        if self.spool_metrics:
+            out.update({f'spool_{name}': value for name, value in self.spool_metrics().items()})
+        return out
+
 @dataclass
 class BarcodeResult:
     code: str
@@ -223,20 +690,943 @@ class AIResult:
     confidence: float
     bbox: Tuple[int, int, int, int]
     barcode: Optional[str] = None
+    track_id: Optional[int] = None
+    class_id: int = -1
     
     def __post_init__(self):
-        self.barcode = AI_TO_BARCODE_MAP.get(self.class_name) or AI_TO_BARCODE_MAP.get(self.class_name.lower())
+        # Detect stage passes the barcode from its class-id table; lookup only for ad-hoc results
+        if self.barcode is None:
+            self.barcode = AI_TO_BARCODE_MAP.get(self.class_name) or AI_TO_BARCODE_MAP.get(self.class_name.lower())
 
-class SmartScanner:
+# One row per detection: box in frame pixels, confidence, class id
+DET_DTYPE = np.dtype([('xyxy', np.float32, (4,)), ('conf', np.float32), ('cls', np.int32)])
+
+def to_detections(data) -> np.ndarray:
+    """(N, 6) array [x1, y1, x2, y2, conf, cls] → DET_DTYPE structured array"""
+    dets = np.empty(len(data), dtype=DET_DTYPE)
+    dets['xyxy'] = data[:, :4]
+    dets['conf'] = data[:, 4]
+    dets['cls'] = data[:, 5]
+    return dets
+
+# ═══════════════════════════════════════════════════════════════════════════════
+#                         🧩 BARCODE ENGINES - SINGLE CALL / PARALLEL TILES
+# ═══════════════════════════════════════════════════════════════════════════════
+class BarcodeBackend:
+    """Decoder interface: decode(gray) → [BarcodeResult] limited to BARCODE_SYMBOLOGIES"""
+    name = "none"
+    available = False
+
+    def __init__(self, symbologies=None):
+        self.symbologies = tuple(CONFIG.BARCODE_SYMBOLOGIES if symbologies is None else symbologies)
+
+    def decode(self, gray) -> List[BarcodeResult]:
+        return []
+
+class PyzbarBackend(BarcodeBackend):
+    name = "pyzbar"
+    available = PYZBAR_AVAILABLE
+
+    def __init__(self, symbologies=None):
+        super().__init__(symbologies)
+        # Restricting zbar to the listed symbologies skips the other scanners entirely
+        self.symbols = [getattr(ZBarSymbol, s) for s in self.symbologies if hasattr(ZBarSymbol, s)] if ZBarSymbol and self.symbologies else None
+
+    def decode(self, gray) -> List[BarcodeResult]:
+        return [BarcodeResult(d.data.decode('utf-8'), tuple(d.rect)) for d in pyzbar_decode(gray, symbols=self.symbols)]
+
+class OpenCVBackend(BarcodeBackend):
+    name = "opencv"
+    available = hasattr(cv2, 'barcode') and hasattr(cv2.barcode, 'BarcodeDetector')
+    TYPES = {"EAN13": "EAN_13", "EAN8": "EAN_8", "CODE128": "CODE_128", "UPCA": "UPC_A", "UPCE": "UPC_E", "CODE39": "CODE_39"}
+
+    def __init__(self, symbologies=None):
+        super().__init__(symbologies)
+        self.detector = cv2.barcode.BarcodeDetector() if self.available else None
+        self.types = {self.TYPES.get(s, s) for s in self.symbologies}
+
+    def decode(self, gray) -> List[BarcodeResult]:
+        if self.detector is None:
+            return []
+        ok, infos, types, points = self.detector.detectAndDecodeWithType(gray)
+        if not ok or points is None:
+            return []
+        results = []
+        for info, kind, pts in zip(infos, types, points):
+            if not info or (self.types and kind not in self.types):
+                continue
+            results.append(BarcodeResult(info, tuple(int(v) for v in cv2.boundingRect(pts.astype(np.float32)))))
+        return results
+
+class ZXingBackend(BarcodeBackend):
+    name = "zxing"
+    available = ZXING_AVAILABLE
+    FORMATS = {"EAN13": "EAN13", "EAN8": "EAN8", "CODE128": "Code128", "UPCA": "UPCA", "UPCE": "UPCE", "CODE39": "Code39"}
+
+    def __init__(self, symbologies=None):
+        super().__init__(symbologies)
+        self.formats = None
+        if self.available and self.symbologies:
+            for s in self.symbologies:
+                fmt = getattr(zxingcpp.BarcodeFormat, self.FORMATS.get(s, s), None)
+                if fmt is not None:
+                    self.formats = fmt if self.formats is None else self.formats | fmt
+
+    def decode(self, gray) -> List[BarcodeResult]:
+        if not self.available:
+            return []
+        found = zxingcpp.read_barcodes(gray, formats=self.formats) if self.formats else zxingcpp.read_barcodes(gray)
+        results = []
+        for r in found:
+            p = r.position
+            xs = [p.top_left.x, p.top_right.x, p.bottom_right.x, p.bottom_left.x]
+            ys = [p.top_left.y, p.top_right.y, p.bottom_right.y, p.bottom_left.y]
+            results.append(BarcodeResult(r.text, (min(xs), min(ys), max(xs) - min(xs), max(ys) - min(ys))))
+        return results
+
+BARCODE_BACKENDS = {cls.name: cls for cls in (PyzbarBackend, OpenCVBackend, ZXingBackend)}
+BARCODE_FALLBACK_ORDER = ("zxing", "opencv", "pyzbar")
+_backend_local = threading.local()
+
+def resolve_barcode_backend(name=None) -> str:
+    """Requested backend if installed, else the first available one (zxing → opencv → pyzbar)"""
+    name = name or CONFIG.BARCODE_BACKEND
+    cls = BARCODE_BACKENDS.get(name)
+    if cls is not None and cls.available:
+        return name
+    for fallback in BARCODE_FALLBACK_ORDER:
+        if BARCODE_BACKENDS[fallback].available:
+            print(f"⚠️ Barcode backend '{name}' not available - using {fallback}")
+            return fallback
+    raise RuntimeError("No barcode backend installed - pip install zxing-cpp (or pyzbar / opencv-contrib-python)")
+
+def get_barcode_backend(name=None) -> BarcodeBackend:
+    """Per-thread backend instance (cv2 detectors are not shared across threads)"""
+    name = name or CONFIG.BARCODE_BACKEND
+    cache = _backend_local.__dict__.setdefault('backends', {})
+    if name not in cache:
+        cache[name] = BARCODE_BACKENDS[resolve_barcode_backend(name)]()
+    return cache[name]
+
+def decode_full_frame(gray) -> List[BarcodeResult]:
+    return get_barcode_backend().decode(gray)
+
+def _decode_tile(job):
+    """Pool worker: decode one tile, rects shifted back to frame coordinates"""
+    x, y, tile, backend = job
+    return [(r.code, (r.rect[0] + x, r.rect[1] + y, r.rect[2], r.rect[3])) for r in get_barcode_backend(backend).decode(tile)]
+
+def tile_grid(width, height, tile, overlap):
+    """Top-left corners of overlapping tiles covering the frame (edges aligned to the border)"""
+    def starts(size):
+        if size <= tile:
+            return [0]
+        step = max(1, tile - overlap)
+        xs = list(range(0, size - tile + 1, step))
+        if xs[-1] + tile < size:
+            xs.append(size - tile)
+        return xs
+    return [(x, y) for y in starts(height) for x in starts(width)]
+
+def merge_barcodes(hits) -> List[BarcodeResult]:
+    """Same code found in overlapping tiles → keep the largest rect"""
+    merged: List[BarcodeResult] = []
+    for code, rect in sorted(hits, key=lambda h: h[1][2] * h[1][3], reverse=True):
+        x, y, w, h = rect
+        if any(m.code == code and x < m.rect[0] + m.rect[2] and m.rect[0] < x + w
+               and y < m.rect[1] + m.rect[3] and m.rect[1] < y + h for m in merged):
+            continue
+        merged.append(BarcodeResult(code, rect))
+    return merged
+
+class TiledBarcodeDecoder:
+    """
+    Splits the gray frame into overlapping tiles decoded in parallel. A barcode
+    narrower than the overlap is always whole in some tile; anything larger (or
+    cut by a seam anyway) is caught by a downscaled full-frame pass when the
+    tiles return nothing.
+    """
+    def __init__(self, workers=None, tile=None, overlap=None, pool=None):
+        self.workers = workers or CONFIG.BARCODE_WORKERS
+        overlap = CONFIG.BARCODE_TILE_OVERLAP if overlap is None else overlap
+        self.overlap = int(CONFIG.BARCODE_MAX_WIDTH * 1.1) if overlap is None else overlap
+        self.tile = max(tile or CONFIG.BARCODE_TILE, 2 * self.overlap)  # Step >= overlap
+        pool = pool or CONFIG.BARCODE_POOL
+        self.executor = (ProcessPoolExecutor if pool == "process" else ThreadPoolExecutor)(max_workers=self.workers)
+
+    def __call__(self, gray) -> List[BarcodeResult]:
+        h, w = gray.shape[:2]
+        jobs = [(x, y, gray[y:y+self.tile, x:x+self.tile], CONFIG.BARCODE_BACKEND) for x, y in tile_grid(w, h, self.tile, self.overlap)]
+        if len(jobs) == 1:
+            return decode_full_frame(gray)
+        hits = [hit for tile_hits in self.executor.map(_decode_tile, jobs) for hit in tile_hits]
+        return merge_barcodes(hits) if hits else decode_downscaled(gray, CONFIG.BARCODE_FALLBACK_SIDE)
+
+    def close(self):
+        # wait=True: a process pool torn down mid-flight raises EBADF from its feeder thread
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+def decode_downscaled(gray, side) -> List[BarcodeResult]:
+    """Full-frame decode with the long side at most `side` px, rects in original coordinates"""
+    h, w = gray.shape[:2]
+    scale = side / max(h, w)
+    if scale >= 1.0:
+        return decode_full_frame(gray)
+    small = cv2.resize(gray, (int(w * scale), int(h * scale)), interpolation=cv2.INTER_AREA)
+    return [BarcodeResult(r.code, tuple(int(v / scale) for v in r.rect)) for r in decode_full_frame(small)]
+
+def make_barcode_engine():
+    return TiledBarcodeDecoder() if CONFIG.BARCODE_ENGINE == "tiled" else decode_full_frame
+
+# ═══════════════════════════════════════════════════════════════════════════════
+#                         🔲 BARCODE ROI - DECODE AROUND THE LAST HIT
+# ═══════════════════════════════════════════════════════════════════════════════
+class BarcodeROITracker:
+    """
+    After a hit only expanded windows around the last rects are decoded (upscaled
+    when small). Any ROI miss falls back to the full frame in the same call, and
+    every BARCODE_FULL_SWEEP_EVERY frames a full sweep runs anyway for new codes.
+    """
+    def __init__(self, full_decoder=None):
+        self.full_decoder = full_decoder or decode_full_frame
+        self.rects: List[Tuple[int, int, int, int]] = []
+        self.frames = 0
+        self.roi_hits = 0
+        self.full_sweeps = 0
+
+    def reset(self):
+        self.rects = []
+
+    def decode(self, gray) -> List[BarcodeResult]:
+        self.frames += 1
+        if CONFIG.BARCODE_ROI and self.rects and self.frames % CONFIG.BARCODE_FULL_SWEEP_EVERY:
+            hits = [self._decode_roi(gray, rect) for rect in self.rects]
+            if all(hits):
+                self.roi_hits += 1
+                results = merge_barcodes((h.code, h.rect) for hit in hits for h in hit)
+                self.rects = [r.rect for r in results]
+                return results
+        self.full_sweeps += 1
+        results = self.full_decoder(gray)
+        self.rects = [r.rect for r in results]
+        return results
+
+    @staticmethod
+    def _decode_roi(gray, rect) -> List[BarcodeResult]:
+        h, w = gray.shape[:2]
+        x, y, bw, bh = rect
+        pad_x = max(CONFIG.BARCODE_ROI_MIN_PAD, int(bw * CONFIG.BARCODE_ROI_MARGIN))
+        pad_y = max(CONFIG.BARCODE_ROI_MIN_PAD, int(bh * CONFIG.BARCODE_ROI_MARGIN))
+        x1, y1 = max(0, x - pad_x), max(0, y - pad_y)
+        x2, y2 = min(w, x + bw + pad_x), min(h, y + bh + pad_y)
+        if x2 <= x1 or y2 <= y1:
+            return []
+        crop = gray[y1:y2, x1:x2]
+        scale = 1.0
+        if min(crop.shape[:2]) < CONFIG.BARCODE_UPSCALE_BELOW:
+            scale = CONFIG.BARCODE_UPSCALE
+            crop = cv2.resize(crop, None, fx=scale, fy=scale, interpolation=cv2.INTER_LINEAR)
+        return [BarcodeResult(r.code, (x1 + int(r.rect[0] / scale), y1 + int(r.rect[1] / scale), int(r.rect[2] / scale), int(r.rect[3] / scale)))
+                for r in get_barcode_backend().decode(crop)]
+
+# ═══════════════════════════════════════════════════════════════════════════════
+#                         🎯 TRACKER - CARRY BOXES BETWEEN YOLO RUNS
+# ═══════════════════════════════════════════════════════════════════════════════
+def box_iou(a, b):
+    ix1, iy1 = max(a[0], b[0]), max(a[1], b[1])
+    ix2, iy2 = min(a[2], b[2]), min(a[3], b[3])
+    inter = max(0.0, ix2 - ix1) * max(0.0, iy2 - iy1)
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+@dataclass
+class Track:
+    track_id: int
+    result: AIResult
+    points: Optional[np.ndarray] = None  # LK feature points inside the box
+    misses: int = 0
+    sent: bool = False  # Auto-input already triggered by this track
+
+class BoxTracker:
+    """IoU association on detector frames, Lucas-Kanade optical flow in between"""
     def __init__(self):
+        self.tracks: List[Track] = []
+        self.next_id = 1
+        self.prev_gray = None
+        self.lost = False  # A track lost its flow points → detector should run
+
+    def reset(self):
+        self.tracks.clear()
+        self.prev_gray = None
+
+    def get(self, track_id):
+        for t in self.tracks:
+            if t.track_id == track_id:
+                return t
+        return None
+
+    @property
+    def results(self) -> List[AIResult]:
+        return [t.result for t in self.tracks]
+
+    def update(self, gray, detections: List[AIResult]):
+        pairs = sorted(((box_iou(t.result.bbox, d.bbox), ti, di)
+                        for ti, t in enumerate(self.tracks) for di, d in enumerate(detections)), reverse=True)
+        used_t, used_d = set(), set()
+        for score, ti, di in pairs:
+            if score < CONFIG.TRACK_IOU_MATCH: break
+            if ti in used_t or di in used_d: continue
+            used_t.add(ti); used_d.add(di)
+            track = self.tracks[ti]
+            # Class switch = different item in the same spot
+            if detections[di].class_id != track.result.class_id:
+                track.sent = False
+            detections[di].track_id = track.track_id
+            track.result, track.misses = detections[di], 0
+        
+        for ti, track in enumerate(self.tracks):
+            if ti not in used_t: track.misses += 1
+        self.tracks = [t for t in self.tracks if t.misses <= CONFIG.TRACK_MAX_MISSES]
+        
+        for di, det in enumerate(detections):
+            if di in used_d: continue
+            det.track_id = self.next_id
+            self.tracks.append(Track(self.next_id, det))
+            self.next_id += 1
+        
+        for track in self.tracks:
+            track.points = self._features(gray, track.result.bbox)
+        self.prev_gray = gray
+        self.lost = False
+
+    def predict(self, gray):
+        """Shift every box by the median flow of its feature points"""
+        live = [t for t in self.tracks if t.points is not None]
+        if self.prev_gray is None or not live:
+            self.prev_gray = gray
+            return
+        p0 = np.concatenate([t.points for t in live])
+        p1, status, _ = cv2.calcOpticalFlowPyrLK(self.prev_gray, gray, p0, None, winSize=(15, 15), maxLevel=2)
+        status = status.reshape(-1).astype(bool)
+        start = 0
+        for track in live:
+            n = len(track.points)
+            ok = status[start:start+n]
+            if ok.sum() < 3:
+                track.points = None
+                self.lost = True
+            else:
+                dx, dy = np.median((p1[start:start+n] - p0[start:start+n])[ok].reshape(-1, 2), axis=0)
+                x1, y1, x2, y2 = track.result.bbox
+                dx, dy = float(dx), float(dy)
+                track.result = replace(track.result, bbox=(x1 + dx, y1 + dy, x2 + dx, y2 + dy))
+                track.points = p1[start:start+n][ok]
+            start += n
+        self.prev_gray = gray
+
+    @staticmethod
+    def _features(gray, bbox):
+        h, w = gray.shape[:2]
+        x1, y1, x2, y2 = (int(v) for v in bbox)
+        x1, y1, x2, y2 = max(0, x1), max(0, y1), min(w, x2), min(h, y2)
+        if x2 - x1 < 8 or y2 - y1 < 8:
+            return None
+        pts = cv2.goodFeaturesToTrack(gray[y1:y2, x1:x2], maxCorners=20, qualityLevel=0.01, minDistance=5)
+        if pts is None:
+            return None
+        return (pts + np.array([x1, y1], dtype=np.float32)).astype(np.float32)
+
+# ═══════════════════════════════════════════════════════════════════════════════
+#                    🧠 CPU INFERENCE - ONNX RUNTIME / OPENVINO
+# ═══════════════════════════════════════════════════════════════════════════════
+def file_hash(path, chunk=1 << 20):
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(chunk), b''):
+            h.update(block)
+    return h.hexdigest()[:12]
+
+def export_cache_path(model_path, runtime, precision="fp32"):
+    """Cache location of an exported artifact: weight hash + imgsz + precision"""
+    stem = os.path.splitext(os.path.basename(model_path))[0]
+    key = f"{stem}-{file_hash(model_path)}-{CONFIG.INFERENCE_IMGSZ}" + ("-dyn" if CONFIG.INFERENCE_DYNAMIC_BATCH else "")
+    key += "-int8" if precision == "int8" else ""
+    # OpenVINO dirs must end in _openvino_model or ultralytics' YOLO() (mAP check) cannot load them
+    return os.path.join(CONFIG.EXPORT_CACHE_DIR, key + (".onnx" if runtime == "onnx" else "_openvino_model"))
+
+def replace_artifact(src, target):
+    """Move an export into the cache over a stale entry (shutil.move would nest a dir inside it)"""
+    if os.path.isdir(target): shutil.rmtree(target)
+    elif os.path.exists(target): os.remove(target)
+    shutil.move(str(src), target)
+
+def export_for_cpu(model_path, runtime) -> Optional[str]:
+    """
+    Export the .pt weights once to ONNX / OpenVINO IR. The artifact is cached in
+    EXPORT_CACHE_DIR keyed by the weight hash + imgsz, so retraining re-exports.
+    """
+    if not os.path.exists(model_path):
+        print(f"❌ Weights not found: {model_path}")
+        return None
+    os.makedirs(CONFIG.EXPORT_CACHE_DIR, exist_ok=True)
+    target = export_cache_path(model_path, runtime)
+    if os.path.exists(target) and os.path.exists(target + ".names.json"):
+        return target
+    
+    try:
+        from ultralytics import YOLO as Exporter
+    except ImportError:
+        print("❌ Export needs ultralytics: pip install ultralytics")
+        return None
+    print(f"📦 Exporting {model_path} → {runtime} (sekali saja)...")
+    model = Exporter(model_path)
+    exported = model.export(format="onnx" if runtime == "onnx" else "openvino",
+                            imgsz=CONFIG.INFERENCE_IMGSZ, dynamic=CONFIG.INFERENCE_DYNAMIC_BATCH, half=False, device="cpu")
+    replace_artifact(exported, target)
+    with open(target + ".names.json", 'w') as f:
+        json.dump({int(k): v for k, v in model.names.items()}, f)
+    print(f"✅ Cached: {target}")
+    return target
+
+def letterbox(frame, size):
+    """Resize keeping aspect + pad to size → (NCHW float blob, ratio, (pad_x, pad_y))"""
+    h, w = frame.shape[:2]
+    r = min(size / h, size / w)
+    nh, nw = int(round(h * r)), int(round(w * r))
+    top, left = (size - nh) // 2, (size - nw) // 2
+    resized = cv2.resize(frame, (nw, nh), interpolation=cv2.INTER_LINEAR) if (nw, nh) != (w, h) else frame
+    canvas = cv2.copyMakeBorder(resized, top, size - nh - top, left, size - nw - left, cv2.BORDER_CONSTANT, value=(114, 114, 114))
+    return cv2.dnn.blobFromImage(canvas, 1 / 255.0, swapRB=True), r, (left, top)
+
+class CPUDetector:
+    """YOLO forward pass on ONNX Runtime / OpenVINO with letterbox + NMS done here"""
+    IOU_NMS = 0.7
+    MAX_DET = 300
+
+    def __init__(self, artifact, runtime, threads=None):
+        threads = threads or CONFIG.INFERENCE_THREADS
+        self.runtime = runtime
+        self.imgsz = CONFIG.INFERENCE_IMGSZ
+        with open(artifact + ".names.json") as f:
+            self.names = {int(k): v for k, v in json.load(f).items()}
+        if runtime == "onnx":
+            opts = ort.SessionOptions()
+            opts.intra_op_num_threads = threads
+            opts.inter_op_num_threads = 1
+            opts.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+            opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+            self.session = ort.InferenceSession(artifact, opts, providers=["CPUExecutionProvider"])
+            self.input_name = self.session.get_inputs()[0].name
+            self.batched = not isinstance(self.session.get_inputs()[0].shape[0], int)
+        else:
+            core = ov.Core()
+            xml = glob.glob(os.path.join(artifact, "*.xml"))[0]
+            self.compiled = core.compile_model(core.read_model(xml), "CPU",
+                                               {"INFERENCE_NUM_THREADS": threads, "PERFORMANCE_HINT": "LATENCY"})
+            self.output = self.compiled.output(0)
+            self.batched = self.compiled.input(0).get_partial_shape()[0].is_dynamic
+
+    def _infer(self, blob):
+        if self.runtime == "onnx":
+            return self.session.run(None, {self.input_name: blob})[0]
+        return self.compiled(blob)[self.output]
+
+    def detect(self, frame, conf, classes=None, max_det=None) -> np.ndarray:
+        """→ DET_DTYPE array in frame coordinates"""
+        blob, ratio, pad = letterbox(frame, self.imgsz)
+        return self._postprocess(self._infer(blob)[0], frame.shape, ratio, pad, conf, classes, max_det)
+
+    def detect_batch(self, frames, conf, classes=None, max_det=None) -> List[np.ndarray]:
+        """One forward pass for all frames when the artifact has a dynamic batch axis"""
+        if not self.batched or len(frames) == 1:
+            return [self.detect(frame, conf, classes, max_det) for frame in frames]
+        boxes = [letterbox(frame, self.imgsz) for frame in frames]
+        preds = self._infer(np.concatenate([blob for blob, _, _ in boxes]))
+        return [self._postprocess(pred, frame.shape, ratio, pad, conf, classes, max_det)
+                for pred, frame, (_, ratio, pad) in zip(preds, frames, boxes)]
+
+    def _postprocess(self, pred, shape, ratio, pad, conf, classes, max_det) -> np.ndarray:
+        pad_x, pad_y = pad
+        preds = pred.T  # (anchors, 4 + classes): cx, cy, w, h, scores...
+        scores = preds[:, 4:]
+        class_ids = scores.argmax(axis=1)
+        confs = scores[np.arange(len(scores)), class_ids]
+        keep = confs >= conf
+        if classes is not None:
+            keep &= np.isin(class_ids, classes)
+        if not keep.any():
+            return np.empty(0, dtype=DET_DTYPE)
+        preds, class_ids, confs = preds[keep], class_ids[keep], confs[keep]
+        tlwh = np.column_stack([preds[:, 0] - preds[:, 2] / 2, preds[:, 1] - preds[:, 3] / 2, preds[:, 2], preds[:, 3]])
+        idx = np.array(cv2.dnn.NMSBoxesBatched(tlwh.tolist(), confs.tolist(), class_ids.tolist(), conf, self.IOU_NMS), dtype=np.int64).reshape(-1)
+        idx = idx[:max_det or self.MAX_DET]
+        h, w = shape[:2]
+        xyxy = np.column_stack([tlwh[idx, 0], tlwh[idx, 1], tlwh[idx, 0] + tlwh[idx, 2], tlwh[idx, 1] + tlwh[idx, 3]])
+        xyxy = (xyxy - [pad_x, pad_y, pad_x, pad_y]) / ratio
+        np.clip(xyxy, 0, [w, h, w, h], out=xyxy)
+        return to_detections(np.column_stack([xyxy, confs[idx], class_ids[idx]]))
+
+def cpu_runtime() -> Optional[str]:
+    """CPU runtime to use for YOLO, or None for torch / barcode only"""
+    backend = CONFIG.INFERENCE_BACKEND
+    if backend == "torch" or (backend == "auto" and AI_AVAILABLE):
+        return None
+    if backend in ("onnx", "auto") and ONNXRUNTIME_AVAILABLE:
+        return "onnx"
+    if backend in ("openvino", "auto") and OPENVINO_AVAILABLE:
+        return "openvino"
+    if backend != "auto":
+        print(f"⚠️ INFERENCE_BACKEND '{backend}' not installed (pip install onnxruntime / openvino)")
+    return None
+
+# ═══════════════════════════════════════════════════════════════════════════════
+#                         💤 MOTION GATE - IDLE WHEN NOTHING MOVES
+# ═══════════════════════════════════════════════════════════════════════════════
+class MotionGate:
+    """Frame differencing on a tiny gray copy against a running background"""
+    def __init__(self):
+        self.background = None
+        self.active = True
+        self.last_motion = 0.0
+
+    def check(self, frame, now) -> Tuple[bool, bool]:
+        """→ (active, woke) where woke is True on the idle → active transition"""
+        small = cv2.cvtColor(cv2.resize(frame, CONFIG.MOTION_SIZE, interpolation=cv2.INTER_AREA), cv2.COLOR_BGR2GRAY)
+        if self.background is None:
+            self.background = small.astype(np.float32)
+            self.last_motion = now
+            return True, False
+        diff = cv2.absdiff(small, cv2.convertScaleAbs(self.background))
+        moving = np.count_nonzero(diff > CONFIG.MOTION_PIXEL_DIFF) >= CONFIG.MOTION_MIN_AREA * diff.size
+        cv2.accumulateWeighted(small, self.background, CONFIG.MOTION_BG_ALPHA)
+        if moving:
+            self.last_motion = now
+        was_active = self.active
+        self.active = moving or (now - self.last_motion) < CONFIG.MOTION_HOLD
+        return self.active, self.active and not was_active
+
+# ═══════════════════════════════════════════════════════════════════════════════
+#                      🎚️ QUALITY CONTROLLER - HOLD TARGET FPS
+# ═══════════════════════════════════════════════════════════════════════════════
+@dataclass(frozen=True)
+class QualityLevel:
+    stride_factor: int   # Multiplies the adaptive detector stride
+    imgsz: int           # YOLO input size (PyTorch; exported CPU models keep their fixed size)
+    decode_scale: float  # Gray frame is resized by this before barcode decoding
+    overlay: int         # 2 = boxes + labels, 1 = boxes, 0 = panel only
+
+class QualityController:
+    """
+    Steps one level down QUALITY_LEVELS when FPS is under target or decode + YOLO
+    exceed the latency budget; steps back up after QUALITY_RESTORE_AFTER calm intervals.
+    decode_scale only follows the ladder once decode alone is over budget, and levels
+    that would change nothing (imgsz on a fixed-shape CPU export) are skipped.
+    """
+    def __init__(self, stats):
+        self.stats = stats
+        self.levels = [QualityLevel(*level) for level in CONFIG.QUALITY_LEVELS]
+        self.index = 0
+        self.decode_index = 0     # Deepest level whose decode_scale is in use
+        self.fixed_imgsz = False  # Detector ignores imgsz (exported ONNX / OpenVINO model)
+        self.calm = 0
+        self.last_check = 0.0
+        self.last_seq = 0
+        self._set(0, "")
+
+    @property
+    def level(self) -> QualityLevel:
+        return self._knobs(self.index)
+
+    def _knobs(self, index, decode_index=None) -> QualityLevel:
+        level = self.levels[index]
+        decode_index = self.decode_index if decode_index is None else decode_index
+        return replace(level, imgsz=CONFIG.INFERENCE_IMGSZ if self.fixed_imgsz else level.imgsz,
+                       decode_scale=self.levels[min(index, decode_index)].decode_scale)
+
+    @property
+    def latency_ms(self):
+        """Per-frame cost: YOLO only runs every detect_stride frames"""
+        stage_ms = self.stats.stage_ms
+        return stage_ms.get('decode', 0.0) + stage_ms.get('detect', 0.0) / max(1, self.stats.detect_stride)
+
+    def update(self, now, seq):
+        """Called once per shown frame; seq (camera frame number) gives the source rate"""
+        if not CONFIG.QUALITY_CONTROL or now - self.last_check < CONFIG.QUALITY_INTERVAL:
+            return
+        elapsed = now - self.last_check
+        source_fps = (seq - self.last_seq) / elapsed if self.last_check and seq > self.last_seq else 0.0
+        self.last_check, self.last_seq = now, seq
+        if not self.stats.lane_active or not self.stats.fps:
+            return  # Idle lane renders every Nth frame on purpose
+        
+        target = min(CONFIG.TARGET_FPS, source_fps * 0.95) if source_fps else CONFIG.TARGET_FPS
+        fps, latency = self.stats.fps, self.latency_ms
+        if fps < target * 0.9 or latency > CONFIG.LATENCY_BUDGET_MS:
+            self.calm = 0
+            reason = f"{fps:.0f}<{target:.0f}fps" if fps < target * 0.9 else f"{latency:.0f}>{CONFIG.LATENCY_BUDGET_MS:.0f}ms"
+            # Decode runs on every frame: it is the bottleneck past the budget or the frame time
+            decode_over = self.stats.stage_ms.get('decode', 0.0) > min(CONFIG.LATENCY_BUDGET_MS, 1000.0 / target)
+            self._step(+1, reason, decode_over)
+        elif fps >= target and latency < CONFIG.LATENCY_BUDGET_MS * 0.6:
+            self.calm += 1
+            if self.calm >= CONFIG.QUALITY_RESTORE_AFTER:
+                self.calm = 0
+                self._step(-1, "headroom")
+        else:
+            self.calm = 0
+
+    def _step(self, direction, reason, decode_over=False):
+        """Move to the nearest level in direction whose knobs differ from the current ones"""
+        current = self.level
+        index = self.index + direction
+        while 0 <= index < len(self.levels):
+            decode_index = min(index if decode_over else self.decode_index, index)
+            if self._knobs(index, decode_index) != current:
+                self.decode_index = decode_index
+                self._set(index, reason)
+                return
+            index += direction
+
+    def _set(self, index, reason):
+        index = max(0, min(len(self.levels) - 1, index))
+        changed = index != self.index
+        self.index = index
+        level = self.level
+        self.stats.quality_level = index
+        self.stats.quality_reason = reason
+        self.stats.quality_knobs = {'stride_factor': level.stride_factor, 'imgsz': level.imgsz,
+                                    'decode_scale': level.decode_scale, 'overlay': level.overlay}
+        if changed:
+            print(f"🎚️ Quality L{index} ({reason}): stride x{level.stride_factor}, {level.imgsz}px, "
+                  f"decode {level.decode_scale*100:.0f}%, overlay {level.overlay}")
+
+# ═══════════════════════════════════════════════════════════════════════════════
+#                         🟨 CHECKOUT ZONE - CROP FOR BOTH DECODERS
+# ═══════════════════════════════════════════════════════════════════════════════
+class CheckoutZone:
+    """Counter region: decoders only see its bounding box, outside a polygon is masked"""
+    def __init__(self, points):
+        pts = np.array(points, dtype=np.int32).reshape(-1, 2)
+        pts[:, 0] = np.clip(pts[:, 0], 0, CONFIG.FRAME_WIDTH - 1)
+        pts[:, 1] = np.clip(pts[:, 1], 0, CONFIG.FRAME_HEIGHT - 1)
+        self.points = pts
+        self.rect = cv2.boundingRect(pts)
+        x, y, w, h = self.rect
+        corners = {(x, y), (x + w - 1, y), (x + w - 1, y + h - 1), (x, y + h - 1)}
+        self.mask = None
+        if len(pts) != 4 or {tuple(p) for p in pts.tolist()} != corners:
+            self.mask = np.zeros((h, w), dtype=np.uint8)
+            cv2.fillPoly(self.mask, [pts - [x, y]], 255)
+
+    @classmethod
+    def from_rect(cls, x1, y1, x2, y2):
+        x1, x2 = sorted((x1, x2)); y1, y2 = sorted((y1, y2))
+        return cls([(x1, y1), (x2, y1), (x2, y2), (x1, y2)])
+
+    @property
+    def offset(self):
+        return self.rect[0], self.rect[1]
+
+    def crop(self, image, scale=1.0):
+        """scale: image size relative to the frame (e.g. a full-resolution barcode gray)"""
+        x, y, w, h = (int(round(v * scale)) for v in self.rect) if scale != 1.0 else self.rect
+        crop = image[y:y+h, x:x+w]
+        if self.mask is None:
+            return crop
+        mask = self.mask if scale == 1.0 else cv2.resize(self.mask, (crop.shape[1], crop.shape[0]), interpolation=cv2.INTER_NEAREST)
+        return cv2.bitwise_and(crop, crop, mask=mask)
+
+def lane_zone_file(lane=None):
+    """checkout_zone.json, or checkout_zone_<lane>.json per lane in multi-lane mode"""
+    if lane is None:
+        return CONFIG.CHECKOUT_ZONE_FILE
+    stem, ext = os.path.splitext(CONFIG.CHECKOUT_ZONE_FILE)
+    return f"{stem}_{lane}{ext}"
+
+def load_checkout_zone(path=None) -> Optional[CheckoutZone]:
+    """Zone saved from the scanner window wins over CHECKOUT_ZONE in the config"""
+    path = path or CONFIG.CHECKOUT_ZONE_FILE
+    points = CONFIG.CHECKOUT_ZONE
+    if os.path.exists(path):
+        try:
+            with open(path) as f:
+                points = json.load(f)
+        except Exception as e:
+            print(f"⚠️ {path}: {e}")
+    return CheckoutZone(points) if len(points) >= 3 else None
+
+# ═══════════════════════════════════════════════════════════════════════════════
+#                 📮 SCAN SUBMISSION - DURABLE SPOOL + KEEP-ALIVE WORKER
+# ═══════════════════════════════════════════════════════════════════════════════
+@dataclass
+class ScanJob:
+    code: str
+    name: str
+    method: str  # "BARCODE" / "AI"
+    lane: Optional[str] = None
+    key: str = field(default_factory=lambda: uuid.uuid4().hex)  # Idempotency key - replays never double-add
+    created: float = field(default_factory=time.time)
+    captured: Optional[float] = None  # Frame time on the camera clock (replay: seq / fps)
+    ok: bool = False
+    reply: str = ""  # Server message (or error) for the overlay
+
+    @property
+    def latency_ms(self):
+        return (time.time() - self.created) * 1000
+
+class ScanSpool:
+    """Append-only SQLite log of scans the server has not answered yet (survives restarts)"""
+    def __init__(self, path=None):
+        self.path = path or CONFIG.SPOOL_FILE
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(self.path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=FULL")
+        self.db.execute("""CREATE TABLE IF NOT EXISTS spool (id INTEGER PRIMARY KEY AUTOINCREMENT, key TEXT UNIQUE NOT NULL,
+                           code TEXT NOT NULL, name TEXT, method TEXT, lane TEXT, created REAL NOT NULL, captured REAL)""")
+        if 'captured' not in {row[1] for row in self.db.execute("PRAGMA table_info(spool)")}:
+            self.db.execute("ALTER TABLE spool ADD COLUMN captured REAL")  # Spool written by an older version
+        self.db.commit()
+
+    def append(self, jobs) -> int:
+        """→ number of oldest rows dropped to stay under SPOOL_MAX_ROWS"""
+        with self.lock, self.db:
+            self.db.executemany("INSERT OR IGNORE INTO spool (key, code, name, method, lane, created, captured) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                [(j.key, j.code, j.name, j.method, j.lane, j.created, j.captured) for j in jobs])
+            excess = self.db.execute("SELECT COUNT(*) FROM spool").fetchone()[0] - CONFIG.SPOOL_MAX_ROWS
+            if excess > 0:
+                self.db.execute("DELETE FROM spool WHERE id IN (SELECT id FROM spool ORDER BY id LIMIT ?)", (excess,))
+            return max(0, excess)
+
+    def head(self, limit) -> List[ScanJob]:
+        with self.lock:
+            rows = self.db.execute("SELECT code, name, method, lane, key, created, captured FROM spool ORDER BY id LIMIT ?", (limit,)).fetchall()
+        return [ScanJob(*row) for row in rows]
+
+    def remove(self, keys):
+        with self.lock, self.db:
+            self.db.executemany("DELETE FROM spool WHERE key = ?", [(k,) for k in keys])
+
+    def depth(self) -> int:
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM spool").fetchone()[0]
+
+class ScanSubmitter:
+    """
+    Scans are written to the ScanSpool first; one long-lived thread drains it in
+    order, SPOOL_BATCH at a time in one /api/scan/batch call, over a keep-alive requests.Session. A row leaves
+    the spool once the server answered it (accepted or rejected) and that answer is
+    acknowledged through the on_ack callback. While /api/scan is unreachable the
+    drain backs off and rows wait on disk; a new scan retries right away.
+    """
+    def __init__(self, path=None):
+        self.path = path
+        self.spool = None  # Opened on first use - worker processes never submit
+        self.acks: Dict[str, Callable] = {}  # key → on_ack for scans submitted by this process
+        self.fails: Dict[str, Callable] = {}  # key → on_fail, called for every failed delivery attempt
+        self.cond = threading.Condition()
+        self.thread = None
+        self.wake = False
+        self.busy = False
+        self.depth = 0
+        self.offline = False
+        self.dropped = 0
+        self.failures = 0  # Delivery attempts that got no answer (API down, 5xx) - rows stay spooled
+        self.delivered = deque(maxlen=1024)  # Delivery times → drain rate
+        self.batch_api = True  # Until API_BATCH_URL turns out to be missing (older app.py)
+
+    def start(self):
+        """Open the spool and drain what a previous run left behind"""
+        with self.cond:
+            if self.thread is None:
+                self.spool = ScanSpool(self.path)
+                self.depth = self.spool.depth()
+                if self.depth: print(f"📥 Spool: {self.depth} scans from the last run")
+                self.thread = threading.Thread(target=self._loop, daemon=True)
+                self.thread.start()
+        return self
+
+    def submit(self, jobs, on_ack, on_fail=None):
+        self.start()
+        with self.cond:
+            for job in jobs:
+                self.acks[job.key] = on_ack
+                if on_fail: self.fails[job.key] = on_fail
+            dropped = self.spool.append(jobs)
+            self.dropped += dropped
+            self.depth = self.spool.depth()
+            self.wake = True
+            self.cond.notify_all()
+        if dropped: print(f"⚠️ Spool full: {dropped} oldest scans dropped")
+
+    def flush(self, timeout=2.0):
+        """Wait until the spool is drained (False if still offline after timeout)"""
+        with self.cond:
+            return self.cond.wait_for(lambda: not self.busy and not self.wake and (not self.depth or self.offline), timeout) \
+                and not self.depth
+
+    @property
+    def drain_rate(self):
+        """Scans delivered per second over the last 10 s"""
+        now = time.time()
+        return sum(1 for t in self.delivered if now - t <= 10.0) / 10.0
+
+    def metrics(self) -> Dict[str, float]:
+        return {'depth': self.depth, 'drain_rate': self.drain_rate, 'offline': int(self.offline), 'dropped': self.dropped,
+                'failures': self.failures}
+
+    def _loop(self):
+        session = requests.Session()
+        backoff = 0.0
+        while True:
+            with self.cond:
+                if backoff: self.cond.wait_for(lambda: self.wake, backoff)
+                else: self.cond.wait_for(lambda: self.wake or self.depth)
+                if self.wake:
+                    # Scans from the same moment (multi-barcode frame, several lanes) join this round
+                    deadline = time.perf_counter() + CONFIG.SUBMIT_COALESCE_MS / 1000
+                    while (remaining := deadline - time.perf_counter()) > 0:
+                        self.cond.wait(remaining)
+                self.wake, self.busy = False, True
+            done, failed = self._deliver(session, self.spool.head(CONFIG.SPOOL_BATCH))
+            self.spool.remove([job.key for job in done])
+            now = time.time()
+            self.delivered.extend([now] * len(done))
+            self._ack(done)
+            if failed: self._failed(failed)
+            with self.cond:
+                self.depth = self.spool.depth()
+                if failed and not self.offline: print(f"📥 API offline ({failed.reply}) - {self.depth} scans spooled")
+                elif self.offline and not failed: print("📤 API back - draining spool")
+                self.offline = failed is not None
+                self.busy = False
+                self.cond.notify_all()
+            backoff = min(max(backoff * 2, 0.5), CONFIG.SPOOL_RETRY_MAX) if failed else 0.0
+
+    def _deliver(self, session, jobs):
+        """→ (answered jobs, first unanswered job or None); later jobs wait behind a failure to keep order"""
+        if not jobs:
+            return [], None
+        if self.batch_api:
+            result = self._post_batch(session, jobs)
+            if result is not None:
+                return result
+        done = []
+        for job in jobs:
+            if not self._post(session, job):
+                return done, job
+            done.append(job)
+        return done, None
+
+    @staticmethod
+    def _event(job):
+        event = {'code': job.code, 'key': job.key, 'ts': job.created if job.captured is None else job.captured}
+        if job.lane is not None: event['lane'] = job.lane
+        return event
+
+    def _post_batch(self, session, jobs):
+        """One /api/scan/batch call for the whole round, None when the server has no batch endpoint"""
+        try:
+            r = session.post(CONFIG.API_BATCH_URL, json={'events': [self._event(job) for job in jobs]}, timeout=CONFIG.SUBMIT_TIMEOUT)
+        except requests.RequestException as e:
+            jobs[0].reply = type(e).__name__
+            return [], jobs[0]
+        if r.status_code in (404, 405):
+            print("ℹ️ /api/scan/batch not found - posting scans one by one")
+            self.batch_api = False
+            return None
+        if r.status_code != 200:
+            jobs[0].reply = f"HTTP {r.status_code}"
+            return [], jobs[0]
+        results = r.json().get('results', [])
+        for job, result in zip(jobs, results):
+            job.ok = result.get('status') == 'success'
+            job.reply = result.get('message', '')
+        answered = jobs[:len(results)]
+        return answered, (jobs[len(answered)] if len(answered) < len(jobs) else None)
+
+    def _post(self, session, job) -> bool:
+        """True once the server answered this scan (accepted or rejected), False = retry later"""
+        try:
+            r = session.post(CONFIG.API_URL, json=self._event(job), timeout=CONFIG.SUBMIT_TIMEOUT)
+        except requests.RequestException as e:
+            job.reply = type(e).__name__
+            return False
+        if r.status_code >= 500 or r.status_code in (408, 429):
+            job.reply = f"HTTP {r.status_code}"
+            return False
+        job.ok = r.status_code == 200
+        try:
+            job.reply = r.json().get('message', '')
+        except ValueError:
+            job.reply = f"HTTP {r.status_code}"
+        return True
+
+    def _failed(self, job):
+        """Count the failed attempt; the scanner of the job at the head of the spool reports it"""
+        self.failures += 1
+        on_fail = self.fails.get(job.key)
+        if on_fail:
+            try:
+                on_fail(job)
+            except Exception as e:
+                print(f"⚠️ Scan fail hook: {e}")
+
+    def _ack(self, jobs):
+        acks: Dict[Callable, List[ScanJob]] = {}
+        for job in jobs:
+            self.fails.pop(job.key, None)
+            ack = self.acks.pop(job.key, None)
+            if ack: acks.setdefault(ack, []).append(job)
+            else: print(f"{'✅' if job.ok else '⚠️'} {job.name} (spool)")  # Scanned before a restart
+        for ack, group in acks.items():
+            try:
+                ack(group)
+            except Exception as e:
+                print(f"⚠️ Scan ack: {e}")
+
+class SmartScanner:
+    def __init__(self, sync=True, load_model=True, lane=None, submitter=None):
+        self.lane = lane  # Multi-lane: sent with every /api/scan call
+        self.tag = f"[{lane}] " if lane is not None else ""
         self.stats = Stats()
-        self.last_scan_time = 0.0
+        self.last_scan_time = -np.inf  # Replay clocks start at 0 - the first scan must not look like a repeat
         self.last_item = None
+        self.code_times: Dict[str, float] = {}  # code → last time it was sent
         self.message = ""
         self.msg_timer = 0.0
+        self.msg_color = (0, 255, 128)
+        self.submitter = submitter or ScanSubmitter()  # Multi-lane: one shared by every lane
+        self.stats.spool_metrics = self.submitter.metrics
         self.yolo = None
-        self._sync_db()
-        self._init_model()
+        self.class_names = np.empty(0, dtype=object)
+        self.class_barcodes = np.empty(0, dtype=object)
+        self.detect_classes = None
+        self.logic_lock = threading.Lock()
+        self.tracker = BoxTracker()
+        self.frames_since_detect = 0
+        self.detect_requested = True
+        self.detect_latency = 0.0   # EMA, seconds per YOLO call
+        self.frame_interval = 0.0   # EMA, seconds between frames reaching the detect stage
+        self.last_frame_time = 0.0
+        self.motion_gate = MotionGate()
+        self.barcode_roi = BarcodeROITracker(make_barcode_engine())
+        self.zone_file = lane_zone_file(lane)
+        self.zone = load_checkout_zone(self.zone_file)
+        self._zones = {}  # stage → zone it last ran with (stage state resets on change)
+        self.quality = QualityController(self.stats)
+        self._decode_scale = 1.0
+        self.show_metrics = False  # M key: per-stage latency panel
+        self._metrics_lines: List[str] = []
+        self._metrics_time = 0.0
+        self.wake_time = 0.0  # Capture time of the frame that woke the lane
+        self.wake_started = 0.0  # perf_counter() at that wake-up (timestamps may be a replay clock)
+        self.detector = None  # Multi-lane: BatchedDetector shared by every lane
+        self.remote_tracks: Dict[int, int] = {}  # track id → class id already sent (tracks from a detector process)
+        if sync: self._sync_db()
+        if load_model: self._init_model()
+        # Exported CPU models have a fixed input shape - imgsz steps would change nothing
+        self.quality.fixed_imgsz = isinstance(self.yolo, CPUDetector) if load_model else cpu_runtime() is not None
         
     def _sync_db(self):
         print("\n" + "="*50)
@@ -253,18 +1643,26 @@ class SmartScanner:
 
     def _init_model(self):
         # Check if AI is available (GPU check already done at import)
-        if not AI_AVAILABLE:
+        runtime = cpu_runtime()
+        if not AI_AVAILABLE and runtime is None:
             print("\n⏭️ AI System disabled - Barcode only mode")
             print("   Tidak ada GPU/MPS yang tersedia untuk YOLO")
             self.yolo = None
             self.stats.model_name = "Barcode Only"
             return
         
+        self.tracker.reset()
+        self.detect_requested = True
         print("\n🤖 Loading AI model...")
         model_path = CONFIG.YOLO_MODEL if os.path.exists(CONFIG.YOLO_MODEL) else CONFIG.YOLO_MODEL_DEFAULT
         
+        if runtime:
+            self._init_cpu_model(model_path, runtime)
+            return
+        
         try:
             self.yolo = YOLO(model_path)
+            self._build_class_table(self.yolo.names)
             self.stats.model_name = os.path.basename(model_path)
             print(f"✅ Model: {model_path}")
             print(f"   Classes: {self.yolo.names}")
@@ -293,102 +1691,1574 @@ class SmartScanner:
             print(f"❌ Error loading model: {e}")
             self.yolo = None
 
-    def _send_api(self, barcode, name, method):
-        def worker():
+    def _init_cpu_model(self, model_path, runtime):
+        try:
+            artifact = None
+            if CONFIG.INFERENCE_PRECISION == "int8" and os.path.exists(model_path):
+                artifact = export_cache_path(model_path, runtime, "int8")
+                if not os.path.exists(artifact + ".names.json"):
+                    print("⚠️ INT8 model not found - run: python quantize_model.py (using FP32)")
+                    artifact = None
+            artifact = artifact or export_for_cpu(model_path, runtime)
+            if artifact is None:
+                self.yolo = None
+                self.stats.model_name = "Barcode Only"
+                return
+            self.yolo = CPUDetector(artifact, runtime)
+            self._build_class_table(self.yolo.names)
+            self.stats.model_name = os.path.basename(model_path)
+            self.stats.gpu_active = False
+            self.stats.engine = f"{runtime.upper()}{' INT8' if artifact.endswith(('-int8.onnx', '-int8_openvino_model')) else ''} x{CONFIG.INFERENCE_THREADS}"
+            print(f"✅ Model: {model_path} via {runtime} ({CONFIG.INFERENCE_THREADS} threads)")
+            for cls_name in self.yolo.names.values():
+                print(f"   {'✅' if cls_name in AI_TO_BARCODE_MAP else '❌'} {cls_name} → {AI_TO_BARCODE_MAP.get(cls_name, 'NO BARCODE!')}")
+        except Exception as e:
+            print(f"❌ Error loading {runtime} model: {e}")
+            self.yolo = None
+
+    def _send_api(self, items, captured=None):
+        """items: [(barcode, name, method)] - spooled for the submission worker, overlay waits for the ack"""
+        for _, _, method in items:
+            if method == "BARCODE": self.stats.barcode_count += 1
+            else: self.stats.ai_count += 1
+        self.submitter.submit([ScanJob(code, name, method, self.lane, captured=captured) for code, name, method in items], self._on_ack, self._on_fail)
+        self._show("⏳ " + ", ".join(name for _, name, _ in items), (0, 200, 255), 1.5)
+
+    def _on_ack(self, jobs):
+        """Server answer (submission worker thread) → counters, beep, confirmed overlay message"""
+        api = self.stats.histogram('api')  # Queued → acknowledged
+        for job in jobs:
+            self.stats.api_calls += 1
+            if not job.ok: self.stats.api_failures += 1
+            api.add(job.latency_ms)
+            print(f"{'✅' if job.ok else '⚠️'} {self.tag}{job.name}" + ("" if job.ok else f" - {job.reply}"))
+        failed = [job for job in jobs if not job.ok]
+        if failed:
+            self._show("❌ " + ", ".join(f"{job.name}: {job.reply}" for job in failed), (60, 60, 255), 3.0)
+        else:
+            play_beep()
+            self._show("✅ " + ", ".join(job.name for job in jobs), (0, 255, 128), 1.5)
+
+    def _on_fail(self, job):
+        """Delivery attempt without an answer (submission worker thread) - the scan stays spooled"""
+        self.stats.api_calls += 1
+        self.stats.api_failures += 1
+
+    def _show(self, message, color, seconds):
+        self.message, self.msg_color = message, color
+        self.msg_timer = time.time() + seconds
+
+    def set_zone(self, points):
+        """New checkout zone (None = full frame); saved for the next start"""
+        self.zone = CheckoutZone(points) if points is not None and len(points) >= 3 else None
+        try:
+            with open(self.zone_file, 'w') as f:
+                json.dump(self.zone.points.tolist() if self.zone else [], f)
+        except OSError as e:
+            print(f"⚠️ Cannot save zone: {e}")
+        print(f"🟨 {self.tag}Checkout zone: {self.zone.points.tolist() if self.zone else 'full frame'}")
+
+    def _stage_zone(self, stage):
+        """Current zone for a stage + whether it changed since that stage last ran"""
+        zone = self.zone
+        changed = self._zones.get(stage, zone) is not zone
+        self._zones[stage] = zone
+        return zone, changed
+
+    def decode_barcode(self, frame, gray=None) -> List[BarcodeResult]:
+        """gray: same frame as grayscale at any size (e.g. camera.gray()), skips cvtColor"""
+        t0 = time.perf_counter()
+        zone, changed = self._stage_zone('barcode')
+        source_scale = gray.shape[1] / frame.shape[1] if gray is not None else 1.0
+        scale = self.quality.level.decode_scale * source_scale  # decoded image size / frame size
+        if changed or scale != self._decode_scale:
+            self.barcode_roi.reset()  # ROI rects are in the old crop / scale
+            self._decode_scale = scale
+        if gray is None:
+            gray = cv2.cvtColor(zone.crop(frame) if zone else frame, cv2.COLOR_BGR2GRAY)
+        elif zone:
+            gray = zone.crop(gray, source_scale)
+        if scale != source_scale:
+            gray = cv2.resize(gray, None, fx=scale / source_scale, fy=scale / source_scale, interpolation=cv2.INTER_AREA)
+        self.stats.histogram('cvtColor').time(t0)
+        t1 = time.perf_counter()
+        results = self.barcode_roi.decode(gray)
+        self.stats.histogram('barcode').time(t1)
+        dx, dy = zone.offset if zone else (0, 0)
+        if scale != 1.0 or zone:
+            results = [BarcodeResult(r.code, (int(r.rect[0] / scale) + dx, int(r.rect[1] / scale) + dy,
+                                              int(r.rect[2] / scale), int(r.rect[3] / scale))) for r in results]
+        self.stats.time_stage('decode', time.perf_counter() - t0)
+        return results
+
+    def use_detector(self, detector):
+        """Lane scanner: YOLO calls go to the shared BatchedDetector, class tables are its owner's"""
+        owner = detector.owner
+        self.detector = detector
+        self.yolo, self.class_names, self.class_barcodes = owner.yolo, owner.class_names, owner.class_barcodes
+        self.detect_classes = owner.detect_classes
+        for name in ('model_name', 'gpu_active', 'gpu_name', 'engine'):
+            setattr(self.stats, name, getattr(owner.stats, name))
+        self.tracker.reset()
+        self.request_detection()
+
+    def _build_class_table(self, names):
+        """class id → name / barcode arrays, built once per model load"""
+        size = max(names) + 1 if names else 0
+        self.class_names = np.array([names.get(i, str(i)) for i in range(size)], dtype=object)
+        self.class_barcodes = np.array([AI_TO_BARCODE_MAP.get(n) or AI_TO_BARCODE_MAP.get(n.lower()) for n in self.class_names], dtype=object)
+        mapped = [i for i, bc in enumerate(self.class_barcodes) if bc]
+        # Nothing mapped yet → keep every class so the overlay can show "[NO MAP!]"
+        self.detect_classes = mapped if CONFIG.DETECT_MAPPED_ONLY and mapped else None
+
+    def detect_array(self, frame) -> np.ndarray:
+        """YOLO → DET_DTYPE array (one host copy of the box tensor per frame)"""
+        yolo = self.yolo
+        if self.detector:
+            return self.detector.detect(frame, min(CONFIG.INFERENCE_IMGSZ, self.quality.level.imgsz))
+        if isinstance(yolo, CPUDetector):
             try:
-                r = requests.post(CONFIG.API_URL, json={'code': barcode}, timeout=2)
-                print(f"{'✅' if r.status_code == 200 else '⚠️'} {name}")
-            except: pass
-        threading.Thread(target=worker, daemon=True).start()
-        if method == "BARCODE": self.stats.barcode_count += 1
-        else: self.stats.ai_count += 1
-        threading.Thread(target=lambda: play_beep(), daemon=True).start()
-        self.message = f"✅ {name}"
-        self.msg_timer = time.time() + 1.5
-
-    def process(self, frame):
-        self.stats.update_fps()
-        now = time.time()
-        
-        # Barcode
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        decoded = pyzbar_decode(gray)
-        barcode = BarcodeResult(decoded[0].data.decode('utf-8'), decoded[0].rect) if decoded else None
-        
-        # AI
-        ai_results = []
-        if self.yolo:
+                return yolo.detect(frame, CONFIG.CONFIDENCE_DISPLAY, self.detect_classes, CONFIG.MAX_DET)
+            except Exception as e:
+                print(f"⚠️ {yolo.runtime} inference error: {e}")
+        elif yolo:
             try:
-                results = self.yolo(frame, verbose=False, conf=CONFIG.CONFIDENCE_DISPLAY)[0]
-                for box in results.boxes:
-                    ai_results.append(AIResult(
-                        class_name=results.names[int(box.cls[0])],
-                        confidence=float(box.conf[0]),
-                        bbox=tuple(box.xyxy[0].tolist())
-                    ))
+                imgsz = min(CONFIG.INFERENCE_IMGSZ, self.quality.level.imgsz)
+                results = yolo(frame, verbose=False, conf=CONFIG.CONFIDENCE_DISPLAY, imgsz=imgsz,
+                               classes=self.detect_classes, max_det=CONFIG.MAX_DET)[0]
+                return to_detections(results.boxes.data.cpu().numpy())
             except: pass
+        return np.empty(0, dtype=DET_DTYPE)
+
+    def detect(self, frame) -> List[AIResult]:
+        dets = self.detect_array(frame)
+        if not len(dets):
+            return []
+        classes = dets['cls'].tolist()
+        names, barcodes = self.class_names[dets['cls']], self.class_barcodes[dets['cls']]
+        return [AIResult(name, conf, tuple(box), barcode or None, class_id=cls)
+                for name, conf, box, barcode, cls in zip(names, dets['conf'].tolist(), dets['xyxy'].tolist(), barcodes, classes)]
+
+    def gate(self, frame, timestamp):
+        """False while the lane is idle - decoders are skipped for this frame"""
+        if not CONFIG.MOTION_GATE:
+            return True
+        zone, changed = self._stage_zone('gate')
+        if changed: self.motion_gate = MotionGate()
+        active, woke = self.motion_gate.check(zone.crop(frame) if zone else frame, timestamp)
+        self.stats.lane_active = active
+        if active: self.stats.active_frames += 1
+        else: self.stats.idle_frames += 1
+        if woke:
+            self.wake_time, self.wake_started = timestamp, time.perf_counter()
+            self.request_detection()
+        return active
+
+    def mark_decoded(self, timestamp):
+        """First decode of the waking frame closes the wake-latency measurement"""
+        if self.wake_time and timestamp >= self.wake_time:
+            self.stats.wake_latency_ms = (time.perf_counter() - self.wake_started) * 1000
+            self.wake_time = 0.0
+
+    def request_detection(self):
+        """Run YOLO on the next frame instead of waiting for the stride"""
+        self.detect_requested = True
+
+    def _detect_stride(self):
+        if self.frame_interval <= 0 or self.detect_latency <= 0:
+            return CONFIG.DETECT_STRIDE_MIN
+        stride = int(np.ceil(self.detect_latency / (self.frame_interval * CONFIG.DETECT_BUDGET)))
+        stride *= self.quality.level.stride_factor
+        return max(CONFIG.DETECT_STRIDE_MIN, min(CONFIG.DETECT_STRIDE_MAX, stride))
+
+    def detect_or_track(self, frame) -> List[AIResult]:
+        """YOLO on the checkout zone, boxes mapped back to frame coordinates"""
+        if not self.yolo:
+            return []
+        zone, changed = self._stage_zone('detect')
+        if changed:
+            self.tracker.reset()
+            self.request_detection()
+        if zone is None:
+            return self._detect_or_track(frame)
+        dx, dy = zone.offset
+        return [replace(r, bbox=(r.bbox[0] + dx, r.bbox[1] + dy, r.bbox[2] + dx, r.bbox[3] + dy))
+                for r in self._detect_or_track(zone.crop(frame))]
+
+    def _detect_or_track(self, frame) -> List[AIResult]:
+        """YOLO every N frames (or on demand), optical-flow tracked boxes in between"""
+        now = time.time()
+        if self.last_frame_time and now - self.last_frame_time < 1.0:
+            self.frame_interval = 0.9 * self.frame_interval + 0.1 * (now - self.last_frame_time) if self.frame_interval else now - self.last_frame_time
+        self.last_frame_time = now
         
-        # Logic
-        target_code, target_name, method = None, None, ""
+        if CONFIG.DETECT_MODE != "track":
+            t0 = time.perf_counter()
+            ai_results = self.detect(frame)
+            self.stats.time_stage('detect', time.perf_counter() - t0)
+            self.stats.update_ai_fps()
+            return ai_results
         
-        if barcode:
-            target_code = barcode.code
-            target_name = BARCODE_TO_PRODUCT_NAME.get(target_code, f"Unknown ({target_code})")
-            method = "BARCODE"
+        t0 = time.perf_counter()
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        self.stats.histogram('cvtColor').time(t0)
+        self.stats.detect_stride = self._detect_stride()
+        self.frames_since_detect += 1
+        if self.detect_requested or self.tracker.lost or self.frames_since_detect >= self.stats.detect_stride:
+            t0 = time.perf_counter()
+            detections = self.detect(frame)
+            latency = time.perf_counter() - t0
+            self.detect_latency = 0.8 * self.detect_latency + 0.2 * latency if self.detect_latency else latency
+            self.stats.time_stage('detect', latency)
+            self.stats.update_ai_fps()
+            self.tracker.update(gray, detections)
+            self.frames_since_detect = 0
+            self.detect_requested = False
+        else:
+            t0 = time.perf_counter()
+            self.tracker.predict(gray)
+            self.stats.histogram('track').time(t0)
+        return self.tracker.results
+
+    def _claim(self, code, now):
+        """Per-code cooldown; caller holds logic_lock"""
+        if now - self.code_times.get(code, -np.inf) <= CONFIG.COOLDOWN_SAME_ITEM:
+            return False
+        if len(self.code_times) > 256:
+            self.code_times = {c: t for c, t in self.code_times.items() if now - t <= CONFIG.COOLDOWN_SAME_ITEM}
+        self.code_times[code] = now
+        self.last_scan_time = now
+        self.last_item = code
+        return True
+
+    def decide(self, barcodes, ai_results, now):
+        """Barcodes win over AI; every barcode in the frame is sent as one batch"""
+        if barcodes:
+            with self.logic_lock:
+                fresh = [bc for bc in barcodes if self._claim(bc.code, now)]
+            if fresh:
+                items = [(bc.code, BARCODE_TO_PRODUCT_NAME.get(bc.code, f"Unknown ({bc.code})"), "BARCODE") for bc in fresh]
+                print(f"\n📦 {self.tag}{', '.join(name for _, name, _ in items)} [BARCODE x{len(items)}]")
+                self._send_api(items, now)
+        elif ai_results and CONFIG.DETECT_MODE == "track":
+            self._decide_tracks(ai_results, now)
         elif ai_results:
             best = max(ai_results, key=lambda x: x.confidence)
             if best.confidence >= CONFIG.CONFIDENCE_AUTO_INPUT and best.barcode:
-                target_code, target_name, method = best.barcode, best.class_name, "AI"
+                with self.logic_lock:
+                    send = now - self.last_scan_time > CONFIG.COOLDOWN_DIFFERENT_ITEM and self._claim(best.barcode, now)
+                if send:
+                    print(f"\n📦 {self.tag}{best.class_name} [AI]")
+                    self._send_api([(best.barcode, best.class_name, "AI")], now)
             elif best.confidence >= CONFIG.CONFIDENCE_SUGGESTION:
-                self.message = f"💡 {best.class_name}? ({best.confidence*100:.0f}%)"
-                self.msg_timer = now + 0.5
-        
-        if target_code:
-            cooldown = CONFIG.COOLDOWN_SAME_ITEM if target_code == self.last_item else CONFIG.COOLDOWN_DIFFERENT_ITEM
-            if now - self.last_scan_time > cooldown:
-                print(f"\n📦 {target_name} [{method}]")
-                self._send_api(target_code, target_name, method)
-                self.last_scan_time = now
-                self.last_item = target_code
-        
-        # Draw
-        self._draw(frame, barcode, ai_results)
+                self._show(f"💡 {best.class_name}? ({best.confidence*100:.0f}%)", (0, 255, 128), 0.5)
+
+    def _decide_tracks(self, ai_results, now):
+        """Each track triggers auto-input at most once instead of the global cooldown"""
+        best = max(ai_results, key=lambda x: x.confidence)
+        if CONFIG.CONFIDENCE_SUGGESTION <= best.confidence < CONFIG.CONFIDENCE_AUTO_INPUT:
+            self._show(f"💡 {best.class_name}? ({best.confidence*100:.0f}%)", (0, 255, 128), 0.5)
+        for ai in ai_results:
+            if ai.confidence < CONFIG.CONFIDENCE_AUTO_INPUT or not ai.barcode:
+                continue
+            with self.logic_lock:
+                if not self._mark_track_sent(ai):
+                    continue
+                # Barcode stage already added this item
+                if not self._claim(ai.barcode, now):
+                    continue
+            print(f"\n📦 {self.tag}{ai.class_name} [AI #{ai.track_id}]")
+            self._send_api([(ai.barcode, ai.class_name, "AI")], now)
+
+    def _mark_track_sent(self, ai):
+        """True the first time a track (or a class switch on it) reaches auto-input; caller holds logic_lock"""
+        if self.yolo:
+            track = self.tracker.get(ai.track_id)
+            if track is None or track.sent: return False
+            track.sent = True
+            return True
+        # No local model → the track lives in a detector worker process (ProcessPipeline)
+        if ai.track_id is None or self.remote_tracks.get(ai.track_id) == ai.class_id:
+            return False
+        if len(self.remote_tracks) > 256:
+            for track_id in sorted(self.remote_tracks)[:128]: del self.remote_tracks[track_id]
+        self.remote_tracks[ai.track_id] = ai.class_id
+        return True
+
+    def process(self, frame, seq=0, gray=None, now=None):
+        """Sequential path: every stage on the calling thread (see ScannerPipeline); now = camera clock"""
+        self.stats.update_fps()
+        self.quality.update(time.time(), seq)
+        now = time.time() if now is None else now
+        if not self.gate(frame, now):
+            self._draw(frame, [], [])
+            return frame
+        barcodes = self.decode_barcode(frame, gray)
+        self.mark_decoded(now)
+        ai_results = self.detect_or_track(frame)
+        self.decide(barcodes, ai_results, now)
+        self._draw(frame, barcodes, ai_results)
         return frame
 
-    def _draw(self, frame, barcode, ai_results):
+    def _draw(self, frame, barcodes, ai_results):
+        t0 = time.perf_counter()
         h, w = frame.shape[:2]
+        level = self.quality.level
+        
+        # Checkout zone
+        zone = self.zone
+        if zone is not None and level.overlay:
+            cv2.polylines(frame, [zone.points], True, (0, 215, 255), 1)
         
         # Panel
-        cv2.rectangle(frame, (10, 10), (280, 110), (30, 30, 40), -1)
-        cv2.rectangle(frame, (10, 10), (280, 110), (255, 255, 0), 1)
+        cv2.rectangle(frame, (10, 10), (280, 170), (30, 30, 40), -1)
+        cv2.rectangle(frame, (10, 10), (280, 170), (255, 255, 0), 1)
         cv2.putText(frame, "SMART RETAIL v3.0", (20, 35), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 0), 2)
-        cv2.putText(frame, f"FPS: {self.stats.fps:.1f}", (20, 55), cv2.FONT_HERSHEY_SIMPLEX, 0.4, (0, 255, 0), 1)
-        cv2.putText(frame, f"GPU: {self.stats.gpu_name if self.stats.gpu_active else 'OFF'}", (20, 75), cv2.FONT_HERSHEY_SIMPLEX, 0.4, (255, 255, 255), 1)
+        cv2.putText(frame, f"FPS: {self.stats.fps:.1f} | AI: {self.stats.ai_fps:.1f} (1/{self.stats.detect_stride})", (20, 55), cv2.FONT_HERSHEY_SIMPLEX, 0.4, (0, 255, 0), 1)
+        device = f"GPU: {self.stats.gpu_name}" if self.stats.gpu_active else (f"CPU: {self.stats.engine}" if self.stats.engine else "GPU: OFF")
+        cv2.putText(frame, device, (20, 75), cv2.FONT_HERSHEY_SIMPLEX, 0.4, (255, 255, 255), 1)
         cv2.putText(frame, f"Scans: {self.stats.barcode_count} BC | {self.stats.ai_count} AI", (20, 95), cv2.FONT_HERSHEY_SIMPLEX, 0.4, (255, 255, 255), 1)
+        lane = "ACTIVE" if self.stats.lane_active else "IDLE"
+        cv2.putText(frame, f"Lane: {lane} | Idle {self.stats.idle_ratio*100:.0f}% | Wake {self.stats.wake_latency_ms:.0f}ms", (20, 115), cv2.FONT_HERSHEY_SIMPLEX, 0.4, (0, 255, 0) if self.stats.lane_active else (150, 150, 150), 1)
+        imgsz = self.yolo.imgsz if isinstance(self.yolo, CPUDetector) else min(CONFIG.INFERENCE_IMGSZ, level.imgsz)
+        quality = f"Q: L{self.quality.index} x{level.stride_factor} {imgsz}px dec {level.decode_scale*100:.0f}%"
+        if self.quality.index: quality += f" ({self.stats.quality_reason})"
+        cv2.putText(frame, quality, (20, 135), cv2.FONT_HERSHEY_SIMPLEX, 0.4, (0, 255, 0) if not self.quality.index else (0, 165, 255), 1)
+        spool = self.submitter
+        color = (60, 60, 255) if spool.offline else ((0, 165, 255) if spool.depth else (0, 255, 0))
+        cv2.putText(frame, f"Spool: {spool.depth}{' OFFLINE' if spool.offline else ''} | {spool.drain_rate:.1f}/s", (20, 155),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.4, color, 1)
         
         # Barcode
-        if barcode:
+        for barcode in barcodes if level.overlay else ():
             x, y, bw, bh = barcode.rect
             cv2.rectangle(frame, (x, y), (x+bw, y+bh), (0, 255, 128), 3)
+            if level.overlay < 2: continue
             name = BARCODE_TO_PRODUCT_NAME.get(barcode.code, "Unknown")
             cv2.putText(frame, name, (x, y-10), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 128), 2)
         
         # AI
-        for ai in ai_results:
+        for ai in ai_results if level.overlay else ():
             x1, y1, x2, y2 = map(int, ai.bbox)
             color = (0, 255, 0) if ai.confidence >= CONFIG.CONFIDENCE_AUTO_INPUT else (0, 165, 255)
             cv2.rectangle(frame, (x1, y1), (x2, y2), color, 2)
+            if level.overlay < 2: continue
             label = f"{ai.class_name} ({ai.confidence*100:.0f}%)"
+            if ai.track_id is not None: label = f"#{ai.track_id} " + label
             if not ai.barcode: label += " [NO MAP!]"
             cv2.putText(frame, label, (x1, y1-10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 2)
         
         # Message
         if time.time() < self.msg_timer:
-            cv2.rectangle(frame, (0, h-50), (w, h), (0, 255, 128), -1)
+            cv2.rectangle(frame, (0, h-50), (w, h), self.msg_color, -1)
             cv2.putText(frame, self.message, (20, h-15), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (30, 30, 40), 2)
         
+        # Latency panel (M)
+        if self.show_metrics:
+            self._draw_metrics(frame)
+        
         # Instructions
-        cv2.putText(frame, "Q:Quit R:Reload S:Sync", (10, h-10), cv2.FONT_HERSHEY_SIMPLEX, 0.4, (150, 150, 150), 1)
+        cv2.putText(frame, "Q:Quit R:Reload S:Sync D:Detect M:Metrics | Drag:Zone RClick:Full", (10, h-10), cv2.FONT_HERSHEY_SIMPLEX, 0.4, (150, 150, 150), 1)
+        self.stats.time_stage('draw', time.perf_counter() - t0)
+
+    def metrics_lines(self) -> List[str]:
+        """p50/p95/p99 per stage + counters, recomputed at most twice a second"""
+        now = time.time()
+        if now - self._metrics_time < 0.5:
+            return self._metrics_lines
+        lines = [f"{'stage':<9}{'p50':>7}{'p95':>7}{'p99':>7}"]
+        for name, hist in sorted(self.stats.stages.items()):
+            pct = hist.percentiles()
+            if pct: lines.append(f"{name:<9}" + "".join(f"{v:>7.1f}" for v in pct))
+        dropped = sum(self.stats.dropped_frames.values())
+        lines.append(f"dropped {dropped} | api fail {self.stats.api_failures}/{self.stats.api_calls}")
+        self._metrics_lines, self._metrics_time = lines, now
+        return lines
+
+    def _draw_metrics(self, frame):
+        lines = self.metrics_lines()
+        x = frame.shape[1] - 230
+        cv2.rectangle(frame, (x, 10), (x + 220, 20 + 16 * len(lines)), (30, 30, 40), -1)
+        for i, line in enumerate(lines):
+            cv2.putText(frame, line, (x + 8, 26 + 16 * i), cv2.FONT_HERSHEY_PLAIN, 0.9, (255, 255, 255), 1)
+
+# ═══════════════════════════════════════════════════════════════════════════════
+#                    🧵 PIPELINE - CAPTURE / DECODE / DETECT / RENDER
+# ═══════════════════════════════════════════════════════════════════════════════
+class DropOldestQueue:
+    """Bounded queue - when full, the oldest item is dropped to make room"""
+    def __init__(self, maxsize=2):
+        self.items = deque()
+        self.maxsize = maxsize
+        self.cond = threading.Condition()
+        self.dropped = 0
+        self.closed = False
+
+    def put(self, item):
+        with self.cond:
+            if len(self.items) >= self.maxsize:
+                self.items.popleft()
+                self.dropped += 1
+            self.items.append(item)
+            self.cond.notify()
+
+    def get(self, timeout=None):
+        with self.cond:
+            self.cond.wait_for(lambda: self.items or self.closed, timeout)
+            return self.items.popleft() if self.items else None
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+@dataclass
+class FramePacket:
+    seq: int
+    frame: np.ndarray
+    timestamp: float
+
+class ScannerPipeline:
+    """
+    Runs each stage of SmartScanner on its own worker:
+        capture → [decode_q] → barcode ─┐
+                → [detect_q] → YOLO   ──┼→ results (tagged with frame seq)
+                → [render_q] → _draw ◄──┘ → [output_q] → imshow (main thread)
+    A slow detector only drops its own frames; render keeps camera rate and only
+    draws results whose seq is within PIPELINE_MAX_RESULT_AGE of the shown frame.
+    PIPELINE_LOCKSTEP: capture waits until every stage is done with a frame, and YOLO
+    decides after the barcode stage of the same frame - no drops, same events every run.
+    """
+    def __init__(self, camera, scanner):
+        self.camera = camera
+        self.scanner = scanner
+        self.decode_q = DropOldestQueue(CONFIG.PIPELINE_QUEUE_SIZE)
+        self.detect_q = DropOldestQueue(CONFIG.PIPELINE_QUEUE_SIZE)
+        self.render_q = DropOldestQueue(CONFIG.PIPELINE_QUEUE_SIZE)
+        self.output_q = DropOldestQueue(1)
+        self.result_lock = threading.Lock()
+        self.barcode_result: Tuple[int, List[BarcodeResult]] = (-1, [])
+        self.ai_result: Tuple[int, List[AIResult]] = (-1, [])
+        self.barcode_hits = deque(maxlen=64)  # seqs where a barcode was decoded
+        self.draw = True  # Headless without preview viewers → frames are not drawn
+        self.stopped = False
+        self.threads = []
+        self.error_reported = {}  # stage → time of the last printed error
+        self.reload_requested = False  # Set by R / SIGHUP, handled by the detect thread between frames
+        self.stale = 0  # Packets whose camera slot was overwritten before/while a stage used it
+        self.lockstep = CONFIG.PIPELINE_LOCKSTEP
+        self.flight = threading.Condition()
+        self.in_flight = 0    # Lockstep: stages still working on the current frame
+        self.decoded_seq = 0  # Lockstep: last frame the barcode stage finished
+        self.settled = 0      # Lockstep: last frame every stage finished
+
+    def start(self):
+        for target in (self._capture_loop, self._decode_loop, self._detect_loop, self._render_loop):
+            t = threading.Thread(target=target, daemon=True)
+            t.start()
+            self.threads.append(t)
+        return self
+
+    def stop(self):
+        self.stopped = True
+        for q in (self.decode_q, self.detect_q, self.render_q, self.output_q):
+            q.close()
+        with self.flight:
+            self.flight.notify_all()
+        for t in self.threads:
+            t.join(timeout=1.0)
+
+    @property
+    def dropped(self):
+        return {'decode': self.decode_q.dropped, 'detect': self.detect_q.dropped, 'render': self.render_q.dropped,
+                'stale': self.stale}
+
+    def _fresh(self, packet):
+        """Packets hold views into the camera ring: False (and skip) once the slot was reused"""
+        if self.camera.is_fresh(packet.seq):
+            return True
+        self.stale += 1
+        return False
+
+    @property
+    def idle(self):
+        if self.lockstep:
+            return self.settled >= self.camera.seq
+        return not (self.decode_q.items or self.detect_q.items or self.render_q.items)
+
+    def _dispatch(self, packet, queues):
+        """Lockstep: hand the frame to its stages and wait until all of them are done with it"""
+        if not self.lockstep:
+            for q in queues: q.put(packet)
+            return
+        with self.flight:
+            self.in_flight = len(queues)
+        for q in queues: q.put(packet)
+        with self.flight:
+            self.flight.wait_for(lambda: not self.in_flight or self.stopped)
+            self.settled = packet.seq
+
+    def _done(self, stage, seq):
+        if not self.lockstep: return
+        with self.flight:
+            if stage == 'decode': self.decoded_seq = seq
+            self.in_flight -= 1
+            self.flight.notify_all()
+
+    def _wait_decoded(self, seq):
+        """Lockstep: AI decisions wait for the barcode verdict on the same frame"""
+        if not self.lockstep: return
+        with self.flight:
+            self.flight.wait_for(lambda: self.decoded_seq >= seq or self.stopped)
+
+    def reload_model(self):
+        """R key / SIGHUP: the detect thread reloads between two frames (it owns the model)"""
+        self.reload_requested = True
+
+    def _stage_failed(self, stage, error):
+        """A stage raised on one frame: count it, print (max every 5 s), keep the thread alive"""
+        self.scanner.stats.count_drop(f'{stage}_error')
+        now = time.time()
+        if now - self.error_reported.get(stage, 0.0) > 5.0:
+            self.error_reported[stage] = now
+            print(f"⚠️ {stage} stage error: {type(error).__name__}: {error}")
+
+    def _capture_loop(self):
+        last_seq = 0
+        while not self.stopped:
+            seq, frame = self.camera.read_new(last_seq, timeout=0.1)
+            if frame is None: continue
+            if last_seq and seq - last_seq > 1: self.scanner.stats.count_drop('camera', seq - last_seq - 1)
+            last_seq = seq
+            packet = FramePacket(seq, frame, self.camera.clock(seq))
+            if self.scanner.gate(frame, packet.timestamp):
+                queues = [self.decode_q, self.detect_q, self.render_q] if self.scanner.yolo else [self.decode_q, self.render_q]
+            else:
+                queues = [self.render_q] if seq % CONFIG.MOTION_IDLE_RENDER_EVERY == 0 else []
+            self._dispatch(packet, queues)
+
+    def _decode_loop(self):
+        while not self.stopped:
+            packet = self.decode_q.get(timeout=0.1)
+            if packet is None: continue
+            try:
+                if not self._fresh(packet): continue
+                barcodes = self.scanner.decode_barcode(packet.frame, self.camera.gray(packet.seq))
+                if not self._fresh(packet): continue  # Decoded a half-overwritten frame
+                self.scanner.mark_decoded(packet.timestamp)
+                with self.result_lock:
+                    self.barcode_result = (packet.seq, barcodes)
+                    if barcodes: self.barcode_hits.append(packet.seq)
+                if barcodes:
+                    self.scanner.decide(barcodes, [], packet.timestamp)
+            except Exception as e:
+                self._stage_failed('decode', e)
+            finally:
+                self._done('decode', packet.seq)
+
+    def _detect_loop(self):
+        while not self.stopped:
+            if self.reload_requested:
+                self.reload_requested = False
+                try:
+                    self.scanner._init_model()
+                except Exception as e:
+                    self._stage_failed('reload', e)
+            packet = self.detect_q.get(timeout=0.1)
+            if packet is None: continue
+            try:
+                if not self._fresh(packet): continue
+                ai_results = self.scanner.detect_or_track(packet.frame)
+                if not self._fresh(packet): continue
+                self._wait_decoded(packet.seq)
+                with self.result_lock:
+                    self.ai_result = (packet.seq, ai_results)
+                    barcode_won = packet.seq in self.barcode_hits
+                # Same frame already produced a barcode → barcode takes priority
+                if ai_results and not barcode_won:
+                    self.scanner.decide([], ai_results, packet.timestamp)
+            except Exception as e:
+                self._stage_failed('detect', e)
+            finally:
+                self._done('detect', packet.seq)
+
+    def _render_loop(self):
+        max_age = CONFIG.PIPELINE_MAX_RESULT_AGE
+        while not self.stopped:
+            packet = self.render_q.get(timeout=0.1)
+            if packet is None: continue
+            try:
+                self.scanner.stats.update_fps()
+                self.scanner.quality.update(time.time(), packet.seq)
+                self.scanner.stats.dropped_frames.update(self.dropped)
+                if not self.draw: continue
+                with self.result_lock:
+                    bc_seq, barcodes = self.barcode_result
+                    ai_seq, ai_results = self.ai_result
+                if abs(packet.seq - bc_seq) > max_age: barcodes = []
+                if abs(packet.seq - ai_seq) > max_age: ai_results = []
+                frame = packet.frame.copy()
+                if not self._fresh(packet): continue
+                self.scanner._draw(frame, barcodes, ai_results)
+                self.output_q.put(frame)
+            except Exception as e:
+                self._stage_failed('render', e)
+            finally:
+                self._done('render', packet.seq)
+
+# ═══════════════════════════════════════════════════════════════════════════════
+#                  🚌 FRAME BUS - SHARED MEMORY RING FOR WORKER PROCESSES
+# ═══════════════════════════════════════════════════════════════════════════════
+class SharedFrameRing:
+    """
+    Camera frames in multiprocessing.shared_memory, read in place by other processes:
+        header int64[16]       latest seq, slot count, frame shape, closed flag, controls
+        slots  int64[N]        seq held by each slot (-1 while it is being written)
+        stamps float64[N]      capture time
+        active uint8[N]        motion gate verdict (idle frames only matter to the recorder)
+        frames uint8[N,h,w,c]
+    Same read_new() / is_fresh() contract as ThreadedCamera: a reader checks
+    is_fresh(seq) after using a view because the writer may have lapped it.
+    """
+    HEADER = 16
+    SEQ, SLOTS, HEIGHT, WIDTH, CHANNELS, CLOSED, QUALITY, DETECT, RELOAD, DECODE_QUALITY = range(10)
+
+    def __init__(self, shape=None, slots=None, name=None):
+        """shape → create the ring (owner), name → attach to an existing one"""
+        self.owner = name is None
+        if self.owner:
+            slots = slots or CONFIG.FRAME_BUS_SLOTS
+            h, w, c = shape
+            self.shm = shared_memory.SharedMemory(create=True, size=self._offsets(slots)[-1] + slots * h * w * c)
+            self.header = np.ndarray(self.HEADER, np.int64, self.shm.buf)
+            self.header[:] = 0
+            self.header[[self.SLOTS, self.HEIGHT, self.WIDTH, self.CHANNELS]] = slots, h, w, c
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            self.header = np.ndarray(self.HEADER, np.int64, self.shm.buf)
+            slots, h, w, c = (int(v) for v in self.header[[self.SLOTS, self.HEIGHT, self.WIDTH, self.CHANNELS]])
+        self.size, self.shape = slots, (h, w, c)
+        _, slot_at, stamp_at, active_at, frame_at = self._offsets(slots)
+        self.slots = np.ndarray(slots, np.int64, self.shm.buf, slot_at)
+        self.stamps = np.ndarray(slots, np.float64, self.shm.buf, stamp_at)
+        self.active = np.ndarray(slots, np.uint8, self.shm.buf, active_at)
+        self.frames = np.ndarray((slots, h, w, c), np.uint8, self.shm.buf, frame_at)
+        if self.owner: self.slots[:] = -1
+
+    @classmethod
+    def _offsets(cls, slots):
+        header = cls.HEADER * 8
+        frames = (header + slots * 17 + 63) // 64 * 64  # Frames 64-byte aligned
+        return 0, header, header + slots * 8, header + slots * 16, frames
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    @property
+    def latest(self):
+        return int(self.header[self.SEQ])
+
+    @property
+    def closed(self):
+        return bool(self.header[self.CLOSED])
+
+    def control(self, index):
+        return int(self.header[index])
+
+    def set_control(self, index, value):
+        self.header[index] = value
+
+    def bump(self, index):
+        """Counter controls (DETECT / RELOAD): readers act when the value changes"""
+        self.header[index] += 1
+
+    def publish(self, frame, seq, timestamp, active=True):
+        """Copy `seq` (increasing, e.g. the camera seq) into its slot - the only copy on the bus"""
+        slot = seq % self.size
+        self.slots[slot] = -1
+        if frame.shape == self.shape: np.copyto(self.frames[slot], frame)
+        else: cv2.resize(frame, (self.shape[1], self.shape[0]), dst=self.frames[slot])
+        self.stamps[slot] = timestamp
+        self.active[slot] = active
+        self.slots[slot] = seq
+        self.header[self.SEQ] = seq
+
+    def frame(self, seq):
+        """Read-only view of frame `seq`, None once it has been overwritten"""
+        slot = seq % self.size
+        if self.slots[slot] != seq:
+            return None
+        view = self.frames[slot].view()
+        view.flags.writeable = False
+        return view
+
+    def read_new(self, after_seq=0, timeout=1.0):
+        """Poll until a frame newer than after_seq is published → (seq, read-only view)"""
+        deadline = time.perf_counter() + (timeout or 0)
+        while not self.closed:
+            seq = self.latest
+            if seq > after_seq:
+                view = self.frame(seq)
+                if view is not None:
+                    return seq, view
+            if time.perf_counter() >= deadline:
+                break
+            time.sleep(CONFIG.FRAME_BUS_POLL)
+        return after_seq, None
+
+    def is_fresh(self, seq):
+        return self.slots[seq % self.size] == seq
+
+    def is_active(self, seq):
+        return bool(self.active[seq % self.size])
+
+    def stamp(self, seq):
+        return float(self.stamps[seq % self.size])
+
+    def close(self):
+        if self.owner: self.header[self.CLOSED] = 1
+        # numpy views pin the buffer - drop them before closing the mapping
+        self.header = self.slots = self.stamps = self.active = self.frames = None
+        self.shm.close()
+        if self.owner: self.shm.unlink()
+
+def drain_stage_samples(stats, seen) -> Dict[str, List[float]]:
+    """Stage timings (ms) recorded since the last call - a worker ships them to the aggregator"""
+    out = {}
+    for name, hist in list(stats.stages.items()):
+        with hist.lock:
+            new = min(hist.count - seen.get(name, 0), len(hist.samples))
+            if new > 0: out[name] = list(hist.samples)[-new:]
+            seen[name] = hist.count
+    return out
+
+def _file_mtime(path):
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return None
+
+def stage_worker(stage, bus_name, results, stop, config):
+    """
+    Worker process: one SmartScanner stage ('barcode' or 'detect') on frames read in
+    place from the bus. Only small tuples go back on `results`:
+        (stage, seq, capture time, BarcodeResult/AIResult list, stage samples, detect stride)
+    """
+    vars(CONFIG).update(config)  # CLI overrides of the parent (spawned workers re-import the module)
+    ring = SharedFrameRing(name=bus_name)
+    scanner = SmartScanner(sync=False, load_model=stage == 'detect')
+    if stage == 'detect':
+        stats = scanner.stats
+        results.put(('model', scanner.yolo is not None, stats.model_name, stats.gpu_active, stats.gpu_name, stats.engine))
+        if not scanner.yolo:
+            ring.close()
+            return
+    seen = {}
+    zone_mtime, zone_check = _file_mtime(CONFIG.CHECKOUT_ZONE_FILE), 0.0
+    detects, reloads = ring.control(ring.DETECT), ring.control(ring.RELOAD)
+    last_seq = 0 if CONFIG.PIPELINE_LOCKSTEP else ring.latest  # Lockstep: the frame on the bus waits for this worker
+    try:
+        while not stop.is_set() and not ring.closed:
+            seq, frame = ring.read_new(last_seq, timeout=0.1)
+            if frame is None: continue
+            last_seq = seq
+            now = time.time()
+            # Zone edits in the main window are saved to CHECKOUT_ZONE_FILE
+            if now - zone_check > 1.0:
+                zone_check = now
+                mtime = _file_mtime(CONFIG.CHECKOUT_ZONE_FILE)
+                if mtime != zone_mtime:
+                    zone_mtime, scanner.zone = mtime, load_checkout_zone()
+            scanner.quality.index = ring.control(ring.QUALITY)
+            scanner.quality.decode_index = ring.control(ring.DECODE_QUALITY)
+            if stage == 'detect':
+                if ring.control(ring.RELOAD) != reloads:
+                    reloads = ring.control(ring.RELOAD)
+                    scanner._init_model()
+                if ring.control(ring.DETECT) != detects:
+                    detects = ring.control(ring.DETECT)
+                    scanner.request_detection()
+            if not ring.is_active(seq): continue
+            timestamp = ring.stamp(seq)
+            payload = scanner.decode_barcode(frame) if stage == 'barcode' else scanner.detect_or_track(frame)
+            if not ring.is_fresh(seq):
+                results.put(('lapped', stage, seq))  # Writer reused the slot mid-stage
+                continue
+            results.put((stage, seq, timestamp, payload, drain_stage_samples(scanner.stats, seen), scanner.stats.detect_stride))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        ring.close()
+
+def recorder_worker(bus_name, stop, path, fps):
+    """Worker process: every bus frame (idle ones too) into a video for --replay"""
+    ring = SharedFrameRing(name=bus_name)
+    h, w, _ = ring.shape
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (w, h))
+    last_seq = ring.latest
+    try:
+        while not stop.is_set() and not ring.closed:
+            seq, frame = ring.read_new(last_seq, timeout=0.1)
+            if frame is None: continue
+            # Frames published while the previous write was encoding, if still in the ring
+            for missed in range(max(last_seq + 1, seq - ring.size + 2), seq):
+                view = ring.frame(missed)
+                if view is not None: writer.write(view)
+            writer.write(frame)
+            last_seq = seq
+    except KeyboardInterrupt:
+        pass
+    finally:
+        writer.release()
+        ring.close()
+        print(f"🎞️ Recorded: {path}")
+
+class ProcessPipeline(ScannerPipeline):
+    """
+    ScannerPipeline with barcode and YOLO in their own processes (no shared GIL):
+        capture → SharedFrameRing ──→ barcode worker ──┐
+                                  ──→ detect worker  ──┼→ [results] → aggregator → decide()
+                                  ──→ recorder (--record)
+                → [render_q] → _draw ◄──────────────────┘ → [output_q] → imshow (main thread)
+    Workers read frames in place; cooldowns, API calls and drawing stay here.
+    """
+    def __init__(self, camera, scanner, record=None):
+        super().__init__(camera, scanner)
+        self.ring = SharedFrameRing(camera.read().shape)
+        self.ctx = mp.get_context('spawn')  # fork + CUDA/torch threads is unsafe
+        self.results = self.ctx.Queue()
+        self.stop_event = self.ctx.Event()
+        self.record = record
+        self.processes = {}  # 'barcode' / 'detect' / 'record' → worker Process
+        self.answered = {'barcode': 0, 'detect': 0}  # stage → last seq a worker answered
+        self.skipped = {'barcode': 0, 'detect': 0}  # Active frames a worker never read or was lapped on
+        self.active_total = 0
+        self.active_upto = OrderedDict()  # seq → active frames published up to and including it
+        self.active_seen = {'barcode': 0, 'detect': 0}  # active_upto at the last answered seq (0: worker still booting)
+        self.last_active = 0
+        self.has_detector = True  # Until the detect worker reports no model
+        self.deferred_ai = None   # Lockstep: (seq, capture time, AIResults) waiting for the barcode answer
+
+    def start(self):
+        config = dict(vars(CONFIG))
+        for stage in ('barcode', 'detect'):
+            self.processes[stage] = self.ctx.Process(target=stage_worker, name=f"scanner-{stage}", daemon=True,
+                                                     args=(stage, self.ring.name, self.results, self.stop_event, config))
+        if self.record:
+            self.processes['record'] = self.ctx.Process(target=recorder_worker, name="scanner-record", daemon=True,
+                                                        args=(self.ring.name, self.stop_event, self.record, CONFIG.RECORD_FPS))
+        for p in self.processes.values():
+            p.start()
+        print(f"🚌 Frame bus {self.ring.name}: {self.ring.size} x {self.ring.shape} | workers: {', '.join(self.processes)}")
+        for target in (self._capture_loop, self._result_loop, self._render_loop):
+            t = threading.Thread(target=target, daemon=True)
+            t.start()
+            self.threads.append(t)
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+        super().stop()
+        for p in self.processes.values():
+            p.join(timeout=3.0)
+            if p.is_alive(): p.terminate()
+        self.results.close()
+        self.ring.close()
+
+    def reload_model(self):
+        self.ring.bump(SharedFrameRing.RELOAD)
+
+    @property
+    def dropped(self):
+        return {'decode': self.skipped['barcode'], 'detect': self.skipped['detect'], 'render': self.render_q.dropped,
+                'stale': self.stale}
+
+    @property
+    def idle(self):
+        if self.lockstep:
+            return self.settled >= self.camera.seq
+        return not self.render_q.items and self._answered(self.last_active)
+
+    def _answered(self, seq):
+        """Every live worker answered up to seq"""
+        stages = [s for s in ('barcode', 'detect') if s != 'detect' or self.has_detector]
+        return all(self.answered[s] >= seq or not self.processes[s].is_alive() for s in stages)
+
+    def _capture_loop(self):
+        last_seq = 0
+        while not self.stopped:
+            seq, frame = self.camera.read_new(last_seq, timeout=0.1)
+            if frame is None: continue
+            if last_seq and seq - last_seq > 1: self.scanner.stats.count_drop('camera', seq - last_seq - 1)
+            last_seq = seq
+            packet = FramePacket(seq, frame, self.camera.clock(seq))
+            active = self.scanner.gate(frame, packet.timestamp)
+            # Motion wake-up / D key set this on the local scanner - the detector lives elsewhere
+            if self.scanner.detect_requested:
+                self.scanner.detect_requested = False
+                self.ring.bump(SharedFrameRing.DETECT)
+            self.ring.set_control(SharedFrameRing.QUALITY, self.scanner.quality.index)
+            self.ring.set_control(SharedFrameRing.DECODE_QUALITY, self.scanner.quality.decode_index)
+            self.ring.publish(frame, seq, packet.timestamp, active)
+            self.active_total += bool(active)
+            self.active_upto[seq] = self.active_total
+            while len(self.active_upto) > 64 * self.ring.size: self.active_upto.popitem(last=False)
+            if active:
+                self.last_active = seq
+                if self.lockstep:
+                    with self.flight:
+                        # Worker death is not signalled → re-check is_alive() every 0.1 s
+                        while not self.stopped and not self._answered(seq): self.flight.wait(0.1)
+            self._dispatch(packet, [self.render_q] if active or seq % CONFIG.MOTION_IDLE_RENDER_EVERY == 0 else [])
+
+    def _record_samples(self, samples):
+        stats = self.scanner.stats
+        for name, values in samples.items():
+            for ms in values:
+                if name in ('decode', 'detect'): stats.time_stage(name, ms / 1000)
+                else: stats.histogram(name).add(ms)
+        if 'detect' in samples: stats.update_ai_fps()
+
+    def _count_skipped(self, stage, seq, lapped=False):
+        """Active frames published between two answers of a worker were never read by it"""
+        upto = self.active_upto.get(seq)
+        if upto is None: return
+        self.skipped[stage] += max(0, upto - self.active_seen[stage] - 1) + lapped
+        self.active_seen[stage] = upto
+
+    def _result_loop(self):
+        stats = self.scanner.stats
+        while not self.stopped:
+            try:
+                message = self.results.get(timeout=0.1)
+            except (queue.Empty, OSError, EOFError, ValueError):
+                continue
+            kind = message[0]
+            if kind == 'model':
+                with self.flight:
+                    self.has_detector, stats.model_name, stats.gpu_active, stats.gpu_name, stats.engine = message[1:]
+                    self.flight.notify_all()
+                continue
+            if kind == 'lapped':
+                self._count_skipped(message[1], message[2], lapped=True)
+                with self.flight:
+                    self.answered[message[1]] = max(self.answered[message[1]], message[2])
+                    self.flight.notify_all()
+                continue
+            _, seq, timestamp, payload, samples, stride = message
+            self._count_skipped(kind, seq)
+            self._record_samples(samples)
+            if kind == 'barcode':
+                self.scanner.mark_decoded(timestamp)
+                with self.result_lock:
+                    self.barcode_result = (seq, payload)
+                    if payload: self.barcode_hits.append(seq)
+                if payload:
+                    self.scanner.decide(payload, [], timestamp)
+                if self.deferred_ai and self.deferred_ai[0] <= seq:
+                    self._decide_ai(*self.deferred_ai)
+                    self.deferred_ai = None
+            else:
+                stats.detect_stride = stride
+                with self.result_lock:
+                    self.ai_result = (seq, payload)
+                if self.lockstep and self.answered['barcode'] < seq:
+                    self.deferred_ai = (seq, timestamp, payload)  # Barcode verdict on this frame is still coming
+                else:
+                    self._decide_ai(seq, timestamp, payload)
+            with self.flight:
+                self.answered[kind] = max(self.answered[kind], seq)
+                self.flight.notify_all()
+
+    def _decide_ai(self, seq, timestamp, payload):
+        with self.result_lock:
+            barcode_won = seq in self.barcode_hits
+        # Same frame already produced a barcode → barcode takes priority
+        if payload and not barcode_won:
+            self.scanner.decide([], payload, timestamp)
+
+# ═══════════════════════════════════════════════════════════════════════════════
+#                🛤️ MULTI-LANE - ONE MODEL, BATCHED ACROSS CAMERAS
+# ═══════════════════════════════════════════════════════════════════════════════
+@dataclass
+class DetectRequest:
+    frame: np.ndarray
+    imgsz: int
+    dets: Optional[np.ndarray] = None
+    done: bool = False
+
+class BatchedDetector:
+    """
+    One YOLO instance for every lane. Lane detect threads block in detect(); requests
+    arriving within LANE_BATCH_WAIT_MS go through the model as one batch and each lane
+    gets its own rows back - tracking, cooldowns and API state stay per lane.
+    """
+    def __init__(self, owner):
+        self.owner = owner  # SmartScanner that loaded the model
+        self.lanes: List[SmartScanner] = []
+        self.pending: List[DetectRequest] = []
+        self.cond = threading.Condition()
+        self.timer = LatencyHistogram()  # One sample per batched call (all lanes)
+        self.batches = 0
+        self.frames = 0
+        self.reload_requested = False
+        self.stopped = False
+
+    def start(self):
+        threading.Thread(target=self._loop, daemon=True).start()
+        return self
+
+    def stop(self):
+        with self.cond:
+            self.stopped = True
+            self.cond.notify_all()
+
+    def attach(self, scanner):
+        self.lanes.append(scanner)
+        if self.owner.yolo: scanner.use_detector(self)
+
+    def reload(self):
+        """R key / SIGHUP: reload the shared model between two batches"""
+        with self.cond:
+            self.reload_requested = True
+            self.cond.notify_all()
+
+    def detect(self, frame, imgsz) -> np.ndarray:
+        request = DetectRequest(frame, imgsz)
+        with self.cond:
+            self.pending.append(request)
+            self.cond.notify_all()
+            self.cond.wait_for(lambda: request.done or self.stopped)
+        return request.dets if request.dets is not None else np.empty(0, dtype=DET_DTYPE)
+
+    def _loop(self):
+        while True:
+            with self.cond:
+                self.cond.wait_for(lambda: self.pending or self.reload_requested or self.stopped)
+                if self.stopped: return
+                # A lane has at most one request in flight → wait a moment for the others
+                deadline = time.perf_counter() + CONFIG.LANE_BATCH_WAIT_MS / 1000
+                target = min(CONFIG.LANE_BATCH_MAX, len(self.lanes))
+                while self.pending and len(self.pending) < target and not self.stopped:
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0 or not self.cond.wait(remaining): break
+                batch = self.pending[:CONFIG.LANE_BATCH_MAX]
+                del self.pending[:len(batch)]
+                reload, self.reload_requested = self.reload_requested, False
+            if reload: self._reload()
+            if not batch: continue
+            t0 = time.perf_counter()
+            results = self._infer(batch)
+            self.timer.time(t0)
+            self.batches += 1
+            self.frames += len(batch)
+            with self.cond:
+                for request, dets in zip(batch, results):
+                    request.dets, request.done = dets, True
+                self.cond.notify_all()
+
+    def _reload(self):
+        self.owner._init_model()
+        for scanner in self.lanes:
+            if self.owner.yolo: scanner.use_detector(self)
+            else: scanner.yolo = scanner.detector = None
+
+    def _infer(self, batch) -> List[Optional[np.ndarray]]:
+        owner, yolo = self.owner, self.owner.yolo
+        try:
+            if isinstance(yolo, CPUDetector):
+                return yolo.detect_batch([r.frame for r in batch], CONFIG.CONFIDENCE_DISPLAY, owner.detect_classes, CONFIG.MAX_DET)
+            out = [None] * len(batch)
+            if not yolo:
+                return out
+            # Lanes on different quality levels ask for different imgsz → one call per size
+            for imgsz in sorted({r.imgsz for r in batch}):
+                idx = [i for i, r in enumerate(batch) if r.imgsz == imgsz]
+                results = yolo([batch[i].frame for i in idx], verbose=False, conf=CONFIG.CONFIDENCE_DISPLAY, imgsz=imgsz,
+                               classes=owner.detect_classes, max_det=CONFIG.MAX_DET)
+                for i, result in zip(idx, results):
+                    out[i] = to_detections(result.boxes.data.cpu().numpy())
+            return out
+        except Exception as e:
+            print(f"⚠️ Batched inference error: {e}")
+            return [None] * len(batch)
+
+@dataclass
+class Lane:
+    lane_id: str
+    camera: ThreadedCamera
+    scanner: SmartScanner
+    pipeline: ScannerPipeline
+    frame: Optional[np.ndarray] = None  # Last drawn frame, for the mosaic
+
+def parse_lanes(spec) -> List[Tuple[str, str]]:
+    """'1=http://a:8080/video,2=0' → [('1', 'http://a:8080/video'), ('2', '0')] (id defaults to position)"""
+    lanes = []
+    for i, item in enumerate(part.strip() for part in spec.split(',') if part.strip()):
+        lane, sep, src = item.partition('=')
+        lanes.append((lane.strip(), src.strip()) if sep and not lane.strip().startswith(('http', 'rtsp')) else (str(i + 1), item))
+    return lanes
+
+def lane_mosaic(lanes) -> np.ndarray:
+    """Last frame of every lane in one grid, labelled with the lane id"""
+    cols = int(np.ceil(np.sqrt(len(lanes))))
+    rows = int(np.ceil(len(lanes) / cols))
+    tw = CONFIG.FRAME_WIDTH if cols == 1 else CONFIG.FRAME_WIDTH * 2 // cols
+    th = tw * CONFIG.FRAME_HEIGHT // CONFIG.FRAME_WIDTH
+    grid = np.zeros((rows * th, cols * tw, 3), dtype=np.uint8)
+    for i, lane in enumerate(lanes):
+        y, x = (i // cols) * th, (i % cols) * tw
+        if lane.frame is not None:
+            grid[y:y+th, x:x+tw] = cv2.resize(lane.frame, (tw, th), interpolation=cv2.INTER_AREA)
+        cv2.putText(grid, f"Lane {lane.lane_id}", (x + 8, y + th - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 215, 255), 2)
+    return grid
+
+def run_lane_command(lanes, detector, name):
+    """Commands for every lane; the model and product mapping exist once"""
+    if name == 'quit': return False
+    elif name == 'reload': detector.reload()
+    elif name == 'sync': detector.owner._sync_db()
+    else:
+        for lane in lanes: run_command(lane.scanner, name)
+    return True
+
+def run_lanes(args, sources):
+    """Multi-lane service: N cameras, one pipeline per lane, one BatchedDetector"""
+    owner = SmartScanner()  # Product mapping + the only model instance
+    owner.submitter.start()
+    detector = BatchedDetector(owner).start()
+    lanes: List[Lane] = []
+    for lane_id, src in sources:
+        print(f"\n📡 Lane {lane_id}: {src}")
+        replay = os.path.exists(src) and not src.isdigit()
+        camera = open_camera(int(src) if src.isdigit() else src, replay, not args.replay_fast, args.replay_fps)
+        if camera is None:
+            print(f"❌ Lane {lane_id}: camera failed - skipped")
+            continue
+        scanner = SmartScanner(sync=False, load_model=False, lane=lane_id, submitter=owner.submitter)
+        scanner.stats.model_name = owner.stats.model_name
+        detector.attach(scanner)
+        scanner.stats.stages['capture'] = camera.grab_timer
+        scanner.stats.camera_metrics = camera.metrics
+        lanes.append(Lane(lane_id, camera, scanner, ScannerPipeline(camera, scanner).start()))
+    if not lanes:
+        detector.stop()
+        return
+    
+    commands = queue.Queue()
+    preview = MJPEGPreview()
+    server = None
+    if args.port:
+        try:
+            server = ControlServer({lane.lane_id: lane.scanner.stats for lane in lanes}, preview, commands, port=args.port).start()
+        except OSError as e:
+            print(f"⚠️ Port {args.port}: {e}")
+    install_signal_commands(commands)
+    print(f"\n🛤️ {len(lanes)} lanes, 1 model ({owner.stats.model_name}) | Q:Quit R:Reload S:Sync D:Detect M:Metrics")
+    keys = {ord('q'): 'quit', ord('r'): 'reload', ord('s'): 'sync', ord('d'): 'detect', ord('m'): 'metrics'}
+    
+    try:
+        running = True
+        while running:
+            show = not args.headless or preview.viewers > 0
+            fresh = False
+            for lane in lanes:
+                lane.pipeline.draw = show
+                output = lane.pipeline.output_q.get(timeout=0)
+                if output is not None:
+                    lane.frame, fresh = output, True
+            if fresh:
+                mosaic = lane_mosaic(lanes)
+                preview.publish(mosaic)
+                if not args.headless: cv2.imshow("Smart Retail Scanner - Lanes", mosaic)
+            if not args.headless:
+                key = cv2.waitKey(1) & 0xFF
+                if key in keys: commands.put(keys[key])
+            elif not fresh:
+                time.sleep(0.01)
+            while running and not commands.empty():
+                running = run_lane_command(lanes, detector, commands.get_nowait())
+            if all(getattr(lane.camera, 'done', False) and lane.pipeline.idle for lane in lanes):
+                break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for lane in lanes: lane.pipeline.stop()
+        detector.stop()
+        owner.submitter.flush()
+        if server: server.stop()
+        for lane in lanes: lane.camera.stop()
+        if not args.headless: cv2.destroyAllWindows()
+        if detector.batches:
+            p50 = detector.timer.percentiles((50,))[0]
+            print(f"\n🛤️ YOLO: {detector.frames} frames in {detector.batches} calls "
+                  f"({detector.frames / detector.batches:.2f} per batch, p50 {p50:.1f} ms/call)")
+        print("\n👋 Bye!")
+
+# ═══════════════════════════════════════════════════════════════════════════════
+#                        📈 METRICS - PROMETHEUS ENDPOINT
+# ═══════════════════════════════════════════════════════════════════════════════
+def prometheus_text(stats) -> str:
+    """Stats (or lane id → Stats in multi-lane mode) → Prometheus text format (latencies in seconds)"""
+    lanes = stats if isinstance(stats, dict) else {None: stats}
+    def labels(lane, **extra):
+        pairs = ([('lane', lane)] if lane is not None else []) + list(extra.items())
+        return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}" if pairs else ""
+    
+    lines = ["# HELP scanner_stage_latency_seconds Per-stage latency over the last METRICS_WINDOW samples",
+             "# TYPE scanner_stage_latency_seconds summary"]
+    for lane, st in lanes.items():
+        for name, hist in sorted(st.stages.items()):
+            pct = hist.percentiles()
+            for q, v in zip(("0.5", "0.95", "0.99"), pct or ()):
+                lines.append(f'scanner_stage_latency_seconds{labels(lane, stage=name, quantile=q)} {v / 1000:.6f}')
+            lines.append(f'scanner_stage_latency_seconds_sum{labels(lane, stage=name)} {hist.total_ms / 1000:.6f}')
+            lines.append(f'scanner_stage_latency_seconds_count{labels(lane, stage=name)} {hist.count}')
+    lines += ["# HELP scanner_dropped_frames_total Frames skipped per stage",
+              "# TYPE scanner_dropped_frames_total counter"]
+    for lane, st in lanes.items():
+        for stage, n in sorted(st.dropped_frames.items()):
+            lines.append(f'scanner_dropped_frames_total{labels(lane, stage=stage)} {n}')
+    lines.append("# TYPE scanner_api_requests_total counter")
+    lines += [f"scanner_api_requests_total{labels(lane)} {st.api_calls}" for lane, st in lanes.items()]
+    lines.append("# TYPE scanner_api_failures_total counter")
+    lines += [f"scanner_api_failures_total{labels(lane)} {st.api_failures}" for lane, st in lanes.items()]
+    gauges: Dict[str, List[str]] = {}
+    for lane, st in lanes.items():
+        for name, value in st.metrics().items():
+            if name in ('api_calls', 'api_failures') or name.startswith('stage_ms_'):
+                continue
+            gauges.setdefault(name, []).append(f"scanner_{name}{labels(lane)} {float(value):g}")
+    for name, samples in gauges.items():
+        lines += [f"# TYPE scanner_{name} gauge"] + samples
+    return "\n".join(lines) + "\n"
+
+class MJPEGPreview:
+    """Latest annotated frame as JPEG, encoded only while someone is watching"""
+    def __init__(self):
+        self.viewers = 0
+        self.jpeg = None
+        self.jpeg_id = 0
+        self.last_encode = 0.0
+        self.cond = threading.Condition()
+
+    def publish(self, frame):
+        now = time.time()
+        if not self.viewers or now - self.last_encode < 1.0 / CONFIG.PREVIEW_FPS:
+            return
+        ok, buf = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, CONFIG.PREVIEW_JPEG_QUALITY])
+        if not ok:
+            return
+        self.last_encode = now
+        with self.cond:
+            self.jpeg = buf.tobytes()
+            self.jpeg_id += 1
+            self.cond.notify_all()
+
+    def frames(self, timeout=5.0):
+        """Yields each new JPEG; counts as a viewer while iterating"""
+        with self.cond:
+            self.viewers += 1
+        try:
+            last_id = 0
+            while True:
+                with self.cond:
+                    if not self.cond.wait_for(lambda: self.jpeg_id != last_id, timeout):
+                        continue
+                    last_id, jpeg = self.jpeg_id, self.jpeg
+                yield jpeg
+        finally:
+            with self.cond:
+                self.viewers -= 1
+
+CONTROL_COMMANDS = ('reload', 'sync', 'detect', 'metrics', 'quit')
+
+class ControlServer:
+    """
+    Small HTTP server on CONTROL_HOST:CONTROL_PORT (daemon threads):
+        GET  /metrics          Prometheus text format
+        GET  /stream.mjpg      annotated preview (multipart MJPEG)
+        POST /command/<name>   reload | sync | detect | metrics | quit → commands queue
+    GETs are read-only. Commands need the X-Scanner-Token header; no CORS headers are
+    sent, so a web page on another origin cannot add it (the Flask app proxies instead).
+    """
+    def __init__(self, stats, preview, commands, host=None, port=None, token=None):
+        self.generated = not (token or CONFIG.CONTROL_TOKEN)
+        self.token = token or CONFIG.CONTROL_TOKEN or secrets.token_urlsafe(16)
+        expected = self.token.encode()
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                path = self.path.split('?')[0]
+                if path == '/metrics':
+                    self._send(200, prometheus_text(stats).encode(), "text/plain; version=0.0.4")
+                elif path == '/stream.mjpg':
+                    self._stream()
+                else:
+                    self.send_error(404)
+
+            def do_POST(self):
+                name = self.path.split('?')[0].rsplit('/', 1)[-1]
+                if not self.path.startswith('/command/') or name not in CONTROL_COMMANDS:
+                    self.send_error(404)
+                    return
+                if not hmac.compare_digest(self.headers.get('X-Scanner-Token', '').encode(), expected):
+                    self.send_error(403, "missing or wrong X-Scanner-Token")
+                    return
+                commands.put(name)
+                self._send(200, json.dumps({'status': 'ok', 'command': name}).encode(), "application/json")
+
+            def _send(self, code, body, content_type):
+                self.send_response(code)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _stream(self):
+                self.send_response(200)
+                self.send_header("Content-Type", "multipart/x-mixed-replace; boundary=frame")
+                self.send_header("Cache-Control", "no-cache")
+                self.end_headers()
+                try:
+                    for jpeg in preview.frames():
+                        self.wfile.write(b"--frame\r\nContent-Type: image/jpeg\r\n")
+                        self.wfile.write(f"Content-Length: {len(jpeg)}\r\n\r\n".encode())
+                        self.wfile.write(jpeg + b"\r\n")
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer((host or CONFIG.CONTROL_HOST, port or CONFIG.CONTROL_PORT), Handler)
+        self.httpd.daemon_threads = True
+
+    def start(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        host, port = self.httpd.server_address[:2]
+        print(f"📈 Metrics: http://{host}:{port}/metrics | Preview: http://{host}:{port}/stream.mjpg")
+        if self.generated: print(f"🔑 POST /command/<name> needs header X-Scanner-Token: {self.token}")
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+# ═══════════════════════════════════════════════════════════════════════════════
+#                     🧪 REPLAY SOURCE + BENCHMARK (NO CAMERA)
+# ═══════════════════════════════════════════════════════════════════════════════
+class FrameDirectory:
+    """Sorted .jpg/.png files read like a cv2.VideoCapture"""
+    def __init__(self, folder):
+        self.paths = sorted(p for ext in ('*.jpg', '*.jpeg', '*.png') for p in glob.glob(os.path.join(folder, ext)))
+        self.index = 0
+
+    def read(self, dst=None):
+        while self.index < len(self.paths):
+            frame = cv2.imread(self.paths[self.index])
+            self.index += 1
+            if frame is not None:
+                return True, frame
+        return False, None
+
+    def get(self, prop):
+        return 0.0  # No recorded FPS - ReplayCamera falls back to --replay-fps
+
+    def release(self):
+        pass
+
+class ReplayCamera(ThreadedCamera):
+    """
+    ThreadedCamera fed from a video file or a frame directory.
+    pace=True  → frames appear at the recorded FPS (like a live camera, may drop)
+    pace=False → next frame as soon as the previous one was taken by read_new()
+    (with PIPELINE_LOCKSTEP or --no-pipeline every frame is processed)
+    clock(seq) is virtual (seq / fps), so cooldowns and events repeat run after run.
+    """
+    def __init__(self, src, pace=True, fps=None, ring_size=None):
+        super().__init__(src, ring_size)
+        self.pace = pace
+        self.fps = fps
+        self.consumed = 0
+        self.finished = False
+
+    def start(self):
+        self.stream = FrameDirectory(self.src) if os.path.isdir(self.src) else cv2.VideoCapture(self.src)
+        self.fps = self.fps or self.stream.get(cv2.CAP_PROP_FPS) or 30.0
+        threading.Thread(target=self.update, daemon=True).start()
+        return self
+
+    def update(self):
+        next_time = time.perf_counter()
+        while not self.stopped:
+            if not self.pace:
+                with self.cond:
+                    self.cond.wait_for(lambda: self.consumed >= self.seq or self.stopped, 0.1)
+                    if self.consumed < self.seq: continue
+            if not self._grab():
+                break
+            if self.pace:
+                next_time += 1.0 / self.fps
+                time.sleep(max(0.0, next_time - time.perf_counter()))
+        with self.cond:
+            self.finished = True
+            self.cond.notify_all()
+
+    def read_new(self, after_seq=0, timeout=1.0):
+        seq, frame = super().read_new(after_seq, timeout)
+        if frame is not None:
+            with self.cond:
+                self.consumed = max(self.consumed, seq)
+                self.cond.notify_all()
+        return seq, frame
+
+    def clock(self, seq):
+        return seq / self.fps
+
+    @property
+    def done(self):
+        """Source exhausted and its last frame handed out"""
+        return self.finished and self.consumed >= self.seq
+
+class StubScanAPI:
+    """Local stand-in for app.py: records /api/scan events (t = camera clock of the frame), empty product mapping"""
+    def __init__(self):
+        self.events = []
+        events = self.events
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # Keep-alive like the Flask server
+            disable_nagle_algorithm = True  # Headers and body are separate writes
+
+            def do_GET(self):
+                self._json({})
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+                batch = body.get('events') if self.path.endswith('/batch') else [body]
+                for scan in batch:
+                    event = {'t': round(scan.get('ts', 0.0), 3), 'code': scan.get('code')}
+                    if 'lane' in scan: event['lane'] = scan['lane']
+                    events.append(event)
+                self._json({'status': 'success', 'results': [{'status': 'success'} for _ in batch]})
+
+            def _json(self, data):
+                payload = json.dumps(data).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        stub = self
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+
+    def start(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+def benchmark_report(scanner, camera, stub, elapsed, pipeline=None) -> dict:
+    stats = scanner.stats
+    processed = stats.histogram('decode').count
+    counts = {}
+    for event in stub.events:
+        counts[event['code']] = counts.get(event['code'], 0) + 1
+    return {
+        'source': str(camera.src), 'pace': 'recorded' if camera.pace else ('lockstep' if CONFIG.PIPELINE_LOCKSTEP else 'fast'),
+        'pipeline': pipeline is not None, 'model': stats.model_name, 'engine': stats.engine or stats.gpu_name,
+        'frames': camera.seq, 'processed': processed, 'elapsed_s': round(elapsed, 3),
+        'throughput_fps': round(processed / elapsed, 2) if elapsed > 0 else 0.0,
+        'stages_ms': {name: dict(zip(('p50', 'p95', 'p99'), [round(v, 3) for v in hist.percentiles()]), count=hist.count)
+                      for name, hist in sorted(stats.stages.items()) if hist.count},
+        'dropped': dict(stats.dropped_frames),
+        'scans': {'barcode': stats.barcode_count, 'ai': stats.ai_count, 'api_failures': stats.api_failures},
+        'event_counts': counts,
+        'events': stub.events,
+    }
+
+def print_benchmark(report):
+    print(f"\n📊 BENCHMARK - {report['source']} ({report['pace']}, {'pipeline' if report['pipeline'] else 'sequential'})")
+    print(f"   Model: {report['model']} {report['engine']}")
+    print(f"   Frames: {report['processed']}/{report['frames']} in {report['elapsed_s']:.2f}s → {report['throughput_fps']:.1f} fps")
+    print(f"   {'stage':<10}{'p50':>8}{'p95':>8}{'p99':>8}{'count':>8}")
+    for name, v in report['stages_ms'].items():
+        print(f"   {name:<10}{v['p50']:>8.2f}{v['p95']:>8.2f}{v['p99']:>8.2f}{v['count']:>8}")
+    print(f"   Dropped: {report['dropped'] or 0} | Scans: {report['scans']}")
+    for code, n in sorted(report['event_counts'].items()):
+        print(f"   📦 {code} x{n}")
+
+class ZoneEditor:
+    """
+    Mouse editing of the checkout zone on the scanner window:
+    drag on empty space = new rectangle, drag a corner = move that vertex,
+    right click = back to full frame.
+    """
+    GRAB_RADIUS = 12
+
+    def __init__(self, scanner):
+        self.scanner = scanner
+        self.start = None
+        self.vertex = None
+        self.points = None
+        self.cursor = None
+
+    def on_mouse(self, event, x, y, flags, param):
+        zone = self.scanner.zone
+        if event == cv2.EVENT_LBUTTONDOWN:
+            self.cursor = (x, y)
+            if zone is not None:
+                dist = np.hypot(zone.points[:, 0] - x, zone.points[:, 1] - y)
+                if dist.min() <= self.GRAB_RADIUS:
+                    self.vertex = int(dist.argmin())
+                    self.points = zone.points.tolist()
+                    return
+            self.start = (x, y)
+        elif event == cv2.EVENT_MOUSEMOVE and flags & cv2.EVENT_FLAG_LBUTTON:
+            self.cursor = (x, y)
+            if self.vertex is not None:
+                self.points[self.vertex] = [x, y]
+        elif event == cv2.EVENT_LBUTTONUP:
+            if self.vertex is not None:
+                self.scanner.set_zone(self.points)
+            elif self.start and abs(x - self.start[0]) > 20 and abs(y - self.start[1]) > 20:
+                self.scanner.set_zone(CheckoutZone.from_rect(*self.start, x, y).points.tolist())
+            self.start = self.vertex = self.points = self.cursor = None
+        elif event == cv2.EVENT_RBUTTONDOWN:
+            self.scanner.set_zone(None)
+
+    def draw(self, frame):
+        """Preview while dragging (drawn on the displayed copy only)"""
+        if self.vertex is not None:
+            cv2.polylines(frame, [np.array(self.points, dtype=np.int32)], True, (0, 255, 255), 2)
+        elif self.start and self.cursor:
+            cv2.rectangle(frame, self.start, self.cursor, (0, 255, 255), 2)
+
+def run_command(scanner, name, pipeline=None):
+    """Keyboard / HTTP / signal command → False when the scanner should quit"""
+    if name == 'quit': return False
+    elif name == 'reload' and pipeline: pipeline.reload_model()  # Never swap the model under a running detect stage
+    elif name == 'reload': scanner._init_model()
+    elif name == 'sync': scanner._sync_db()
+    elif name == 'detect': scanner.request_detection()
+    elif name == 'metrics': scanner.show_metrics = not scanner.show_metrics
+    return True
+
+def install_signal_commands(commands):
+    """POSIX signals as key equivalents for headless services (no-op where missing)"""
+    for sig_name, name in (('SIGHUP', 'reload'), ('SIGUSR1', 'sync'), ('SIGUSR2', 'detect'), ('SIGTERM', 'quit')):
+        sig = getattr(signal, sig_name, None)
+        if sig is not None:
+            signal.signal(sig, lambda signum, frame, name=name: commands.put(name))
 
 def scan_available_cameras(max_cameras=5):
     """Scan dan tampilkan daftar kamera yang tersedia"""
@@ -418,6 +3288,27 @@ def scan_available_cameras(max_cameras=5):
     print(f"\n📹 Ditemukan {len(available)} kamera")
     return available
 
+def open_camera(src, replay=False, pace=True, fps=None):
+    """Replay source, MJPEGCamera for http(s) URLs or cv2.VideoCapture → started camera, None if no frame"""
+    if replay:
+        camera = ReplayCamera(src, pace=pace, fps=fps).start()
+        with camera.cond:
+            camera.cond.wait_for(lambda: camera.seq or camera.finished, 5.0)
+    elif CONFIG.MJPEG_READER and isinstance(src, str) and src.startswith(('http://', 'https://')):
+        camera = MJPEGCamera(src).start()
+        if camera.read() is None and camera.failed:
+            camera.stop()
+            camera = ThreadedCamera(src).start()
+            time.sleep(2)
+    else:
+        camera = ThreadedCamera(src).start()
+        time.sleep(2)
+    
+    if camera.read() is None:
+        camera.stop()
+        return None
+    return camera
+
 def main():
     import argparse
     
@@ -425,9 +3316,54 @@ def main():
     parser.add_argument('--mode', choices=['wifi', 'usb', 'webcam', 'custom'], 
                         help='Camera mode: wifi, usb, webcam, or custom')
     parser.add_argument('--url', help='Custom camera URL (for custom mode)')
+    parser.add_argument('--no-pipeline', action='store_true',
+                        help='Run all stages sequentially on the main thread')
+    parser.add_argument('--lanes', default=",".join(f"{lane}={src}" for lane, src in CONFIG.LANES),
+                        help='Multi-lane: "1=http://.../video,2=0,3=rekaman.mp4" - one process, one shared YOLO')
+    parser.add_argument('--multiprocess', action='store_true',
+                        help='Barcode + YOLO in worker processes reading a shared-memory frame bus')
+    parser.add_argument('--record', help='With --multiprocess: a recorder process writes every frame to this video')
+    parser.add_argument('--port', type=int, default=None,
+                        help=f'HTTP port for /metrics, /stream.mjpg and /command/<name> (default {CONFIG.CONTROL_PORT}, 0 = off)')
+    parser.add_argument('--headless', action='store_true',
+                        help='No window: control via HTTP or signals, preview via /stream.mjpg')
+    parser.add_argument('--barcode-backend', choices=sorted(BARCODE_BACKENDS), default=CONFIG.BARCODE_BACKEND,
+                        help='Barcode decoder (falls back to the first installed one: zxing → opencv → pyzbar)')
+    parser.add_argument('--replay', help='Video file or frame directory instead of a camera')
+    parser.add_argument('--replay-fast', action='store_true',
+                        help='Replay as fast as the scanner takes frames instead of at recorded pace (lockstep: every stage sees every frame)')
+    parser.add_argument('--no-lockstep', action='store_true',
+                        help='With --replay-fast: let pipeline stages drop frames like a live camera (throughput, not repeatability)')
+    parser.add_argument('--replay-fps', type=float, help='Pace for frame directories (default 30)')
+    parser.add_argument('--benchmark', action='store_true',
+                        help='Headless replay against a stub /api/scan, then print a report')
+    parser.add_argument('--benchmark-out', help='Also write the benchmark report as JSON')
     args = parser.parse_args()
+    try:
+        CONFIG.BARCODE_BACKEND = resolve_barcode_backend(args.barcode_backend)
+    except RuntimeError as e:
+        parser.error(str(e))
+    if args.benchmark:
+        if not args.replay:
+            parser.error("--benchmark needs --replay")
+        args.headless = True
+        CONFIG.QUALITY_CONTROL = False  # Same quality every run so versions can be compared
+        CONFIG.SPOOL_FILE = ":memory:"  # Never replay real spooled scans into the stub
+    if args.replay_fast and not args.no_lockstep:
+        CONFIG.PIPELINE_LOCKSTEP = True
+    if args.port is None:
+        args.port = 0 if args.benchmark else CONFIG.CONTROL_PORT
+    if args.lanes and (args.benchmark or args.multiprocess or args.no_pipeline or args.replay):
+        parser.error("--lanes cannot be combined with --benchmark, --multiprocess, --no-pipeline or --replay")
+    if args.multiprocess and args.no_pipeline:
+        parser.error("--multiprocess and --no-pipeline are exclusive")
+    if args.record and not args.multiprocess:
+        parser.error("--record needs --multiprocess")
+    if args.headless and not (args.mode or args.replay or args.lanes):
+        parser.error("--headless needs --mode or --replay (no interactive camera menu)")
     
-    ai_status = "✅ ENABLED" if AI_AVAILABLE else "❌ DISABLED (Barcode only)"
+    runtime = cpu_runtime()
+    ai_status = "✅ ENABLED" if AI_AVAILABLE else (f"✅ CPU ({runtime})" if runtime else "❌ DISABLED (Barcode only)")
     gpu_text = f"{GPU_INFO['name']} ({GPU_INFO['memory']}GB)" if GPU_INFO['available'] else "Not Available"
     
     print(f"""
@@ -439,8 +3375,14 @@ def main():
 ║  📦 Barcode    : ✅ ENABLED                                                  ║
 ╚══════════════════════════════════════════════════════════════════════════════╝""")
     
+    if args.lanes:
+        run_lanes(args, parse_lanes(args.lanes))
+        return
+    
     # If mode is provided via command line, use it directly
-    if args.mode:
+    if args.replay:
+        url = args.replay
+    elif args.mode:
         print(f"\n📷 Mode: {args.mode.upper()}")
         if args.mode == 'wifi':
             url = CONFIG.IP_MODE_WIFI
@@ -505,35 +3447,92 @@ def main():
 
     
     print(f"\n📡 Connecting to: {url}")
-    camera = ThreadedCamera(url).start()
-    time.sleep(2)
-    
-    if camera.read() is None:
+    camera = open_camera(url, bool(args.replay), not args.replay_fast, args.replay_fps)
+    if camera is None:
         print("❌ Camera failed!")
-        camera.stop()
         return
     
     print("✅ Camera OK!")
-    scanner = SmartScanner()
+    stub = None
+    if args.benchmark:
+        stub = StubScanAPI().start()
+        CONFIG.API_URL, CONFIG.SYNC_URL = f"{stub.url}/api/scan", f"{stub.url}/api/product_mapping"
+        CONFIG.API_BATCH_URL = f"{stub.url}/api/scan/batch"
+    scanner = SmartScanner(load_model=not args.multiprocess)  # --multiprocess: model loads in the detect worker
+    scanner.submitter.start()
+    scanner.stats.stages['capture'] = camera.grab_timer
+    scanner.stats.camera_metrics = camera.metrics
+    commands = queue.Queue()
+    preview = MJPEGPreview()
+    server = None
+    if args.port:
+        try:
+            server = ControlServer(scanner.stats, preview, commands, port=args.port).start()
+        except OSError as e:
+            print(f"⚠️ Port {args.port}: {e}")
+    install_signal_commands(commands)
     
-    print("\n🎮 Q:Quit R:Reload S:Sync")
+    if args.headless:
+        print("\n🖥️ Headless: SIGHUP=Reload SIGUSR1=Sync SIGUSR2=Detect SIGTERM=Quit (or POST /command/<name>)")
+    else:
+        print("\n🎮 Q:Quit R:Reload S:Sync D:Detect M:Metrics")
+    
+    if args.multiprocess:
+        pipeline = ProcessPipeline(camera, scanner, record=args.record).start()
+    else:
+        pipeline = None if args.no_pipeline else ScannerPipeline(camera, scanner).start()
+    last_seq = 0
+    editor = None
+    if not args.headless:
+        editor = ZoneEditor(scanner)
+        cv2.namedWindow("Smart Retail Scanner")
+        cv2.setMouseCallback("Smart Retail Scanner", editor.on_mouse)
+    keys = {ord('q'): 'quit', ord('r'): 'reload', ord('s'): 'sync', ord('d'): 'detect', ord('m'): 'metrics'}
+    started = time.perf_counter()
     
     try:
-        while True:
-            frame = camera.read()
-            if frame is None: continue
-            
-            frame = cv2.resize(frame, (CONFIG.FRAME_WIDTH, CONFIG.FRAME_HEIGHT))
-            output = scanner.process(frame)
-            cv2.imshow("Smart Retail Scanner", output)
+        running = True
+        while running:
+            if pipeline:
+                pipeline.draw = editor is not None or args.benchmark or preview.viewers > 0
+                output = pipeline.output_q.get(timeout=0.1)
+            else:
+                seq, frame = camera.read_new(last_seq, timeout=0.1)
+                if last_seq and seq - last_seq > 1: scanner.stats.count_drop('camera', seq - last_seq - 1)
+                last_seq = seq
+                output = scanner.process(frame.copy(), last_seq, camera.gray(last_seq), camera.clock(last_seq)) if frame is not None else None
+            if output is not None:
+                preview.publish(output)
+                if editor:
+                    editor.draw(output)
+                    t0 = time.perf_counter()
+                    cv2.imshow("Smart Retail Scanner", output)
+                    scanner.stats.histogram('imshow').time(t0)
             
-            key = cv2.waitKey(1) & 0xFF
-            if key == ord('q'): break
-            elif key == ord('r'): scanner._init_model()
-            elif key == ord('s'): scanner._sync_db()
+            if editor:
+                key = cv2.waitKey(1) & 0xFF
+                if key in keys: commands.put(keys[key])
+            while running and not commands.empty():
+                running = run_command(scanner, commands.get_nowait(), pipeline)
+            if args.replay and camera.done and (pipeline.idle if pipeline else output is None):
+                break
+    except KeyboardInterrupt:
+        pass
     finally:
+        elapsed = time.perf_counter() - started
+        if pipeline: pipeline.stop()
+        if server: server.stop()
+        scanner.submitter.flush()  # Scans still queued for /api/scan
+        if stub:
+            report = benchmark_report(scanner, camera, stub, elapsed, pipeline)
+            print_benchmark(report)
+            if args.benchmark_out:
+                with open(args.benchmark_out, 'w') as f:
+                    json.dump(report, f, indent=2)
+                print(f"   💾 {args.benchmark_out}")
+            stub.stop()
         camera.stop()
-        cv2.destroyAllWindows()
+        if editor: cv2.destroyAllWindows()
         print("\n👋 Bye!")
 
 if __name__ == "__main__":